@@ -0,0 +1,179 @@
+"""
+语义回答缓存：相似问题 + 相同画像状态 + 相同知识库代次时直接复用回答
+
+很多学员问的是几乎相同的问题（"Java多线程学不懂怎么办"），画像相近的用户得到的推荐也相同，
+但每次都要完整跑一遍多轮LLM推理。缓存按 (画像指纹, 知识库代次) 分组，组内比较查询向量的
+余弦相似度，超过阈值即命中。画像中的课程或学习状态变化、知识库更新后，对应的缓存自然不再命中。
+
+使用示例：
+    from agent.answer_cache import SemanticAnswerCache
+    
+    cache = SemanticAnswerCache()
+    answer = cache.lookup(query_embedding, key)
+    if answer is None:
+        answer = await run_agent()
+        cache.store(query, query_embedding, key, answer)
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from loguru import logger
+from config import settings
+from metrics import ANSWER_CACHE
+
+
+class SemanticAnswerCache:
+    """语义回答缓存（进程内）"""
+    
+    def __init__(
+        self,
+        similarity_threshold: Optional[float] = None,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None
+    ):
+        """
+        初始化缓存
+        
+        Args:
+            similarity_threshold: 命中所需的最小余弦相似度，默认使用配置
+            ttl_seconds: 缓存条目有效期（秒），默认使用配置
+            max_entries: 最多保存的条目数，默认使用配置
+            max_bytes: 缓存占用内存上限（字节，按向量和文本长度估算），默认使用配置
+        """
+        self.similarity_threshold = (
+            settings.answer_cache_similarity_threshold if similarity_threshold is None else similarity_threshold
+        )
+        self.ttl_seconds = settings.answer_cache_ttl_seconds if ttl_seconds is None else ttl_seconds
+        self.max_entries = settings.answer_cache_max_entries if max_entries is None else max_entries
+        self.max_bytes = settings.answer_cache_max_bytes if max_bytes is None else max_bytes
+        
+        # 分组键 -> 条目列表；条目按写入顺序记录在 _order 中，用于按LRU淘汰
+        self._groups: Dict[Tuple, List[Dict]] = {}
+        self._order: "OrderedDict[int, Dict]" = OrderedDict()
+        self._next_id = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            "lookups": 0,
+            "hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+    
+    def lookup(self, query_embedding: Sequence[float], key: Tuple) -> Optional[str]:
+        """
+        查找相似问题的缓存回答
+        
+        Args:
+            query_embedding: 查询向量
+            key: 分组键（画像指纹, 知识库代次）
+        
+        Returns:
+            缓存的回答，未命中时返回None
+        """
+        vector = self._normalize(query_embedding)
+        now = time.time()
+        with self._lock:
+            self.stats["lookups"] += 1
+            best, best_score = None, self.similarity_threshold
+            for entry in self._groups.get(key, []):
+                if now - entry["created_at"] > self.ttl_seconds:
+                    continue
+                score = float(np.dot(entry["vector"], vector))
+                if score >= best_score:
+                    best, best_score = entry, score
+            if best is None:
+                self.stats["misses"] += 1
+                ANSWER_CACHE.labels(result="miss").inc()
+                return None
+            self.stats["hits"] += 1
+            ANSWER_CACHE.labels(result="hit").inc()
+            self._order.move_to_end(best["id"])
+        logger.info(f"命中回答缓存: 相似度 {best_score:.3f}，原问题: {best['query']}")
+        return best["answer"]
+    
+    def store(self, query: str, query_embedding: Sequence[float], key: Tuple, answer: str):
+        """
+        写入缓存
+        
+        Args:
+            query: 查询文本
+            query_embedding: 查询向量
+            key: 分组键（画像指纹, 知识库代次）
+            answer: 回答
+        """
+        vector = self._normalize(query_embedding)
+        size = vector.nbytes + 2 * (len(query) + len(answer))
+        with self._lock:
+            entry = {
+                "id": self._next_id,
+                "key": key,
+                "query": query,
+                "vector": vector,
+                "answer": answer,
+                "created_at": time.time(),
+                "size": size,
+            }
+            self._next_id += 1
+            self._groups.setdefault(key, []).append(entry)
+            self._order[entry["id"]] = entry
+            self._bytes += size
+            self.stats["stores"] += 1
+            self._evict()
+    
+    def record_bypass(self):
+        """记录一次跳过缓存的请求"""
+        with self._lock:
+            self.stats["bypassed"] += 1
+        ANSWER_CACHE.labels(result="bypass").inc()
+    
+    def snapshot(self) -> Dict:
+        """获取统计信息（含命中率和占用）"""
+        with self._lock:
+            lookups = self.stats["lookups"]
+            return {
+                **self.stats,
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": len(self._order),
+                "bytes": self._bytes,
+            }
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._groups.clear()
+            self._order.clear()
+            self._bytes = 0
+    
+    def _evict(self):
+        """淘汰过期条目，以及超出条目数或内存上限时最久未使用的条目"""
+        now = time.time()
+        while self._order:
+            entry = next(iter(self._order.values()))
+            expired = now - entry["created_at"] > self.ttl_seconds
+            if not expired and len(self._order) <= self.max_entries and self._bytes <= self.max_bytes:
+                break
+            self._remove(entry)
+            self.stats["evictions"] += 1
+    
+    def _remove(self, entry: Dict):
+        """删除单个条目"""
+        self._order.pop(entry["id"], None)
+        group = [item for item in self._groups.get(entry["key"], []) if item["id"] != entry["id"]]
+        self._groups[entry["key"]] = group
+        if not group:
+            # 知识库代次或画像变化后旧分组不再被访问，条目删完时一起删除
+            self._groups.pop(entry["key"], None)
+        self._bytes -= entry["size"]
+    
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> np.ndarray:
+        """归一化向量，点积即余弦相似度"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -1,15 +1,54 @@
 """
 LangGraph Agent编排：实现智能对话流程
 """
-from typing import TypedDict, Annotated, Sequence
+import asyncio
+import contextvars
+import time
+import uuid
+from typing import TypedDict, Annotated, Sequence, Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import (
+    BaseMessage, HumanMessage, AIMessage, SystemMessage, ToolMessage, message_chunk_to_message
+)
 from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import ToolNode
 from langgraph.graph.message import add_messages
 from loguru import logger
 from config import settings
+from metrics import (
+    AGENT_LLM_ROUND_TRIPS, AGENT_REQUEST_SECONDS, LLM_SECONDS, LLM_TOKENS, TOOL_SECONDS, TOOL_SERIALIZE_SECONDS, timed
+)
+from tracing import bind, span
 from agent.tools import MCPTools
+from agent.serialization import ToolResultSerializer, estimate_tokens
+from agent.session import SessionStore
+from agent.answer_cache import SemanticAnswerCache
+from agent.intent import IntentRouter, INTENT_RECOMMEND
+from agent.llm_governor import LLMGovernor, llm_priority
+from services.course_store import content_hash
+
+
+# 流式输出时的事件队列；非流式调用时为None，节点不产生事件
+_event_queue: contextvars.ContextVar[Optional[asyncio.Queue]] = contextvars.ContextVar("agent_event_queue", default=None)
+
+# 本次请求的LLM往返次数（单元素列表，图中各节点共用同一个计数器）；请求之外的调用（如摘要）为None
+_llm_round_trips: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar("agent_llm_round_trips", default=None)
+
+# 本次回答是否仍可写入回答缓存（单元素列表）；不使用缓存的请求为None。可缓存的请求只向LLM提供画像指纹
+# 包含的字段（课程和学习状态），调用了返回其他用户数据的工具后置为False，回答不再写入缓存
+_answer_cacheable: contextvars.ContextVar[Optional[List[bool]]] = contextvars.ContextVar(
+    "agent_answer_cacheable", default=None
+)
+
+# 返回画像指纹之外的用户数据（学习进度、学习时长等）的工具
+_USER_DETAIL_TOOLS = {"get_user_purchased_courses", "get_user_learning_records"}
+
+
+def _emit(event: str, data: Dict):
+    """向当前流式调用的事件队列写入事件（非流式调用时忽略）"""
+    queue = _event_queue.get()
+    if queue is not None:
+        queue.put_nowait({"event": event, "data": data})
 
 
 class AgentState(TypedDict):
@@ -17,6 +56,12 @@ class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], add_messages]
     user_id: int
     context: dict
+    tool_tokens: int  # 本次对话中工具结果已使用的token数
+    summary: str  # 会话中更早轮次的摘要
+    steps: int  # 已执行的Agent推理步数（LLM调用次数）
+    tool_calls: int  # 已执行的工具调用次数
+    deadline: float  # 整次请求的截止时间（time.monotonic()）
+    limit_hit: Optional[str]  # 触发的限制：max_steps / max_tool_calls / deadline
 
 
 class CourseRecommendationAgent:
@@ -28,32 +73,66 @@ class CourseRecommendationAgent:
         self.tools = MCPTools()
         
         # 初始化LLM
-        self.llm = ChatOpenAI(
-            model=settings.llm_model,
-            temperature=0.7,
-            api_key=settings.openai_api_key,
-            base_url=settings.openai_base_url
-        )
+        # 限流和临时错误由调度器统一退避重试，客户端自身不再重试，避免重试风暴
+        # 配置了路由模型时分为两级：路由模型决定调用哪些工具，回答模型生成最终回答
+        self.answer_model = settings.llm_answer_model or settings.llm_model
+        self.llm = self._create_llm(self.answer_model)
+        router_model = settings.llm_router_model
+        self.router_llm = self._create_llm(router_model) if router_model and router_model != self.answer_model else None
+        self.governor = LLMGovernor()
+        self.tier_stats = {
+            "router": {"model": router_model if self.router_llm else None, "calls": 0, "total_ms": 0.0,
+                       "prompt_tokens": 0, "completion_tokens": 0},
+            "answer": {"model": self.answer_model, "calls": 0, "total_ms": 0.0,
+                       "prompt_tokens": 0, "completion_tokens": 0},
+            "handoffs": 0,  # 路由模型决定回答，交给回答模型
+            "escalations": 0,  # 路由模型的工具调用校验失败或输出被提前截断，改由回答模型重新决定
+        }
         
-        # 创建LangChain工具
+        # 创建LangChain工具和按名称分发的工具处理函数
         self.langchain_tools = self._create_tools()
+        self.tool_handlers = self._create_tool_handlers()
+        self.serializer = ToolResultSerializer()
+        
+        # 多轮会话存储；会话键 -> 进行中的后台摘要任务
+        self.sessions = SessionStore()
+        self._summary_tasks: Dict[str, asyncio.Task] = {}
+        
+        # 语义回答缓存
+        self.answer_cache = SemanticAnswerCache() if settings.answer_cache_enabled else None
+        
+        # 意图路由：常见推荐问题走快速路径
+        self.intent_router = IntentRouter()
+        self.route_stats = {"requests": 0, "fast_path": 0, "fast_path_fallback": 0}
         
         # 绑定工具到LLM
         self.llm_with_tools = self.llm.bind_tools(self.langchain_tools)
+        self.router_llm_with_tools = self.router_llm.bind_tools(self.langchain_tools) if self.router_llm else None
         
         # 构建图
         self.graph = self._build_graph()
     
+    @staticmethod
+    def _create_llm(model: str) -> ChatOpenAI:
+        """创建LLM客户端"""
+        return ChatOpenAI(
+            model=model,
+            temperature=0.7,
+            api_key=settings.openai_api_key,
+            base_url=settings.openai_base_url,
+            max_retries=0
+        )
+    
     def _create_tools(self):
         """创建工具列表"""
         from langchain_core.tools import StructuredTool
         from pydantic import BaseModel, Field
-        from typing import Optional
+        from typing import List, Optional
         
         # 定义工具函数
-        async def get_user_learning_profile(user_id: int):
+        async def get_user_learning_profile(user_id: int, raw: bool = False):
             """获取用户学习画像"""
-            return await self.tools.get_user_learning_profile(user_id)
+            return await self.tools.get_user_learning_profile(user_id, raw)
         
         async def get_user_purchased_courses(user_id: int):
             """获取用户购买的课程"""
@@ -63,16 +142,37 @@ class CourseRecommendationAgent:
             """获取用户学习记录"""
             return await self.tools.get_user_learning_records(user_id, course_id)
         
-        async def search_courses(query: str, top_k: int = 5):
+        async def search_courses(query: str, top_k: int = 5, user_id: Optional[int] = None):
             """在课程知识库中搜索相关课程"""
-            return await self.tools.search_courses(query, top_k)
+            return await self.tools.search_courses(query, top_k, user_id)
+        
+        async def get_course_details(course_ids: List[int]):
+            """批量获取课程详情"""
+            return await self.tools.get_course_details(course_ids)
+        
+        async def get_recommended_candidates(user_id: int, top_k: int = 10):
+            """读取预计算的候选课程"""
+            return await self.tools.get_recommended_candidates(user_id, top_k)
+        
+        async def similar_courses(course_ids: List[int], k: int = 5, user_id: Optional[int] = None):
+            """查询相似课程"""
+            return await self.tools.similar_courses(course_ids, k, user_id)
+        
+        async def browse_category(category: Optional[str] = None, limit: int = 20):
+            """浏览课程分类"""
+            return await self.tools.browse_category(category, limit)
+        
+        async def learning_path(topic: str, user_id: Optional[int] = None, per_stage: int = 3):
+            """生成学习路径"""
+            return await self.tools.learning_path(topic, user_id, per_stage)
         
         # 创建工具
         tools = [
             StructuredTool.from_function(
                 func=get_user_learning_profile,
                 name="get_user_learning_profile",
-                description="获取用户的学习画像，包括学习时长、学习习惯、学习进度等信息"
+                description="获取用户的学习画像摘要，包括各状态课程数、学习进度、近期活跃度、主要分类和停滞课程；"
+                            "raw=true 时返回完整的原始课表数据（仅在摘要不够用时使用）"
             ),
             StructuredTool.from_function(
                 func=get_user_purchased_courses,
@@ -87,12 +187,90 @@ class CourseRecommendationAgent:
             StructuredTool.from_function(
                 func=search_courses,
                 name="search_courses",
-                description="在课程知识库中搜索相关课程，用于推荐和匹配"
+                description="在课程知识库中搜索相关课程，用于推荐和匹配；结果只包含与查询相关的摘录，"
+                            "需要完整的介绍或大纲时再调用 get_course_details；推荐时传入 user_id 以排除用户已购买的课程"
+            ),
+            StructuredTool.from_function(
+                func=get_course_details,
+                name="get_course_details",
+                description="批量获取课程详情（课程介绍、适用人群、大纲等），优先读取本地缓存"
+            ),
+            StructuredTool.from_function(
+                func=get_recommended_candidates,
+                name="get_recommended_candidates",
+                description="读取为用户离线预计算的候选课程（与已学课程最相似、且不在课表中的课程，按相似度排序）；"
+                            "没有结果时再用 search_courses 检索"
+            ),
+            StructuredTool.from_function(
+                func=similar_courses,
+                name="similar_courses",
+                description="查询与指定课程最相似的课程，适合“学完某门课下一步学什么”；"
+                            "course_ids 可取自学习画像中已学完或学习中的课程，传入 user_id 以排除已购买的课程"
+            ),
+            StructuredTool.from_function(
+                func=browse_category,
+                name="browse_category",
+                description="浏览课程分类树，返回子分类（含课程数）和该分类下按难度排序的课程；"
+                            "category 为空时返回顶级分类"
+            ),
+            StructuredTool.from_function(
+                func=learning_path,
+                name="learning_path",
+                description="生成某个方向的学习路径，按入门、基础、进阶、高级分阶段列出课程，适合“某方向从入门到进阶怎么学”；"
+                            "传入 user_id 以标记用户已购买的课程"
             )
         ]
         
         return tools
     
+    def _create_tool_handlers(self) -> Dict[str, Callable[[Dict], Awaitable]]:
+        """
+        创建工具名称到处理函数的注册表
+        
+        Returns:
+            工具名称 -> 处理函数（接收LLM给出的参数字典）
+        """
+        return {
+            "get_user_learning_profile": lambda args: self.tools.get_user_learning_profile(
+                args.get("user_id"),
+                args.get("raw", False),
+                courses_only=_answer_cacheable.get() is not None
+            ),
+            "get_user_purchased_courses": lambda args: self.tools.get_user_purchased_courses(
+                args.get("user_id")
+            ),
+            "get_user_learning_records": lambda args: self.tools.get_user_learning_records(
+                args.get("user_id"),
+                args.get("course_id")
+            ),
+            "search_courses": lambda args: self.tools.search_courses(
+                args.get("query"),
+                args.get("top_k", 5),
+                args.get("user_id")
+            ),
+            "get_course_details": lambda args: self.tools.get_course_details(
+                args.get("course_ids", [])
+            ),
+            "get_recommended_candidates": lambda args: self.tools.get_recommended_candidates(
+                args.get("user_id"),
+                args.get("top_k", 10)
+            ),
+            "similar_courses": lambda args: self.tools.similar_courses(
+                args.get("course_ids", []),
+                args.get("k", 5),
+                args.get("user_id")
+            ),
+            "browse_category": lambda args: self.tools.browse_category(
+                args.get("category"),
+                args.get("limit", 20)
+            ),
+            "learning_path": lambda args: self.tools.learning_path(
+                args.get("topic"),
+                args.get("user_id"),
+                args.get("per_stage", 3)
+            ),
+        }
+    
     def _build_graph(self) -> StateGraph:
         """构建LangGraph"""
         workflow = StateGraph(AgentState)
@@ -100,6 +278,7 @@ class CourseRecommendationAgent:
         # 添加节点
         workflow.add_node("agent", self._agent_node)
         workflow.add_node("tools", self._tools_node)
+        workflow.add_node("finalize", self._finalize_node)
         
         # 设置入口点
         workflow.set_entry_point("agent")
@@ -110,31 +289,214 @@ class CourseRecommendationAgent:
             self._should_continue,
             {
                 "continue": "tools",
+                "finalize": "finalize",
                 "end": END
             }
         )
         
-        # 工具执行后返回agent
+        # 工具执行后返回agent；达到限制时用已有信息生成最终回答
         workflow.add_edge("tools", "agent")
+        workflow.add_edge("finalize", END)
         
         return workflow.compile()
     
     async def _agent_node(self, state: AgentState) -> AgentState:
         """Agent节点：LLM推理"""
+        with span("agent.node", step=state.get("steps", 0) + 1):
+            return await self._agent_step(state)
+    
+    async def _agent_step(self, state: AgentState) -> AgentState:
+        """一次Agent推理（先经路由模型，必要时交给回答模型）"""
         messages = state["messages"]
         user_id = state.get("user_id", 0)
         context = state.get("context", {})
         
         # 构建系统提示
-        system_prompt = self._build_system_prompt(user_id, context)
+        system_prompt = self._build_system_prompt(user_id, context, state.get("summary", ""))
         system_message = SystemMessage(content=system_prompt)
         
-        # 调用LLM
-        response = await self.llm_with_tools.ainvoke([system_message] + list(messages))
+        # 调用LLM；为最终回答预留时间，超出截止时间时转为最终回答
+        llm_messages = [system_message] + list(messages)
+        reserve = settings.agent_finalize_reserve_seconds
+        try:
+            if self.router_llm_with_tools is not None:
+                # 先由路由模型决定调用哪些工具；决定回答或工具调用不合法时交给回答模型
+                response = await self._call_llm(
+                    self.router_llm_with_tools, llm_messages, state["deadline"] - reserve - time.monotonic(), "router"
+                )
+                if response.tool_calls:
+                    problems = self._validate_tool_calls(response)
+                    if not problems:
+                        return {"messages": [response], "steps": state.get("steps", 0) + 1}
+                    self.tier_stats["escalations"] += 1
+                    logger.warning(f"路由模型的工具调用校验失败，改用回答模型: {'; '.join(problems)}")
+                elif response.response_metadata.get("router_stopped_early"):
+                    # 截断前没有出现工具调用，但不能确定之后是否还有，由回答模型重新决定
+                    self.tier_stats["escalations"] += 1
+                    logger.info("路由模型输出了较长的文本且没有工具调用，已提前停止，改用回答模型")
+                else:
+                    self.tier_stats["handoffs"] += 1
+            response = await self._call_llm(
+                self.llm_with_tools, llm_messages, state["deadline"] - reserve - time.monotonic()
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Agent推理达到截止时间，使用已有信息生成回答")
+            return {"limit_hit": "deadline"}
+        
+        return {"messages": [response], "steps": state.get("steps", 0) + 1}
+    
+    async def _call_llm(self, llm, llm_messages: list, timeout: float, tier: str = "answer") -> AIMessage:
+        """
+        调用LLM（经调度器排队，带超时）；流式调用时逐个token输出
+        
+        Args:
+            llm: 使用的LLM
+            llm_messages: 发送给LLM的消息列表
+            timeout: 超时时间（秒），不大于0时直接超时
+            tier: 模型层级 router / answer，路由模型的输出不推送给用户
+        
+        Returns:
+            AI消息
+        """
+        if timeout <= 0:
+            raise asyncio.TimeoutError()
+        if tier == "router":
+            factory = lambda: self._route_llm(llm_messages, llm)
+        elif _event_queue.get() is None:
+            factory = lambda: llm.ainvoke(llm_messages)
+        else:
+            factory = lambda: self._stream_llm(llm_messages, llm)
+        round_trips = _llm_round_trips.get()
+        if round_trips is not None:
+            round_trips[0] += 1
+        # 排队时间也计入超时
+        started = time.monotonic()
+        with span(f"llm.{tier}", messages=len(llm_messages)) as llm_span:
+            response = await asyncio.wait_for(self.governor.call(factory, llm_messages), timeout=timeout)
+            prompt_tokens, completion_tokens = self._record_tier(tier, started, llm_messages, response)
+            if llm_span:
+                llm_span.set(
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=completion_tokens,
+                    tool_calls=[tool_call["name"] for tool_call in response.tool_calls]
+                )
+        return response
+    
+    async def _route_llm(self, llm_messages: list, llm) -> AIMessage:
+        """
+        调用路由模型：输出了足够长的回答文本仍没有工具调用时停止生成
+        
+        路由模型决定回答时，回答会交给回答模型重新生成，提前停止可以省掉路由模型生成整段回答的时间。
+        部分模型会在工具调用前先输出一段说明文字，因此文本达到 llm_router_early_stop_chars 字符才停止，
+        停止时在 response_metadata 中标记 router_stopped_early。
+        
+        Args:
+            llm_messages: 发送给LLM的消息列表
+            llm: 绑定了工具的路由模型
         
-        return {"messages": [response]}
+        Returns:
+            AI消息（提前停止时只包含回答的开头）
+        """
+        response = None
+        stopped_early = False
+        stop_chars = settings.llm_router_early_stop_chars
+        stream = llm.astream(llm_messages)
+        try:
+            async for chunk in stream:
+                response = chunk if response is None else response + chunk
+                if (
+                    stop_chars > 0
+                    and not response.tool_call_chunks
+                    and len(str(response.content).strip()) >= stop_chars
+                ):
+                    stopped_early = True
+                    break
+        finally:
+            await stream.aclose()
+        if response is None:
+            return AIMessage(content="")
+        message = message_chunk_to_message(response)
+        if stopped_early:
+            message.response_metadata["router_stopped_early"] = True
+        return message
+    
+    def _validate_tool_calls(self, message: AIMessage) -> List[str]:
+        """
+        校验LLM给出的工具调用（工具是否存在、参数是否符合工具定义）
+        
+        Args:
+            message: 包含工具调用的AI消息
+        
+        Returns:
+            问题列表，全部合法时为空
+        """
+        problems = [
+            f"无法解析的工具调用 {invalid.get('name')}: {invalid.get('error')}"
+            for invalid in getattr(message, "invalid_tool_calls", None) or []
+        ]
+        schemas = {tool.name: tool.args_schema for tool in self.langchain_tools}
+        for tool_call in message.tool_calls:
+            name = tool_call["name"]
+            if name not in self.tool_handlers:
+                problems.append(f"未知工具 {name}")
+                continue
+            try:
+                schemas[name](**tool_call["args"])
+            except Exception as e:
+                problems.append(f"{name} 参数不合法: {str(e).splitlines()[0]}")
+        return problems
+    
+    def _record_tier(self, tier: str, started: float, llm_messages: list, response: AIMessage) -> Tuple[int, int]:
+        """记录各层级模型的耗时和token用量（服务商未返回用量时按文本长度估算），返回 (prompt, completion) token数"""
+        stats = self.tier_stats[tier]
+        usage = getattr(response, "usage_metadata", None) or {}
+        elapsed = time.monotonic() - started
+        prompt_tokens = usage.get("input_tokens") or sum(
+            estimate_tokens(str(message.content)) for message in llm_messages
+        )
+        completion_tokens = usage.get("output_tokens") or estimate_tokens(str(response.content)) + sum(
+            estimate_tokens(str(tool_call["args"])) for tool_call in response.tool_calls
+        )
+        stats["calls"] += 1
+        stats["total_ms"] += elapsed * 1000
+        stats["prompt_tokens"] += prompt_tokens
+        stats["completion_tokens"] += completion_tokens
+        LLM_SECONDS.labels(tier=tier).observe(elapsed)
+        LLM_TOKENS.labels(tier=tier, kind="prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(tier=tier, kind="completion").inc(completion_tokens)
+        return prompt_tokens, completion_tokens
+    
+    def tier_snapshot(self) -> Dict:
+        """获取各层级模型的统计信息（含平均耗时）"""
+        snapshot = dict(self.tier_stats)
+        for tier in ("router", "answer"):
+            stats = self.tier_stats[tier]
+            snapshot[tier] = {
+                **stats,
+                "total_ms": round(stats["total_ms"], 1),
+                "avg_ms": round(stats["total_ms"] / stats["calls"], 1) if stats["calls"] else 0.0,
+            }
+        return snapshot
+    
+    async def _stream_llm(self, llm_messages: list, llm=None) -> AIMessage:
+        """
+        流式调用LLM，把文本token写入事件队列，返回合并后的完整消息
+        
+        Args:
+            llm_messages: 发送给LLM的消息列表
+            llm: 使用的LLM，默认为绑定了工具的LLM
+        
+        Returns:
+            完整的AI消息（包含工具调用）
+        """
+        response = None
+        async for chunk in (llm or self.llm_with_tools).astream(llm_messages):
+            if chunk.content:
+                _emit("token", {"content": chunk.content})
+            response = chunk if response is None else response + chunk
+        return message_chunk_to_message(response) if response is not None else AIMessage(content="")
     
-    def _build_system_prompt(self, user_id: int, context: dict) -> str:
+    def _build_system_prompt(self, user_id: int, context: dict, summary: str = "") -> str:
         """构建系统提示"""
         prompt = """你是一个专业的课程推荐助手，能够根据用户的学习情况提供个性化的课程推荐和学习建议。
 
@@ -148,104 +510,185 @@ class CourseRecommendationAgent:
 - get_user_learning_profile: 获取用户学习画像
 - get_user_purchased_courses: 获取用户购买的课程
 - get_user_learning_records: 获取用户学习记录
-- search_courses: 在课程知识库中搜索相关课程
+- search_courses: 在课程知识库中搜索相关课程（传入 user_id 时排除用户已购买的课程）
+- get_course_details: 批量获取课程详情（介绍、适用人群、大纲）
+- get_recommended_candidates: 读取预计算的候选课程（与已学课程相似、尚未购买）
+- similar_courses: 查询与指定课程最相似的课程（学完某门课后的下一步）
+- browse_category: 浏览课程分类树（子分类和按难度排序的课程）
+- learning_path: 生成某个方向按难度分阶段的学习路径
 
 请根据用户的问题，智能地调用这些工具，然后基于收集到的信息给出专业的建议。
+"""
+        prompt += f"\n当前用户ID：{user_id}\n"
+        if summary:
+            prompt += f"""
+之前对话的摘要（已获取过的信息不必重复调用工具，除非需要更详细的内容）：
+{summary}
 """
         return prompt
     
     async def _tools_node(self, state: AgentState) -> AgentState:
-        """工具节点：执行工具调用"""
+        """工具节点：并发执行本轮的所有工具调用"""
+        with span("agent.tools", step=state.get("steps", 0)):
+            return await self._tools_step(state)
+    
+    async def _tools_step(self, state: AgentState) -> AgentState:
+        """执行一轮工具调用并序列化结果"""
         messages = state["messages"]
         last_message = messages[-1]
+        tool_calls = getattr(last_message, "tool_calls", None) or []
         
-        tool_calls = []
-        tool_results = []
-        
-        # 提取工具调用
-        if hasattr(last_message, "tool_calls") and last_message.tool_calls:
-            for tool_call in last_message.tool_calls:
-                tool_name = tool_call.get("name", "")
-                tool_args = tool_call.get("args", {})
-                
-                logger.info(f"调用工具: {tool_name}, 参数: {tool_args}")
-                
-                # 执行工具
-                try:
-                    # 根据工具名称找到对应的工具并执行
-                    tool_func = None
-                    for tool in self.langchain_tools:
-                        if tool.name == tool_name:
-                            tool_func = tool
-                            break
-                    
-                    if tool_func:
-                        # 调用工具
-                        if tool_name == "get_user_learning_profile":
-                            result = await self.tools.get_user_learning_profile(
-                                tool_args.get("user_id")
-                            )
-                        elif tool_name == "get_user_purchased_courses":
-                            result = await self.tools.get_user_purchased_courses(
-                                tool_args.get("user_id")
-                            )
-                        elif tool_name == "get_user_learning_records":
-                            result = await self.tools.get_user_learning_records(
-                                tool_args.get("user_id"),
-                                tool_args.get("course_id")
-                            )
-                        elif tool_name == "search_courses":
-                            result = await self.tools.search_courses(
-                                tool_args.get("query"),
-                                tool_args.get("top_k", 5)
-                            )
-                        else:
-                            result = {"error": f"未知工具: {tool_name}"}
-                    else:
-                        result = {"error": f"未找到工具: {tool_name}"}
-                    
-                    # 将结果转换为字符串
-                    if isinstance(result, (dict, list)):
-                        import json
-                        result_str = json.dumps(result, ensure_ascii=False, indent=2)
-                    else:
-                        result_str = str(result)
-                    
-                    tool_results.append({
-                        "tool_call_id": tool_call.get("id", ""),
-                        "content": result_str
-                    })
-                except Exception as e:
-                    logger.error(f"工具执行失败: {e}")
-                    tool_results.append({
-                        "tool_call_id": tool_call.get("id", ""),
-                        "content": f"工具执行失败: {str(e)}"
-                    })
-        
-        # 构建工具结果消息
-        from langchain_core.messages import ToolMessage
+        # 同一轮的工具调用互不依赖，并发执行，耗时取决于最慢的一个
+        results = await asyncio.gather(
+            *(self._run_tool(tool_call, state["deadline"]) for tool_call in tool_calls)
+        )
+        
+        # 按工具投影字段并压缩序列化，受单个工具和整次对话的token预算限制
+        tool_tokens = state.get("tool_tokens", 0)
+        with timed(TOOL_SERIALIZE_SECONDS), span("serialize"):
+            contents, used_tokens = self.serializer.serialize_step(
+                [tool_call.get("name", "") for tool_call in tool_calls],
+                results,
+                settings.tool_turn_token_budget - tool_tokens
+            )
+        
+        # 构建工具结果消息（顺序与工具调用一致）
         tool_messages = [
             ToolMessage(
-                content=result["content"],
-                tool_call_id=result["tool_call_id"]
+                content=content,
+                tool_call_id=tool_call.get("id", "")
             )
-            for result in tool_results
+            for tool_call, content in zip(tool_calls, contents)
         ]
         
-        return {"messages": tool_messages}
+        return {
+            "messages": tool_messages,
+            "tool_tokens": tool_tokens + used_tokens,
+            "tool_calls": state.get("tool_calls", 0) + len(tool_calls)
+        }
+    
+    async def _run_tool(self, tool_call: Dict, deadline: Optional[float] = None) -> Any:
+        """
+        执行单个工具调用（带超时）
+        
+        Args:
+            tool_call: LLM给出的工具调用
+            deadline: 整次请求的截止时间（time.monotonic()，可选），工具超时不会超过截止时间
+        
+        Returns:
+            工具返回值；超时或失败时为错误说明文本
+        """
+        tool_name = tool_call.get("name", "")
+        tool_args = tool_call.get("args", {})
+        handler = self.tool_handlers.get(tool_name)
+        if handler is None:
+            return {"error": f"未知工具: {tool_name}"}
+        
+        cacheable = _answer_cacheable.get()
+        if cacheable is not None and tool_name in _USER_DETAIL_TOOLS:
+            cacheable[0] = False
+        
+        timeout = settings.tool_timeouts.get(tool_name, settings.tool_timeout_seconds)
+        if deadline is not None:
+            timeout = max(min(timeout, deadline - settings.agent_finalize_reserve_seconds - time.monotonic()), 0.001)
+        logger.info(f"调用工具: {tool_name}, 参数: {tool_args}")
+        _emit("tool_start", {"id": tool_call.get("id", ""), "name": tool_name, "args": tool_args})
+        started = time.perf_counter()
+        status = "ok"
+        tool_span = None
+        try:
+            with span(f"tool.{tool_name}", args=tool_args) as tool_span:
+                # 超时后 wait_for 会取消工具协程
+                return await asyncio.wait_for(handler(tool_args), timeout=timeout)
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        except asyncio.TimeoutError:
+            status = "timeout"
+            logger.warning(f"工具执行超时: {tool_name}（{timeout:.1f}s）")
+            return f"工具执行超时: {tool_name} 超过 {timeout:.1f} 秒未返回"
+        except Exception as e:
+            status = "error"
+            logger.error(f"工具执行失败: {e}")
+            return f"工具执行失败: {str(e)}"
+        finally:
+            elapsed = time.perf_counter() - started
+            TOOL_SECONDS.labels(tool=tool_name, status=status).observe(elapsed)
+            if tool_span:
+                tool_span.set(status=status)
+            _emit("tool_end", {
+                "id": tool_call.get("id", ""),
+                "name": tool_name,
+                "status": status,
+                "elapsed_ms": round(elapsed * 1000)
+            })
     
     def _should_continue(self, state: AgentState) -> str:
-        """判断是否继续"""
+        """判断是否继续：有工具调用时继续，达到步数、工具调用数或时间限制时转为最终回答"""
+        if state.get("limit_hit"):
+            return "finalize"
+        
         messages = state["messages"]
         last_message = messages[-1]
         
-        # 如果有工具调用，继续执行
-        if hasattr(last_message, "tool_calls") and last_message.tool_calls:
-            return "continue"
-        # 否则结束
-        return "end"
+        # 没有工具调用，LLM已经给出回答
+        if not (hasattr(last_message, "tool_calls") and last_message.tool_calls):
+            return "end"
+        
+        limit = self._check_limits(state, len(last_message.tool_calls))
+        if limit:
+            logger.warning(f"Agent达到限制 {limit}，使用已有信息生成回答")
+            return "finalize"
+        return "continue"
+    
+    @staticmethod
+    def _check_limits(state: AgentState, pending_tool_calls: int) -> Optional[str]:
+        """
+        检查继续执行工具调用是否会超出限制
+        
+        Args:
+            state: 当前状态
+            pending_tool_calls: 待执行的工具调用数
+        
+        Returns:
+            触发的限制名称，未触发时返回None
+        """
+        if state.get("steps", 0) >= settings.agent_max_steps:
+            return "max_steps"
+        if state.get("tool_calls", 0) + pending_tool_calls > settings.agent_max_tool_calls:
+            return "max_tool_calls"
+        if time.monotonic() >= state["deadline"] - settings.agent_finalize_reserve_seconds:
+            return "deadline"
+        return None
+    
+    async def _finalize_node(self, state: AgentState) -> AgentState:
+        """
+        最终回答节点：达到限制时不再调用工具，让LLM根据已有信息直接回答
+        
+        未执行的工具调用补上说明性的工具结果，保证消息序列合法（每个工具调用都有对应结果）。
+        """
+        messages = list(state["messages"])
+        pending_tool_calls = getattr(messages[-1], "tool_calls", None) or []
+        limit = state.get("limit_hit") or self._check_limits(state, len(pending_tool_calls)) or "max_steps"
+        skipped = [
+            ToolMessage(content=f"未执行：已达到 {limit} 限制", tool_call_id=tool_call.get("id", ""))
+            for tool_call in pending_tool_calls
+        ]
+        
+        prompt = self._build_system_prompt(state.get("user_id", 0), state.get("context", {}), state.get("summary", ""))
+        prompt += "\n本次请求已达到处理上限，不能再调用工具。请根据已经获取的信息直接给出尽可能有用的回答，信息不足之处如实说明。\n"
+        llm_messages = [SystemMessage(content=prompt)] + messages + skipped
+        with span("agent.finalize", limit=limit):
+            try:
+                response = await self._call_llm(self.llm, llm_messages, state["deadline"] - time.monotonic())
+                response = AIMessage(content=str(response.content))
+            except Exception as e:
+                logger.error(f"生成最终回答失败: {e}")
+                response = AIMessage(content="抱歉，这个问题处理时间过长，暂时无法给出完整的建议，请稍后再试或换个更具体的问法。")
+        
+        return {"messages": skipped + [response], "limit_hit": limit}
     
-    async def invoke(self, user_id: int, query: str, context: dict = None) -> str:
+    async def invoke(self, user_id: int, query: str, context: dict = None, session_id: Optional[str] = None) -> str:
         """
         执行Agent推理
         
@@ -253,30 +696,474 @@ class CourseRecommendationAgent:
             user_id: 用户ID
             query: 用户查询
             context: 上下文信息
+            session_id: 会话ID（可选），指定时带上该会话的历史，并在结束后保存本轮对话
             
         Returns:
             Agent回复
         """
-        # 构建初始状态
-        initial_state = {
-            "messages": [HumanMessage(content=query)],
-            "user_id": user_id,
-            "context": context or {}
-        }
+        result = await self.run(user_id, query, context, session_id)
+        return result["answer"]
+    
+    async def run(self, user_id: int, query: str, context: dict = None, session_id: Optional[str] = None) -> Dict:
+        """
+        执行Agent推理，返回回复及执行信息
         
-        # 执行图
-        final_state = await self.graph.ainvoke(initial_state)
+        Args:
+            user_id: 用户ID
+            query: 用户查询
+            context: 上下文信息
+            session_id: 会话ID（可选）
+        
+        Returns:
+            {"answer": 回复, "limit_hit": 触发的限制（未触发为None）, "cached": 是否来自回答缓存}
+        """
+        # 相似问题且画像状态、知识库代次相同时直接复用缓存的回答
+        with span("answer_cache.key"):
+            cache_entry = await self._prepare_answer_cache(user_id, query, context, session_id)
+        if cache_entry:
+            cached_answer = self.answer_cache.lookup(*cache_entry)
+            if cached_answer is not None:
+                await self._save_cached_turn(session_id, user_id, query, cached_answer)
+                return {"answer": cached_answer, "limit_hit": None, "cached": True}
+        
+        cacheable = [True] if cache_entry else None
+        token = _answer_cacheable.set(cacheable)
+        try:
+            final_state = await self._run(user_id, query, context, session_id)
+        finally:
+            _answer_cacheable.reset(token)
         
         # 提取最终回复
         messages = final_state["messages"]
         last_message = messages[-1]
         
         if isinstance(last_message, AIMessage):
-            return last_message.content
+            answer = last_message.content
         else:
-            return str(last_message.content)
+            answer = str(last_message.content)
+        limit_hit = final_state.get("limit_hit")
+        # 达到限制时的回答信息不完整，用到画像指纹之外的用户数据时回答因人而异，都不写入缓存
+        if cache_entry and cacheable[0] and answer and not limit_hit:
+            self.answer_cache.store(query, *cache_entry, answer)
+        return {"answer": answer, "limit_hit": limit_hit, "cached": False}
+    
+    async def stream(
+        self,
+        user_id: int,
+        query: str,
+        context: dict = None,
+        session_id: Optional[str] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        流式执行Agent推理，逐个产出事件
+        
+        事件类型：
+        - tool_start / tool_end: 工具调用开始和结束（名称、参数、状态、耗时）
+        - token: LLM输出的文本片段
+        - done: 推理完成，包含完整回复
+        - error: 推理失败
+        
+        调用方停止迭代（如客户端断开连接）时，图的执行和进行中的工具调用都会被取消。
+        
+        Args:
+            user_id: 用户ID
+            query: 用户查询
+            context: 上下文信息
+            session_id: 会话ID（可选）
+        
+        Yields:
+            事件字典 {"event": 事件类型, "data": 事件数据}
+        """
+        with span("answer_cache.key"):
+            cache_entry = await self._prepare_answer_cache(user_id, query, context, session_id)
+        if cache_entry:
+            cached_answer = self.answer_cache.lookup(*cache_entry)
+            if cached_answer is not None:
+                await self._save_cached_turn(session_id, user_id, query, cached_answer)
+                yield {"event": "token", "data": {"content": cached_answer}}
+                yield {"event": "done", "data": {"answer": cached_answer, "cached": True}}
+                return
+        
+        queue: asyncio.Queue = asyncio.Queue()
+        cacheable = [True] if cache_entry else None
+        token = _event_queue.set(queue)
+        cacheable_token = _answer_cacheable.set(cacheable)
+        try:
+            # create_task 复制当前上下文，图中的节点都能取到事件队列
+            task = asyncio.create_task(self._run(user_id, query, context, session_id))
+        finally:
+            _answer_cacheable.reset(cacheable_token)
+            _event_queue.reset(token)
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield event
+            
+            try:
+                final_state = task.result()
+            except Exception as e:
+                logger.error(f"流式推理失败: {e}")
+                yield {"event": "error", "data": {"message": str(e)}}
+                return
+            answer = str(final_state["messages"][-1].content)
+            limit_hit = final_state.get("limit_hit")
+            if cache_entry and cacheable[0] and answer and not limit_hit:
+                self.answer_cache.store(query, *cache_entry, answer)
+            yield {"event": "done", "data": {"answer": answer, "limit_hit": limit_hit}}
+        finally:
+            if not task.done():
+                logger.info(f"用户 {user_id} 的流式请求已中断，取消推理")
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+    
+    async def _run(self, user_id: int, query: str, context: Optional[dict], session_id: Optional[str]) -> Dict:
+        """
+        执行一次推理：识别出的常见推荐意图走快速路径，其余问题走完整的Agent循环
+        
+        Args:
+            user_id: 用户ID
+            query: 用户查询
+            context: 上下文信息
+            session_id: 会话ID（可选）
+        
+        Returns:
+            结束时的状态（messages 的最后一条为回答）
+        """
+        initial_state = self._initial_state(user_id, query, context, session_id)
+        self.route_stats["requests"] += 1
+        round_trips = [0]
+        token = _llm_round_trips.set(round_trips)
+        started = time.perf_counter()
+        
+        final_state = None
+        path = "agent"
+        with span("agent", user_id=user_id) as agent_span:
+            try:
+                # 追问依赖会话上下文，只有首轮问题走快速路径
+                if (
+                    settings.fast_path_enabled
+                    and len(initial_state["messages"]) == 1
+                    and not (context or {}).get("full_agent")
+                    and self.intent_router.route(query) == INTENT_RECOMMEND
+                ):
+                    try:
+                        with span("agent.fast_path"):
+                            final_state = await self._run_fast_path(initial_state, query)
+                        # 只统计成功由快速路径回答的请求，失败改走Agent循环的计入 fast_path_fallback
+                        self.route_stats["fast_path"] += 1
+                        path = "fast_path"
+                    except Exception as e:
+                        self.route_stats["fast_path_fallback"] += 1
+                        path = "fast_path_fallback"
+                        logger.warning(f"快速路径执行失败，改为完整Agent循环: {e}")
+            
+                if final_state is None:
+                    final_state = await self.graph.ainvoke(initial_state)
+            finally:
+                _llm_round_trips.reset(token)
+                AGENT_REQUEST_SECONDS.labels(path=path).observe(time.perf_counter() - started)
+                AGENT_LLM_ROUND_TRIPS.labels(path=path).observe(round_trips[0])
+                if agent_span:
+                    agent_span.set(path=path, llm_round_trips=round_trips[0])
+            if session_id:
+                with span("session.save"):
+                    await self._save_session(session_id, user_id, final_state)
+        return final_state
+    
+    async def _run_fast_path(self, state: Dict, query: str) -> Dict:
+        """
+        推荐意图的快速路径：并发获取画像、检索课程（以及预计算的候选课程、学习路径），只调用一次LLM生成回答
+        
+        工具调用同样受超时和token预算限制；生成的消息与Agent循环的格式一致
+        （AI工具调用消息 + 工具结果 + 回答），便于写入会话历史。
+        
+        Args:
+            state: 初始状态
+            query: 用户查询
+        
+        Returns:
+            结束时的状态
+        """
+        user_id = state["user_id"]
+        call_suffix = uuid.uuid4().hex[:8]
+        tool_calls = [
+            {
+                "name": "get_user_learning_profile",
+                "args": {"user_id": user_id},
+                "id": f"fast_profile_{call_suffix}"
+            },
+            {
+                "name": "search_courses",
+                "args": {
+                    "query": self.intent_router.search_query(query),
+                    "top_k": settings.fast_path_top_k,
+                    "user_id": user_id
+                },
+                "id": f"fast_search_{call_suffix}"
+            },
+        ]
+        # 有离线预计算的候选课程时一并提供（按用户ID直接读取，不增加明显耗时）
+        if self.tools.candidate_store.has(user_id):
+            tool_calls.append({
+                "name": "get_recommended_candidates",
+                "args": {"user_id": user_id, "top_k": settings.fast_path_top_k},
+                "id": f"fast_candidates_{call_suffix}"
+            })
+        # 询问学习路线且问题中能匹配到分类时，提供按难度分阶段的学习路径（读取本地分类索引）
+        if self.intent_router.wants_learning_path(query) and self.tools.category_index.find_node(query):
+            tool_calls.append({
+                "name": "learning_path",
+                "args": {"topic": query, "user_id": user_id},
+                "id": f"fast_learning_path_{call_suffix}"
+            })
+        results = await asyncio.gather(*(self._run_tool(tool_call, state["deadline"]) for tool_call in tool_calls))
+        with timed(TOOL_SERIALIZE_SECONDS), span("serialize"):
+            contents, used_tokens = self.serializer.serialize_step(
+                [tool_call["name"] for tool_call in tool_calls],
+                results,
+                settings.tool_turn_token_budget
+            )
+        
+        prompt = self._build_system_prompt(user_id, state["context"], state.get("summary", ""))
+        prompt += "\n已经为你获取了以下信息，请直接根据这些信息回答，不要再调用工具：\n"
+        for tool_call, content in zip(tool_calls, contents):
+            prompt += f"\n[{tool_call['name']}]\n{content}\n"
+        llm_messages = [SystemMessage(content=prompt), HumanMessage(content=query)]
+        response = await self._call_llm(self.llm, llm_messages, state["deadline"] - time.monotonic())
+        
+        tool_messages = [
+            ToolMessage(content=content, tool_call_id=tool_call["id"])
+            for tool_call, content in zip(tool_calls, contents)
+        ]
+        return {
+            **state,
+            "messages": list(state["messages"]) + [
+                AIMessage(content="", tool_calls=tool_calls),
+                *tool_messages,
+                AIMessage(content=str(response.content))
+            ],
+            "tool_tokens": used_tokens,
+            "steps": 1,
+            "tool_calls": len(tool_calls)
+        }
+    
+    async def _prepare_answer_cache(
+        self,
+        user_id: int,
+        query: str,
+        context: Optional[dict],
+        session_id: Optional[str]
+    ) -> Optional[tuple]:
+        """
+        计算回答缓存的查询向量和分组键
+        
+        以下情况不使用缓存：缓存未启用、context 中 bypass_cache=true、会话中已有历史（追问依赖上下文）、
+        画像获取失败。
+        
+        Args:
+            user_id: 用户ID
+            query: 用户查询
+            context: 上下文信息
+            session_id: 会话ID
+        
+        Returns:
+            (查询向量, 分组键)，不使用缓存时返回None
+        """
+        if self.answer_cache is None:
+            return None
+        if (context or {}).get("bypass_cache") or (
+            session_id and self.sessions.load(self._session_key(user_id, session_id))
+        ):
+            self.answer_cache.record_bypass()
+            return None
+        
+        # 画像指纹和查询向量互不依赖，同时计算
+        loop = asyncio.get_running_loop()
+        embedding_model = self.tools.vector_store.embedding_model
+        try:
+            fingerprint, query_embedding = await asyncio.gather(
+                self._profile_fingerprint(user_id),
+                loop.run_in_executor(None, bind(embedding_model.embed_query), query)
+            )
+        except Exception as e:
+            logger.warning(f"计算回答缓存键失败，跳过缓存: {e}")
+            self.answer_cache.record_bypass()
+            return None
+        key = (fingerprint, self.tools.vector_store.generation, self.answer_model)
+        return query_embedding, key
+    
+    async def _profile_fingerprint(self, user_id: int) -> str:
+        """
+        计算用户画像指纹：只取课表中的课程和学习状态
+        
+        学习进度、最近学习时间等每天都在变化的字段不参与计算，否则缓存几乎不会命中；
+        课程和状态相同的不同用户得到相同的指纹。画像经工具层短期缓存，随后的画像工具调用不再请求Java端。
+        """
+        profile = await self.tools.fetch_learning_profile(user_id)
+        state = sorted(
+            (lesson.get("courseId"), lesson.get("status"))
+            for lesson in profile.get("lessons", [])
+            if lesson.get("courseId") is not None
+        )
+        return content_hash(state)
+    
+    async def _save_cached_turn(self, session_id: Optional[str], user_id: int, query: str, answer: str):
+        """缓存命中时把本轮问答写入会话，后续追问仍能看到上下文"""
+        if session_id:
+            await self._save_session(session_id, user_id, {
+                "messages": [HumanMessage(content=query), AIMessage(content=answer)],
+                "summary": ""
+            })
+    
+    def _initial_state(
+        self,
+        user_id: int,
+        query: str,
+        context: Optional[dict],
+        session_id: Optional[str] = None
+    ) -> Dict:
+        """构建图的初始状态（指定会话时带上历史消息和摘要）"""
+        history, summary = [], ""
+        session = self.sessions.load(self._session_key(user_id, session_id)) if session_id else None
+        if session:
+            history, summary = session["messages"], session["summary"]
+        return {
+            "messages": history + [HumanMessage(content=query)],
+            "user_id": user_id,
+            "context": context or {},
+            "tool_tokens": 0,
+            "summary": summary,
+            "steps": 0,
+            "tool_calls": 0,
+            "deadline": time.monotonic() + settings.agent_deadline_seconds,
+            "limit_hit": None
+        }
+    
+    async def _save_session(self, session_id: str, user_id: int, final_state: Dict):
+        """
+        保存会话：工具结果压缩为简短引用；超出轮数上限时先完整保存，早期轮次在后台合并进滚动摘要
+        
+        摘要需要一次LLM调用，放在后台执行，本轮回答不等待摘要完成。
+        
+        Args:
+            session_id: 会话ID
+            user_id: 用户ID
+            final_state: 图执行结束时的状态
+        """
+        key = self._session_key(user_id, session_id)
+        messages = [self._compact_message(message) for message in final_state["messages"]]
+        summary = final_state.get("summary", "")
+        try:
+            self.sessions.save(key, user_id, summary, messages)
+        except Exception as e:
+            logger.error(f"保存会话 {session_id} 失败: {e}")
+            return
+        
+        turn_starts = [i for i, message in enumerate(messages) if isinstance(message, HumanMessage)]
+        if len(turn_starts) > settings.session_max_turns and key not in self._summary_tasks:
+            # 早期轮次：保留最近 session_max_turns 轮之前的全部消息
+            old_count = turn_starts[-settings.session_max_turns]
+            # 在空白上下文中创建任务：不计入本次请求的追踪和LLM往返次数
+            task = contextvars.Context().run(
+                asyncio.create_task, self._compact_session(key, user_id, summary, messages[:old_count])
+            )
+            self._summary_tasks[key] = task
+            task.add_done_callback(lambda _: self._summary_tasks.pop(key, None))
+    
+    async def _compact_session(self, key: str, user_id: int, summary: str, old_messages: List[BaseMessage]):
+        """
+        后台任务：把早期轮次合并进摘要，并从存储的会话中移除这些消息
+        
+        摘要期间会话可能又追加了新的轮次（追加在末尾，前面的消息不变），只有摘要基础未变时才写回，
+        否则放弃本次结果，由下一轮重新合并。
+        
+        Args:
+            key: 会话存储键
+            user_id: 用户ID
+            summary: 开始合并时的摘要
+            old_messages: 需要合并的早期消息（会话消息的前缀）
+        """
+        new_summary = await self._summarize(summary, old_messages)
+        try:
+            session = self.sessions.load(key)
+            if not session or session["summary"] != summary or len(session["messages"]) < len(old_messages):
+                return
+            self.sessions.save(key, user_id, new_summary, session["messages"][len(old_messages):])
+        except Exception as e:
+            logger.error(f"保存会话摘要失败: {e}")
+    
+    @staticmethod
+    def _session_key(user_id: int, session_id: str) -> str:
+        """会话存储键：按用户隔离，其他用户使用相同的会话ID也读不到该会话"""
+        return f"{user_id}:{session_id}"
+    
+    @staticmethod
+    def _compact_message(message: BaseMessage) -> BaseMessage:
+        """把工具结果压缩为简短引用（保留开头部分，完整结果需要时重新调用工具）"""
+        max_chars = settings.session_tool_result_chars
+        if not isinstance(message, ToolMessage) or len(message.content) <= max_chars:
+            return message
+        return ToolMessage(
+            content=f"{message.content[:max_chars]}…[完整结果已省略，需要时重新调用工具]",
+            tool_call_id=message.tool_call_id
+        )
+    
+    async def _summarize(self, summary: str, messages: List[BaseMessage]) -> str:
+        """
+        把早期轮次合并进滚动摘要
+        
+        Args:
+            summary: 已有摘要
+            messages: 需要合并的消息
+        
+        Returns:
+            新的摘要；LLM调用失败时退化为拼接问答的前若干字符
+        """
+        lines = []
+        for message in messages:
+            if isinstance(message, HumanMessage):
+                lines.append(f"用户：{message.content}")
+            elif isinstance(message, ToolMessage):
+                lines.append(f"工具结果：{message.content}")
+            elif message.content:
+                lines.append(f"助手：{message.content}")
+        transcript = "\n".join(lines)
+        max_chars = settings.session_summary_chars
+        
+        prompt = f"""请把下面的对话合并进已有摘要，输出不超过{max_chars}字的新摘要。
+保留用户的学习情况、需求和偏好，以及已经推荐或查询过的课程（名称和ID），省略寒暄和重复内容。
+
+已有摘要：
+{summary or "无"}
+
+对话：
+{transcript}
+"""
+        try:
+            llm_messages = [HumanMessage(content=prompt)]
+            # 摘要不影响本轮回答，排在在线对话之后；配置了路由模型时用更便宜的路由模型
+            llm = self.router_llm or self.llm
+            with llm_priority("background"):
+                response = await self.governor.call(lambda: llm.ainvoke(llm_messages), llm_messages)
+            return str(response.content)[:max_chars * 2]
+        except Exception as e:
+            logger.warning(f"生成会话摘要失败: {e}，改为截取对话内容")
+            merged = f"{summary}\n{transcript}".strip()
+            return merged[-max_chars:]
     
     async def close(self):
         """关闭Agent"""
+        # 会话已完整保存，未完成的摘要直接放弃，下一轮对话时重新合并
+        for task in list(self._summary_tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._summary_tasks.values(), return_exceptions=True)
         await self.tools.close()
+        self.sessions.close()
 
@@ -0,0 +1,101 @@
+"""
+意图路由：在进入Agent循环之前识别常见的推荐类问题（不调用LLM）
+
+典型的"推荐课程"请求在Agent循环中至少需要两到三次串行的LLM调用（决定调用哪些工具、
+执行工具、可能再补充调用、最后生成回答）。这类问题需要的数据是固定的：用户画像和课程检索。
+路由器用规则识别这类意图，命中时由Agent走快速路径：并发获取画像和检索课程，只调用一次LLM生成回答；
+未识别的问题仍然走完整的Agent循环。
+
+使用示例：
+    from agent.intent import IntentRouter
+    
+    router = IntentRouter()
+    if router.route("Java多线程学不懂，接下来学什么？") == INTENT_RECOMMEND:
+        search_query = router.search_query("Java多线程学不懂，接下来学什么？")
+"""
+import re
+from typing import Optional
+
+
+INTENT_RECOMMEND = "recommend"
+
+# 推荐类意图的关键词
+_RECOMMEND_PATTERN = re.compile(
+    r"推荐|学什么|该学|先学|再学|接下来|下一步|怎么办|咋办|如何提升|怎么提升|进阶|入门|"
+    r"选什么|选哪|适合我|有什么课|有哪些课|哪门课|哪些课|什么课|学习路线|学习路径|学习建议"
+)
+
+# 询问某个方向学习路线的问题（快速路径额外提供按难度分阶段的学习路径）
+_LEARNING_PATH_PATTERN = re.compile(
+    r"学习路线|学习路径|路线图|从零|从入门|从基础|到进阶|到高级|到精通|怎么学|如何学|系统学|系统地学|学习顺序"
+)
+
+# 需要其他工具（学习记录、已购课程明细、课程详情）才能回答的问题，交给完整的Agent循环
+_EXCLUDE_PATTERN = re.compile(
+    r"学习记录|学到哪|学了多少|进度|买过|购买|已购|订单|退款|价格|多少钱|优惠|"
+    r"大纲|章节|第.{1,3}[章节]|老师|讲师|证书|课程ID|\d{3,}"
+)
+
+# 生成检索词时去掉的口语化表达
+_FILLER_PATTERN = re.compile(
+    r"请|帮我|给我|麻烦|推荐一下|推荐|一下|一些|几门|课程|课|吗|呢|啊|吧|呀|我|想|要|"
+    r"接下来|下一步|该|应该|怎么办|咋办|学什么|有什么|有哪些|哪些|什么|适合|"
+    r"[，。！？、,.!?；;：:\s]+"
+)
+
+
+class IntentRouter:
+    """基于规则的意图路由器"""
+    
+    def __init__(self, max_query_chars: int = 80):
+        """
+        初始化路由器
+        
+        Args:
+            max_query_chars: 超过该长度的问题视为复杂问题，不走快速路径
+        """
+        self.max_query_chars = max_query_chars
+    
+    def route(self, query: str) -> Optional[str]:
+        """
+        识别问题意图
+        
+        Args:
+            query: 用户问题
+        
+        Returns:
+            意图名称（目前只有 INTENT_RECOMMEND），未识别时返回None
+        """
+        query = query.strip()
+        if not query or len(query) > self.max_query_chars:
+            return None
+        if _EXCLUDE_PATTERN.search(query):
+            return None
+        if _RECOMMEND_PATTERN.search(query):
+            return INTENT_RECOMMEND
+        return None
+    
+    def wants_learning_path(self, query: str) -> bool:
+        """
+        判断问题是否在询问某个方向的学习路线
+        
+        Args:
+            query: 用户问题
+        
+        Returns:
+            是否需要学习路径
+        """
+        return bool(_LEARNING_PATH_PATTERN.search(query))
+    
+    def search_query(self, query: str) -> str:
+        """
+        从问题中提取用于课程检索的关键词（去掉口语化表达）
+        
+        Args:
+            query: 用户问题
+        
+        Returns:
+            检索词；去掉后为空时返回原问题
+        """
+        keywords = _FILLER_PATTERN.sub(" ", query).strip()
+        return re.sub(r"\s+", " ", keywords) or query
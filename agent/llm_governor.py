@@ -0,0 +1,306 @@
+"""
+LLM调用调度：并发上限、令牌桶限流和优先级排队
+
+所有请求共用一个 ChatOpenAI 实例，并发调用没有上限。流量高峰时容易触发服务商限流，
+各调用各自重试又会形成重试风暴，后台任务（批量推荐、预计算）还会和在线用户抢配额。
+调度器在每次LLM调用前排队：
+- 并发上限：同时进行中的调用数不超过 llm_max_concurrency
+- 令牌桶：按每分钟请求数和每分钟token数限流（token按prompt长度估算，调用结束后按实际用量修正）
+- 优先级：在线对话（interactive）先于后台任务（background）和批量任务（batch）
+- 退避：服务商返回限流（429，读取 Retry-After）或临时错误时，暂停所有调用一段时间后重试
+
+优先级通过上下文变量传递，调用方不需要逐层传参：
+    from agent.llm_governor import llm_priority
+    
+    with llm_priority("batch"):
+        await agent.run(user_id, query)
+"""
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from loguru import logger
+from config import settings
+from metrics import LLM_CALLS, LLM_QUEUE_WAIT_SECONDS
+from agent.serialization import estimate_tokens
+
+
+PRIORITIES = {"interactive": 0, "background": 1, "batch": 2}
+
+_current_priority: contextvars.ContextVar[str] = contextvars.ContextVar("llm_priority", default="interactive")
+
+# 可以重试的服务商错误（限流、服务端临时错误、连接错误）
+_RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+_RETRYABLE_ERRORS = {"RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError"}
+
+
+@contextlib.contextmanager
+def llm_priority(priority: str):
+    """
+    在上下文中设置LLM调用的优先级
+    
+    Args:
+        priority: interactive / background / batch
+    """
+    if priority not in PRIORITIES:
+        raise ValueError(f"未知的LLM调用优先级: {priority}")
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class TokenBucket:
+    """令牌桶"""
+    
+    def __init__(self, rate_per_minute: float):
+        """
+        初始化令牌桶（容量为一分钟的配额）
+        
+        Args:
+            rate_per_minute: 每分钟补充的令牌数
+        """
+        self.capacity = rate_per_minute
+        self.rate = rate_per_minute / 60.0
+        self.tokens = rate_per_minute
+        self.updated_at = time.monotonic()
+    
+    def wait_time(self, amount: float) -> float:
+        """获取令牌足够前需要等待的秒数"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+    
+    def consume(self, amount: float):
+        """消耗令牌（允许为负，表示透支，后续调用需要等待补足）"""
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+    
+    def refund(self, amount: float):
+        """归还令牌（实际用量小于预估时）"""
+        self.tokens = min(self.tokens + amount, self.capacity)
+    
+    def _refill(self):
+        """按经过的时间补充令牌"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+class LLMGovernor:
+    """LLM调用调度器"""
+    
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None
+    ):
+        """
+        初始化调度器
+        
+        Args:
+            max_concurrency: 最大并发调用数，默认使用配置
+            requests_per_minute: 每分钟请求数上限（0表示不限），默认使用配置
+            tokens_per_minute: 每分钟token数上限（0表示不限），默认使用配置
+        """
+        self.max_concurrency = max_concurrency or settings.llm_max_concurrency
+        rpm = requests_per_minute if requests_per_minute is not None else settings.llm_requests_per_minute
+        tpm = tokens_per_minute if tokens_per_minute is not None else settings.llm_tokens_per_minute
+        self._request_bucket = TokenBucket(rpm) if rpm else None
+        self._token_bucket = TokenBucket(tpm) if tpm else None
+        
+        self._active = 0
+        self._waiters: List[tuple] = []  # (优先级, 序号, future, 预估token数)
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        
+        self.stats = {
+            "calls": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "failed": 0,
+            "estimated_tokens": 0,
+            "actual_tokens": 0,
+            "queue_wait": {
+                name: {"count": 0, "total_ms": 0.0, "max_ms": 0.0} for name in PRIORITIES
+            },
+        }
+    
+    async def call(self, factory: Callable[[], Awaitable[Any]], llm_messages: list) -> Any:
+        """
+        排队执行一次LLM调用，遇到限流或临时错误时退避重试
+        
+        Args:
+            factory: 创建LLM调用协程的函数（每次重试重新创建）
+            llm_messages: 发送给LLM的消息，用于估算token数
+        
+        Returns:
+            LLM调用的返回值
+        """
+        priority = _current_priority.get()
+        estimated = sum(estimate_tokens(str(message.content)) for message in llm_messages)
+        estimated += settings.llm_completion_token_estimate
+        
+        attempt = 0
+        while True:
+            await self._acquire(priority, estimated)
+            actual = None
+            try:
+                response = await factory()
+                actual = self._usage(response)
+                self.stats["calls"] += 1
+                LLM_CALLS.labels(result="ok").inc()
+                return response
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None or attempt >= settings.llm_max_retries:
+                    self.stats["failed"] += 1
+                    LLM_CALLS.labels(result="failed").inc()
+                    raise
+                attempt += 1
+                self.stats["retries"] += 1
+                LLM_CALLS.labels(result="retried").inc()
+                logger.warning(f"LLM调用失败（{type(e).__name__}），所有调用暂停 {delay:.1f}s 后重试（第{attempt}次）")
+                self._pause(delay)
+            finally:
+                self._release(estimated, actual)
+    
+    def snapshot(self) -> Dict:
+        """获取统计信息（含当前并发和排队数）"""
+        queue_wait = {
+            name: {
+                "count": wait["count"],
+                "avg_ms": round(wait["total_ms"] / wait["count"], 1) if wait["count"] else 0.0,
+                "max_ms": round(wait["max_ms"], 1),
+            }
+            for name, wait in self.stats["queue_wait"].items()
+        }
+        return {
+            **self.stats,
+            "queue_wait": queue_wait,
+            "active": self._active,
+            "queued": sum(1 for waiter in self._waiters if not waiter[2].done()),
+            "paused_for_seconds": round(max(self._paused_until - time.monotonic(), 0.0), 2),
+        }
+    
+    async def _acquire(self, priority: str, estimated: int):
+        """排队等待调用许可"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        started = time.monotonic()
+        heapq.heappush(self._waiters, (PRIORITIES[priority], next(self._seq), future, estimated))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 已经拿到许可后才被取消时归还许可；仍在排队时 _dispatch 会跳过已取消的future
+            if future.done() and not future.cancelled():
+                self._release(estimated, estimated)
+            raise
+        
+        waited = time.monotonic() - started
+        LLM_QUEUE_WAIT_SECONDS.labels(priority=priority).observe(waited)
+        waited_ms = waited * 1000
+        wait_stats = self.stats["queue_wait"][priority]
+        wait_stats["count"] += 1
+        wait_stats["total_ms"] += waited_ms
+        wait_stats["max_ms"] = max(wait_stats["max_ms"], waited_ms)
+    
+    def _release(self, estimated: int, actual: Optional[int]):
+        """调用结束，归还并发许可，按实际token用量修正令牌桶"""
+        self._active -= 1
+        self.stats["estimated_tokens"] += estimated
+        if actual is not None:
+            self.stats["actual_tokens"] += actual
+            if self._token_bucket and actual < estimated:
+                self._token_bucket.refund(estimated - actual)
+            elif self._token_bucket and actual > estimated:
+                self._token_bucket.consume(actual - estimated)
+        self._dispatch()
+    
+    def _dispatch(self):
+        """按优先级放行排队的调用（严格优先级：队首等待限流时，低优先级调用不会插队）"""
+        while self._waiters and self._active < self.max_concurrency:
+            _, _, future, estimated = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            
+            now = time.monotonic()
+            delay = self._paused_until - now
+            if self._request_bucket:
+                delay = max(delay, self._request_bucket.wait_time(1))
+            if self._token_bucket:
+                delay = max(delay, self._token_bucket.wait_time(estimated))
+            if delay > 0:
+                self._schedule(delay)
+                return
+            
+            heapq.heappop(self._waiters)
+            if self._request_bucket:
+                self._request_bucket.consume(1)
+            if self._token_bucket:
+                self._token_bucket.consume(estimated)
+            self._active += 1
+            future.set_result(None)
+    
+    def _schedule(self, delay: float):
+        """在限流等待结束后重新调度"""
+        loop = asyncio.get_running_loop()
+        when = loop.time() + delay
+        if self._timer and not self._timer.cancelled() and self._timer.when() <= when:
+            return
+        if self._timer:
+            self._timer.cancel()
+        self._timer = loop.call_at(when, self._on_timer)
+    
+    def _on_timer(self):
+        """定时器回调"""
+        self._timer = None
+        self._dispatch()
+    
+    def _pause(self, delay: float):
+        """暂停所有调用（服务商限流时避免各调用同时重试）"""
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+    
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """
+        判断错误是否可以重试，并计算退避时间
+        
+        优先使用服务商返回的 Retry-After / retry-after-ms 响应头，否则按指数退避。
+        
+        Returns:
+            退避秒数，不可重试时返回None
+        """
+        status = getattr(error, "status_code", None)
+        if status not in _RETRYABLE_STATUS and type(error).__name__ not in _RETRYABLE_ERRORS:
+            return None
+        if status == 429 or type(error).__name__ == "RateLimitError":
+            self.stats["rate_limited"] += 1
+        
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except (TypeError, ValueError):
+            pass
+        return settings.llm_retry_backoff_seconds * (2 ** attempt)
+    
+    @staticmethod
+    def _usage(response: Any) -> Optional[int]:
+        """从LLM响应中读取实际token用量"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage and usage.get("total_tokens"):
+            return usage["total_tokens"]
+        metadata = getattr(response, "response_metadata", None) or {}
+        token_usage = metadata.get("token_usage") or {}
+        return token_usage.get("total_tokens")
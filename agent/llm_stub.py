@@ -0,0 +1,293 @@
+"""
+LLM服务替身：本地的 OpenAI 兼容接口（/v1/chat/completions）
+
+没有真实LLM时无法对 CourseRecommendationAgent 做基准测试，也分不清延迟有多少来自
+我们自己的图编排、工具、序列化和RAG，有多少来自模型。替身按脚本返回工具调用和回答，
+首token延迟和每token延迟可配置，支持流式输出，相同输入总是得到相同输出。
+把 OPENAI_BASE_URL 指向替身即可离线跑完整的Agent流程并做性能分析和压测。
+
+脚本（JSON文件，可选）按"本轮第几次回复"依次取用，{query} 和 {user_id} 会被替换：
+    {
+        "rounds": [
+            {"tool_calls": [
+                {"name": "get_user_learning_profile", "arguments": {"user_id": "{user_id}"}},
+                {"name": "search_courses", "arguments": {"query": "{query}", "top_k": 5, "user_id": "{user_id}"}}
+            ]},
+            {"content": "根据您的学习情况，建议先巩固{query}相关的基础..."}
+        ]
+    }
+未提供脚本时使用默认脚本：第一次回复调用画像和检索工具，之后给出固定长度的回答。
+
+使用示例：
+    # 启动替身（监听9000端口）
+    python -m agent.llm_stub --port 9000 --first-token-ms 300 --token-ms 20
+    
+    # .env 中指向替身
+    OPENAI_BASE_URL=http://127.0.0.1:9000/v1
+"""
+import asyncio
+import hashlib
+import itertools
+import json
+import re
+import time
+from typing import Dict, List, Optional
+from loguru import logger
+from config import settings
+from agent.serialization import estimate_tokens
+
+
+_USER_ID_PATTERN = re.compile(r"用户ID[:：]\s*(\d+)")
+
+# 默认回答的句子，按查询哈希选取，保证相同输入得到相同输出
+_ANSWER_SENTENCES = [
+    "根据您目前的学习进度，建议先把正在学习的课程推进到一半以上，再开始新的方向。",
+    "从课程知识库中检索到的几门课程与您的问题比较匹配，可以按难度由浅入深地学习。",
+    "如果某个章节卡住了，建议先回顾前置知识点，再结合课程中的练习巩固。",
+    "每天保持固定的学习时间，比集中突击更容易坚持下来。",
+    "学完一门课程后，可以通过一个小项目把知识串起来，检验掌握程度。",
+]
+
+
+class StubLLMScript:
+    """替身的回复脚本"""
+    
+    def __init__(self, rounds: Optional[List[Dict]] = None, answer_tokens: Optional[int] = None):
+        """
+        初始化脚本
+        
+        Args:
+            rounds: 按顺序使用的回复列表（每项包含 tool_calls 或 content），为空时使用默认脚本
+            answer_tokens: 默认回答的长度（token数），默认使用配置
+        """
+        self.rounds = rounds or []
+        self.answer_tokens = answer_tokens or settings.llm_stub_answer_tokens
+    
+    @classmethod
+    def from_file(cls, path: str) -> "StubLLMScript":
+        """从JSON文件加载脚本"""
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f).get("rounds", []))
+    
+    def respond(self, messages: List[Dict], tools: List[Dict]) -> Dict:
+        """
+        根据对话生成回复
+        
+        Args:
+            messages: 请求中的消息列表（OpenAI格式）
+            tools: 请求中声明的工具列表
+        
+        Returns:
+            {"content": 文本或None, "tool_calls": 工具调用列表}
+        """
+        # 本轮 = 最后一条用户消息之后的对话；本轮已有几次助手回复决定使用哪条脚本
+        last_user = max((i for i, m in enumerate(messages) if m.get("role") == "user"), default=-1)
+        query = str(messages[last_user].get("content", "")) if last_user >= 0 else ""
+        round_index = sum(1 for m in messages[last_user + 1:] if m.get("role") == "assistant")
+        user_id = self._find_user_id(messages)
+        tool_names = {tool.get("function", {}).get("name") for tool in tools or []}
+        variables = {"query": query, "user_id": user_id}
+        
+        if self.rounds:
+            step = self.rounds[min(round_index, len(self.rounds) - 1)]
+            # 脚本用完后如果最后一条仍是工具调用，改为给出回答，避免无限循环
+            if step.get("tool_calls") and round_index < len(self.rounds) and tool_names:
+                return {"content": None, "tool_calls": self._render(step["tool_calls"], variables)}
+            if step.get("content"):
+                return {"content": self._render(step["content"], variables), "tool_calls": []}
+        elif round_index == 0 and tool_names:
+            calls = [
+                {"name": "get_user_learning_profile", "arguments": {"user_id": user_id}},
+                {"name": "search_courses", "arguments": {"query": query, "top_k": 5, "user_id": user_id}},
+            ]
+            return {"content": None, "tool_calls": [call for call in calls if call["name"] in tool_names]}
+        
+        return {"content": self._default_answer(query), "tool_calls": []}
+    
+    def _default_answer(self, query: str) -> str:
+        """生成确定性的默认回答（长度约为 answer_tokens）"""
+        seed = int(hashlib.md5(query.encode("utf-8")).hexdigest(), 16)
+        sentences = itertools.cycle(_ANSWER_SENTENCES[seed % len(_ANSWER_SENTENCES):] + _ANSWER_SENTENCES)
+        answer = ""
+        while estimate_tokens(answer) < self.answer_tokens:
+            answer += next(sentences)
+        return answer
+    
+    @staticmethod
+    def _find_user_id(messages: List[Dict]) -> int:
+        """从系统提示中读取用户ID，找不到时使用1"""
+        for message in messages:
+            match = _USER_ID_PATTERN.search(str(message.get("content") or ""))
+            if match:
+                return int(match.group(1))
+        return 1
+    
+    @classmethod
+    def _render(cls, value, variables: Dict):
+        """替换脚本中的 {query}、{user_id} 占位符；整个值就是占位符时保留原类型"""
+        if isinstance(value, str):
+            for name, replacement in variables.items():
+                if value == f"{{{name}}}":
+                    return replacement
+                value = value.replace(f"{{{name}}}", str(replacement))
+            return value
+        if isinstance(value, list):
+            return [cls._render(item, variables) for item in value]
+        if isinstance(value, dict):
+            return {key: cls._render(item, variables) for key, item in value.items()}
+        return value
+
+
+def _split_tokens(text: str) -> List[str]:
+    """把回答切分为流式输出的片段（中文每2个字符、英文每4个字符约为1个token）"""
+    pieces = []
+    buffer = ""
+    for char in text:
+        buffer += char
+        if estimate_tokens(buffer) >= 1 and len(buffer) >= 2:
+            pieces.append(buffer)
+            buffer = ""
+    if buffer:
+        pieces.append(buffer)
+    return pieces
+
+
+def create_llm_stub_app(
+    script: Optional[StubLLMScript] = None,
+    first_token_ms: Optional[float] = None,
+    token_ms: Optional[float] = None
+):
+    """
+    创建LLM替身的ASGI应用
+    
+    Args:
+        script: 回复脚本，默认使用默认脚本
+        first_token_ms: 首token延迟（毫秒），默认使用配置
+        token_ms: 每个输出token的延迟（毫秒），默认使用配置
+    
+    Returns:
+        FastAPI应用
+    """
+    from fastapi import FastAPI, Request
+    from fastapi.responses import StreamingResponse
+    
+    script = script or StubLLMScript()
+    first_token_delay = (first_token_ms if first_token_ms is not None else settings.llm_stub_first_token_ms) / 1000
+    token_delay = (token_ms if token_ms is not None else settings.llm_stub_token_ms) / 1000
+    counter = itertools.count(1)
+    stats = {"requests": 0, "streamed": 0, "tool_call_responses": 0, "completion_tokens": 0}
+    
+    app = FastAPI(title="Tianji LLM Stub")
+    
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": settings.llm_model, "object": "model", "owned_by": "stub"}]}
+    
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+    
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        reply = script.respond(messages, body.get("tools") or [])
+        number = next(counter)
+        completion_id = f"chatcmpl-stub-{number}"
+        model = body.get("model", settings.llm_model)
+        tool_calls = [
+            {
+                "id": f"call_{number}_{index}",
+                "type": "function",
+                "function": {"name": call["name"], "arguments": json.dumps(call["arguments"], ensure_ascii=False)},
+            }
+            for index, call in enumerate(reply["tool_calls"])
+        ]
+        pieces = _split_tokens(reply["content"] or "")
+        completion_tokens = len(pieces) + sum(estimate_tokens(call["function"]["arguments"]) for call in tool_calls)
+        usage = {
+            "prompt_tokens": sum(estimate_tokens(str(m.get("content") or "")) for m in messages),
+            "completion_tokens": completion_tokens,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        finish_reason = "tool_calls" if tool_calls else "stop"
+        
+        stats["requests"] += 1
+        stats["completion_tokens"] += completion_tokens
+        if tool_calls:
+            stats["tool_call_responses"] += 1
+        
+        if not body.get("stream"):
+            await asyncio.sleep(first_token_delay + token_delay * completion_tokens)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {
+                        "role": "assistant",
+                        "content": reply["content"],
+                        **({"tool_calls": tool_calls} if tool_calls else {}),
+                    },
+                    "finish_reason": finish_reason,
+                }],
+                "usage": usage,
+            }
+        
+        stats["streamed"] += 1
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+        
+        async def event_stream():
+            def chunk(delta: Dict, finish: Optional[str] = None, **extra) -> str:
+                payload = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+                    **extra,
+                }
+                return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+            
+            await asyncio.sleep(first_token_delay)
+            yield chunk({"role": "assistant", "content": ""})
+            for index, call in enumerate(tool_calls):
+                await asyncio.sleep(token_delay * estimate_tokens(call["function"]["arguments"]))
+                yield chunk({"tool_calls": [{"index": index, **call}]})
+            for piece in pieces:
+                await asyncio.sleep(token_delay)
+                yield chunk({"content": piece})
+            yield chunk({}, finish_reason)
+            if include_usage:
+                payload = {"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                           "choices": [], "usage": usage}
+                yield f"data: {json.dumps(payload)}\n\n"
+            yield "data: [DONE]\n\n"
+        
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+    
+    logger.info(f"LLM替身已创建，首token延迟 {first_token_delay * 1000:.0f}ms，每token延迟 {token_delay * 1000:.0f}ms")
+    return app
+
+
+if __name__ == "__main__":
+    import argparse
+    import uvicorn
+    
+    parser = argparse.ArgumentParser(description="LLM服务替身（OpenAI兼容接口）")
+    parser.add_argument("--script", default=settings.llm_stub_script, help="回复脚本（JSON文件）")
+    parser.add_argument("--first-token-ms", type=float, default=settings.llm_stub_first_token_ms)
+    parser.add_argument("--token-ms", type=float, default=settings.llm_stub_token_ms)
+    parser.add_argument("--answer-tokens", type=int, default=settings.llm_stub_answer_tokens)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    args = parser.parse_args()
+    
+    stub_script = StubLLMScript.from_file(args.script) if args.script else StubLLMScript(answer_tokens=args.answer_tokens)
+    uvicorn.run(
+        create_llm_stub_app(stub_script, first_token_ms=args.first_token_ms, token_ms=args.token_ms),
+        host=args.host,
+        port=args.port
+    )
@@ -0,0 +1,272 @@
+"""
+工具结果序列化：把工具返回值压缩为紧凑文本，并控制token预算
+
+工具结果直接用 json.dumps(indent=2) 写入ToolMessage，缩进本身就会明显增加prompt token，
+search_courses 还会带上包含大纲的完整课程文档。这里按工具做固定的字段投影，
+同构列表输出为行式表格，其他结构输出为紧凑JSON；超出预算时截断并写明截断标记，
+同时统计相对原始序列化节省的token数。
+
+使用示例：
+    from agent.serialization import ToolResultSerializer
+    
+    serializer = ToolResultSerializer()
+    contents, used = serializer.serialize_step(
+        ["search_courses", "get_user_learning_profile"],
+        [search_results, profile],
+        remaining_budget=4000
+    )
+"""
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from loguru import logger
+from config import settings
+
+
+# 每次工具调用至少保留的token数，保证预算耗尽时LLM仍能看到结果概要
+MIN_TOOL_TOKENS = 64
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数
+    
+    中文等CJK字符约1个token，其余字符约4个字符1个token。
+    只用于预算控制，不追求与具体模型的分词器完全一致。
+    
+    Args:
+        text: 文本
+    
+    Returns:
+        估算的token数
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _clip(value: Any, max_chars: int) -> Any:
+    """截断过长的字符串字段"""
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[:max_chars] + "…"
+    return value
+
+
+def _score(distance: Optional[float]) -> Optional[float]:
+    """把余弦距离转换为相似度分数"""
+    if distance is None:
+        return None
+    return round(1 - distance, 3)
+
+
+def _project_search_result(item: Dict) -> Dict:
+    """search_courses 结果投影"""
+    metadata = item.get("metadata") or {}
+    return {
+        "course_id": metadata.get("course_id"),
+        "name": metadata.get("course_name"),
+        "category": metadata.get("category"),
+        "price": metadata.get("price"),
+        "score": _score(item.get("distance")),
+        "text": _clip(item.get("text", ""), settings.tool_result_text_chars),
+    }
+
+
+def _project_lesson(item: Dict) -> Dict:
+    """课表行投影"""
+    return {
+        "course_id": item.get("courseId"),
+        "name": item.get("courseName"),
+        "status": item.get("status"),
+        "learned": item.get("learnedSections"),
+        "sections": item.get("sections"),
+        "latest_section": item.get("latestSectionName"),
+        "latest_learn_time": item.get("latestLearnTime"),
+    }
+
+
+def _project_learning_record(item: Dict) -> Dict:
+    """学习记录投影"""
+    return {
+        "section_id": item.get("sectionId"),
+        "finished": item.get("finished"),
+        "moment": item.get("moment"),
+        "finish_time": item.get("finishTime"),
+    }
+
+
+def _project_course_detail(item: Dict) -> Dict:
+    """课程详情投影：大纲只保留章名"""
+    if item.get("error"):
+        return {"id": item.get("id"), "error": item["error"]}
+    chapters = [chapter.get("name", "") for chapter in item.get("catalogue") or []]
+    return {
+        "id": item.get("id"),
+        "name": item.get("name"),
+        "introduce": _clip(item.get("courseIntroduce"), settings.tool_result_text_chars),
+        "use_people": _clip(item.get("usePeople"), settings.tool_result_text_chars),
+        "chapters": " / ".join(chapters),
+    }
+
+
+def _project_profile(profile: Dict) -> Dict:
+    """学习画像投影"""
+    # 摘要画像已经足够紧凑，原始画像（raw=true）只保留课表的投影，去掉重复的 learning/finished 列表
+    if "lessons" not in profile:
+        return profile
+    return {
+        "total_courses": profile.get("total_courses"),
+        "lessons": [_project_lesson(lesson) for lesson in profile.get("lessons") or []],
+    }
+
+
+# 工具名称 -> (列表元素的字段投影, 整体结果的投影)
+_PROJECTIONS: Dict[str, Tuple[Optional[Callable[[Dict], Dict]], Optional[Callable[[Any], Any]]]] = {
+    "search_courses": (_project_search_result, None),
+    "get_user_purchased_courses": (_project_lesson, None),
+    "get_user_learning_records": (_project_learning_record, None),
+    "get_course_details": (_project_course_detail, None),
+    "get_user_learning_profile": (None, _project_profile),
+}
+
+
+class ToolResultSerializer:
+    """工具结果序列化器"""
+    
+    def __init__(self):
+        """初始化序列化器"""
+        self.stats = {
+            "calls": 0,
+            "baseline_tokens": 0,
+            "output_tokens": 0,
+            "saved_tokens": 0,
+            "truncated": 0,
+        }
+    
+    def serialize_step(self, tool_names: List[str], results: List[Any], remaining_budget: int) -> Tuple[List[str], int]:
+        """
+        序列化一轮工具调用的全部结果
+        
+        本轮剩余预算在各工具调用间平均分配，每个调用同时受工具自身预算限制。
+        
+        Args:
+            tool_names: 工具名称列表
+            results: 工具返回值列表（与工具名称一一对应）
+            remaining_budget: 本次对话剩余的工具结果token预算
+        
+        Returns:
+            (序列化后的文本列表, 本轮使用的token数)
+        """
+        if not results:
+            return [], 0
+        share = max(remaining_budget, 0) // len(results)
+        contents = []
+        used = 0
+        for tool_name, result in zip(tool_names, results):
+            budget = max(MIN_TOOL_TOKENS, min(self._tool_budget(tool_name), share))
+            content = self.serialize(tool_name, result, budget)
+            used += estimate_tokens(content)
+            contents.append(content)
+        return contents, used
+    
+    def serialize(self, tool_name: str, result: Any, budget: int) -> str:
+        """
+        序列化单个工具结果
+        
+        Args:
+            tool_name: 工具名称
+            result: 工具返回值
+            budget: token预算
+        
+        Returns:
+            序列化后的文本
+        """
+        if isinstance(result, str):
+            content, truncated = self._truncate_text(result, budget)
+            self._record(estimate_tokens(result), content, truncated)
+            return content
+        
+        baseline = estimate_tokens(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+        item_projection, result_projection = _PROJECTIONS.get(tool_name, (None, None))
+        if result_projection:
+            result = result_projection(result)
+        if isinstance(result, list) and item_projection:
+            result = [item_projection(item) if isinstance(item, dict) else item for item in result]
+        
+        if isinstance(result, list) and result and all(isinstance(item, dict) for item in result):
+            content, truncated = self._serialize_rows(result, budget)
+        else:
+            content, truncated = self._truncate_text(self._compact_json(result), budget)
+        
+        self._record(baseline, content, truncated)
+        return content
+    
+    def _serialize_rows(self, rows: List[Dict], budget: int) -> Tuple[str, bool]:
+        """
+        把同构字典列表输出为行式表格：第一行为字段名，之后每行一条记录
+        
+        超出预算时丢弃末尾的记录并追加截断标记。
+        """
+        fields = list(dict.fromkeys(key for row in rows for key in row))
+        header = "fields: " + "|".join(fields)
+        lines = [header]
+        tokens = estimate_tokens(header)
+        for index, row in enumerate(rows):
+            line = "|".join(self._format_cell(row.get(field)) for field in fields)
+            line_tokens = estimate_tokens(line)
+            if tokens + line_tokens > budget and index > 0:
+                lines.append(f"…[已截断: 省略 {len(rows) - index}/{len(rows)} 条记录]")
+                return "\n".join(lines), True
+            if tokens + line_tokens > budget:
+                # 单条记录就超出预算，截断这一条
+                line, _ = self._truncate_text(line, budget - tokens)
+                lines.append(line)
+                if len(rows) > 1:
+                    lines.append(f"…[已截断: 省略 {len(rows) - 1}/{len(rows)} 条记录]")
+                return "\n".join(lines), True
+            lines.append(line)
+            tokens += line_tokens
+        return "\n".join(lines), False
+    
+    def _truncate_text(self, text: str, budget: int) -> Tuple[str, bool]:
+        """按token预算截断文本，截断时追加标记"""
+        total = estimate_tokens(text)
+        if total <= budget:
+            return text, False
+        # 按比例估算可保留的字符数，再逐步收缩到预算以内
+        keep = max(int(len(text) * budget / total) - 16, 0)
+        while keep > 0 and estimate_tokens(text[:keep]) > budget - 16:
+            keep = int(keep * 0.9)
+        return f"{text[:keep]}…[已截断: 原文约 {total} tokens]", True
+    
+    @staticmethod
+    def _format_cell(value: Any) -> str:
+        """格式化表格单元格"""
+        if value is None:
+            return ""
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        return str(value).replace("\n", " / ").replace("|", "｜")
+    
+    @staticmethod
+    def _compact_json(value: Any) -> str:
+        """紧凑JSON（无缩进和多余空格）"""
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+    
+    def _tool_budget(self, tool_name: str) -> int:
+        """获取工具自身的token预算"""
+        return settings.tool_result_token_budgets.get(tool_name, settings.tool_result_token_budget)
+    
+    def _record(self, baseline_tokens: int, content: str, truncated: bool):
+        """记录统计信息"""
+        output_tokens = estimate_tokens(content)
+        self.stats["calls"] += 1
+        self.stats["baseline_tokens"] += baseline_tokens
+        self.stats["output_tokens"] += output_tokens
+        self.stats["saved_tokens"] += max(baseline_tokens - output_tokens, 0)
+        if truncated:
+            self.stats["truncated"] += 1
+        logger.debug(f"工具结果序列化: 原始约 {baseline_tokens} tokens，输出约 {output_tokens} tokens")
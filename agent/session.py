@@ -0,0 +1,180 @@
+"""
+多轮会话存储：按 session_id 保存对话历史，支持过期淘汰
+
+每次请求只带当前问题，追问时画像和检索都要重新做一遍。会话存储保存最近几轮的消息
+（工具结果只保留紧凑的引用）和更早轮次的滚动摘要，下一轮直接作为上下文使用。
+
+存储后端：
+- memory: 进程内LRU，重启后丢失
+- sqlite: 持久化到 session_db_path，多个进程可共享
+
+使用示例：
+    from agent.session import SessionStore
+    
+    store = SessionStore()
+    session = store.load("abc")  # {"user_id", "summary", "messages"} 或 None
+    store.save("abc", user_id=123, summary="", messages=messages)
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+from loguru import logger
+from config import settings
+
+
+class SessionStore:
+    """会话存储（内存或SQLite）"""
+    
+    def __init__(
+        self,
+        backend: Optional[str] = None,
+        db_path: Optional[str] = None,
+        ttl_seconds: Optional[float] = None,
+        max_sessions: Optional[int] = None
+    ):
+        """
+        初始化会话存储
+        
+        Args:
+            backend: 存储后端 memory / sqlite，默认使用配置
+            db_path: SQLite文件路径，默认使用配置
+            ttl_seconds: 会话空闲多久后过期（秒），默认使用配置
+            max_sessions: 内存后端最多保存的会话数，超出时淘汰最久未使用的会话
+        """
+        self.backend = backend or settings.session_backend
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else settings.session_ttl_seconds
+        self.max_sessions = max_sessions or settings.session_max_sessions
+        self._lock = threading.Lock()
+        
+        if self.backend == "sqlite":
+            self.db_path = db_path or settings.session_db_path
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    user_id INTEGER,
+                    summary TEXT,
+                    messages TEXT,
+                    updated_at REAL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at)")
+            self._conn.commit()
+        elif self.backend == "memory":
+            self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+        else:
+            raise ValueError(f"不支持的会话存储后端: {self.backend}")
+        logger.info(f"会话存储初始化完成，后端: {self.backend}，过期时间: {self.ttl_seconds}s")
+    
+    def load(self, session_id: str) -> Optional[Dict]:
+        """
+        读取会话
+        
+        Args:
+            session_id: 会话ID
+        
+        Returns:
+            会话数据 {"user_id", "summary", "messages"}，不存在或已过期时返回None
+        """
+        expire_before = time.time() - self.ttl_seconds
+        with self._lock:
+            if self.backend == "memory":
+                session = self._sessions.get(session_id)
+                if not session or session["updated_at"] < expire_before:
+                    self._sessions.pop(session_id, None)
+                    return None
+                self._sessions.move_to_end(session_id)
+                user_id, summary, messages = session["user_id"], session["summary"], session["messages"]
+            else:
+                row = self._conn.execute(
+                    "SELECT user_id, summary, messages FROM sessions WHERE session_id = ? AND updated_at >= ?",
+                    (session_id, expire_before)
+                ).fetchone()
+                if not row:
+                    return None
+                user_id, summary, messages = row
+        return {
+            "user_id": user_id,
+            "summary": summary or "",
+            "messages": messages_from_dict(json.loads(messages)) if messages else [],
+        }
+    
+    def save(self, session_id: str, user_id: int, summary: str, messages: List[BaseMessage]):
+        """
+        保存会话（覆盖原有内容）并淘汰过期会话
+        
+        Args:
+            session_id: 会话ID
+            user_id: 用户ID
+            summary: 更早轮次的滚动摘要
+            messages: 保留的最近消息
+        """
+        now = time.time()
+        payload = json.dumps(messages_to_dict(messages), ensure_ascii=False)
+        with self._lock:
+            if self.backend == "memory":
+                self._sessions[session_id] = {
+                    "user_id": user_id,
+                    "summary": summary,
+                    "messages": payload,
+                    "updated_at": now,
+                }
+                self._sessions.move_to_end(session_id)
+                self._evict_memory(now)
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, user_id, summary, messages, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (session_id, user_id, summary, payload, now)
+                )
+                self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl_seconds,))
+                self._conn.commit()
+    
+    def delete(self, session_id: str):
+        """
+        删除会话
+        
+        Args:
+            session_id: 会话ID
+        """
+        with self._lock:
+            if self.backend == "memory":
+                self._sessions.pop(session_id, None)
+            else:
+                self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self._conn.commit()
+    
+    def count(self) -> int:
+        """获取未过期的会话数量"""
+        expire_before = time.time() - self.ttl_seconds
+        with self._lock:
+            if self.backend == "memory":
+                return sum(1 for session in self._sessions.values() if session["updated_at"] >= expire_before)
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE updated_at >= ?", (expire_before,)
+            ).fetchone()[0]
+    
+    def close(self):
+        """关闭存储"""
+        if self.backend == "sqlite":
+            with self._lock:
+                self._conn.close()
+    
+    def _evict_memory(self, now: float):
+        """淘汰内存后端中过期的会话，以及超出数量上限的最久未使用会话"""
+        expire_before = now - self.ttl_seconds
+        # OrderedDict 按最近使用排序，过期的会话都在前面
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session["updated_at"] >= expire_before and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
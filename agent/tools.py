@@ -1,10 +1,21 @@
 """
 MCP工具：封装各种工具函数供Agent调用
 """
-from typing import Dict, List, Optional
+import asyncio
+import functools
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Tuple
 from loguru import logger
+from config import settings
+from tracing import bind
 from services.java_client import JavaServiceClient
+from services.course_store import CourseStore
+from services.candidates import CandidateStore
 from rag.vector_store import VectorStore
+from rag.knn_graph import CourseKnnGraph
+from rag.category_index import CategoryIndex
+from services.profile_summary import summarize_learning_profile
 
 
 class MCPTools:
@@ -14,25 +25,83 @@ class MCPTools:
         """初始化工具"""
         self.java_client = JavaServiceClient()
         self.vector_store = VectorStore()
+        self.course_store = CourseStore()
+        self.candidate_store = CandidateStore()
+        self.knn_graph = CourseKnnGraph()
+        self.category_index = CategoryIndex()
+        
+        # 用户已购买课程ID的缓存：用户ID -> (写入时间, 课程ID集合)
+        self._owned_courses: "OrderedDict[int, Tuple[float, FrozenSet[int]]]" = OrderedDict()
+        # 原始学习画像的短期缓存：用户ID -> (写入时间, 画像)
+        self._profiles: "OrderedDict[int, Tuple[float, Dict]]" = OrderedDict()
     
-    async def get_user_learning_profile(self, user_id: int) -> Dict:
+    async def get_user_learning_profile(self, user_id: int, raw: bool = False, courses_only: bool = False) -> Dict:
         """
         获取用户学习画像
         
+        默认返回紧凑的画像特征（各状态课程数、学习进度、近期活跃度、主要分类、
+        停滞课程和课程ID），避免把完整课表塞进prompt。
+        
         Args:
             user_id: 用户ID
+            raw: 是否返回Java端的原始画像数据
+            courses_only: 只返回课程和学习状态相关的特征（不含学习进度、近期活跃度和停滞课程），
+                优先于 raw；回答会写入缓存的请求使用，保证回答只依赖画像指纹包含的字段
             
         Returns:
             用户学习画像
         """
         logger.info(f"获取用户 {user_id} 的学习画像")
         try:
-            profile = await self.java_client.get_user_learning_profile(user_id)
-            return profile
+            profile = await self.fetch_learning_profile(user_id)
+            if raw and not courses_only:
+                return profile
+            summary = summarize_learning_profile(profile, self._get_course_categories(profile))
+            if courses_only:
+                return {key: summary[key] for key in ("total_courses", "status_counts", "top_categories", "course_ids")}
+            return summary
         except Exception as e:
             logger.error(f"获取用户画像失败: {e}")
             return {"error": str(e)}
     
+    async def fetch_learning_profile(self, user_id: int) -> Dict:
+        """
+        获取用户原始学习画像（优先读取短期缓存）
+        
+        同一请求中计算回答缓存键和画像工具都需要画像，缓存 profile_cache_ttl_seconds 秒避免重复请求Java端。
+        
+        Args:
+            user_id: 用户ID
+        
+        Returns:
+            原始画像
+        
+        Raises:
+            Exception: 请求Java端失败
+        """
+        cached = self._profiles.get(user_id)
+        if cached and time.monotonic() - cached[0] < settings.profile_cache_ttl_seconds:
+            self._profiles.move_to_end(user_id)
+            return cached[1]
+        profile = await self.java_client.get_user_learning_profile(user_id)
+        self._remember_owned_courses(user_id, profile.get("lessons") or [])
+        if settings.profile_cache_ttl_seconds > 0:
+            self._profiles[user_id] = (time.monotonic(), profile)
+            self._profiles.move_to_end(user_id)
+            while len(self._profiles) > settings.profile_cache_max_users:
+                self._profiles.popitem(last=False)
+        return profile
+    
+    def _get_course_categories(self, profile: Dict) -> Dict[int, str]:
+        """从知识库元数据中查询课表课程的分类路径"""
+        course_ids = [l["courseId"] for l in profile.get("lessons", []) if l.get("courseId") is not None]
+        try:
+            metadata_map = self.vector_store.get_course_metadata(course_ids)
+        except Exception as e:
+            logger.warning(f"查询课程分类失败，画像将不包含分类统计: {e}")
+            return {}
+        return {course_id: metadata.get("category", "") for course_id, metadata in metadata_map.items()}
+    
     async def get_user_purchased_courses(self, user_id: int) -> List[Dict]:
         """
         获取用户购买的课程
@@ -46,6 +115,7 @@ class MCPTools:
         logger.info(f"获取用户 {user_id} 购买的课程")
         try:
             courses = await self.java_client.get_user_purchased_courses(user_id)
+            self._remember_owned_courses(user_id, courses)
             return courses
         except Exception as e:
             logger.error(f"获取用户课程失败: {e}")
@@ -70,41 +140,240 @@ class MCPTools:
             logger.error(f"获取学习记录失败: {e}")
             return []
     
-    async def search_courses(self, query: str, top_k: int = 5) -> List[Dict]:
+    async def search_courses(self, query: str, top_k: int = 5, user_id: Optional[int] = None) -> List[Dict]:
         """
         在RAG知识库中搜索相关课程
         
         Args:
             query: 搜索查询
             top_k: 返回前k个结果
+            user_id: 用户ID（可选），指定时排除该用户已购买的课程
             
         Returns:
-            搜索结果列表
+            搜索结果列表；长文档只返回与查询相关的摘录，完整内容可通过 get_course_details 获取
         """
         logger.info(f"搜索课程: {query}")
+        exclude = await self._get_owned_course_ids(user_id) if user_id is not None else None
         try:
-            results = self.vector_store.search(query, top_k=top_k)
+            # 向量化和检索是CPU密集的同步操作，放到线程池中执行，避免阻塞并发的其他工具调用
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(
+                None,
+                bind(functools.partial(
+                    self.vector_store.search,
+                    query,
+                    top_k=top_k,
+                    snippet_chars=settings.search_snippet_chars or None,
+                    exclude_course_ids=exclude
+                ))
+            )
             return results
         except Exception as e:
             logger.error(f"搜索课程失败: {e}")
             return []
     
+    async def similar_courses(self, course_ids: List[int], k: int = 5, user_id: Optional[int] = None) -> List[Dict]:
+        """
+        查询与指定课程最相似的课程（读取预计算的相似度图，不做向量检索）
+        
+        Args:
+            course_ids: 课程ID列表（如用户刚学完的课程）
+            k: 每门课程返回的相似课程数
+            user_id: 用户ID（可选），指定时排除该用户已购买的课程
+        
+        Returns:
+            相似课程列表（source、id、name、category、score），source 为对应的输入课程ID
+        """
+        logger.info(f"查询相似课程: {course_ids}")
+        owned = await self._get_owned_course_ids(user_id) if user_id is not None else None
+        exclude = set(course_ids) | set(owned or ())
+        # 图中每门课程保存了 knn_graph_k 个邻居，排除之后再截取前k个
+        neighbors = {
+            source: [(course_id, score) for course_id, score in items if course_id not in exclude][:k]
+            for source, items in self.knn_graph.similar(course_ids).items()
+        }
+        metadata_map = self.vector_store.get_course_metadata(
+            list({course_id for items in neighbors.values() for course_id, _ in items})
+        )
+        return [
+            {
+                "source": source,
+                "id": course_id,
+                "name": metadata_map[course_id].get("course_name", ""),
+                "category": metadata_map[course_id].get("category", ""),
+                "score": round(score, 3),
+            }
+            for source, items in neighbors.items()
+            for course_id, score in items
+            if course_id in metadata_map
+        ]
+    
+    async def browse_category(self, category: Optional[str] = None, limit: int = 20) -> Dict:
+        """
+        浏览课程分类（读取预计算的分类索引）
+        
+        Args:
+            category: 分类路径（如"后端开发 > Java"）或分类名称，为空时返回顶级分类
+            limit: 最多返回的课程数
+        
+        Returns:
+            {"path", "children", "course_count", "courses"}，子分类含课程数，课程按难度排序；
+            找不到分类时返回 {"error": ...}
+        """
+        logger.info(f"浏览课程分类: {category or '(顶级)'}")
+        result = self.category_index.browse(category, limit)
+        if result is None:
+            return {"error": f"未找到分类: {category}"}
+        return result
+    
+    async def learning_path(self, topic: str, user_id: Optional[int] = None, per_stage: int = 3) -> Dict:
+        """
+        生成某个方向的学习路径：按入门→基础→进阶→高级分阶段列出课程
+        
+        Args:
+            topic: 学习方向（分类名称或包含分类名称的问题）
+            user_id: 用户ID（可选），指定时标记该用户已购买的课程
+            per_stage: 每个阶段最多返回的课程数
+        
+        Returns:
+            {"path", "stages": [{"stage", "course_count", "courses"}]}；找不到分类时返回 {"error": ...}
+        """
+        logger.info(f"生成学习路径: {topic}")
+        result = self.category_index.learning_path(topic, per_stage)
+        if result is None:
+            return {"error": f"未找到与“{topic}”匹配的分类"}
+        owned = await self._get_owned_course_ids(user_id) if user_id is not None else None
+        if owned is not None:
+            for stage in result["stages"]:
+                for course in stage["courses"]:
+                    course["owned"] = course["id"] in owned
+        return result
+    
+    async def _get_owned_course_ids(self, user_id: int) -> Optional[FrozenSet[int]]:
+        """
+        获取用户已购买的课程ID（优先读取缓存）
+        
+        Args:
+            user_id: 用户ID
+        
+        Returns:
+            课程ID集合，获取失败时返回None（检索时不做排除）
+        """
+        cached = self._owned_courses.get(user_id)
+        if cached and time.monotonic() - cached[0] < settings.owned_courses_cache_ttl_seconds:
+            self._owned_courses.move_to_end(user_id)
+            return cached[1]
+        try:
+            lessons = await self.java_client.get_user_purchased_courses(user_id)
+        except Exception as e:
+            logger.warning(f"获取用户 {user_id} 已购买的课程失败，检索结果不排除已购课程: {e}")
+            return None
+        return self._remember_owned_courses(user_id, lessons)
+    
+    def _remember_owned_courses(self, user_id: int, lessons: List[Dict]) -> FrozenSet[int]:
+        """把课表中的课程ID写入缓存（画像和购买课程工具取到课表时顺便更新）"""
+        owned = frozenset(l["courseId"] for l in lessons if isinstance(l, dict) and l.get("courseId") is not None)
+        self._owned_courses[user_id] = (time.monotonic(), owned)
+        self._owned_courses.move_to_end(user_id)
+        while len(self._owned_courses) > settings.owned_courses_cache_max_users:
+            self._owned_courses.popitem(last=False)
+        return owned
+    
+    def invalidate_owned_courses(self, user_ids: List[int]):
+        """
+        清除用户已购买课程和学习画像的缓存（课表变更时调用）
+        
+        Args:
+            user_ids: 用户ID列表
+        """
+        for user_id in user_ids:
+            self._owned_courses.pop(user_id, None)
+            self._profiles.pop(user_id, None)
+    
+    async def get_course_details(self, course_ids: List[int]) -> List[Dict]:
+        """
+        批量获取课程详情（优先读取本地课程存储，未命中的课程并发请求Java端）
+        
+        Args:
+            course_ids: 课程ID列表
+        
+        Returns:
+            课程详情列表，顺序与输入一致；获取失败的课程包含 error 字段
+        """
+        logger.info(f"获取课程详情: {course_ids}")
+        records = self.course_store.get_many(course_ids)
+        details = {
+            course_id: record["detail"]
+            for course_id, record in records.items()
+            if record and record["detail"] is not None
+        }
+        semaphore = asyncio.Semaphore(settings.sync_detail_concurrency)
+        
+        async def fetch(course_id: int) -> Tuple[int, Dict]:
+            async with semaphore:
+                try:
+                    detail = await self.java_client.get_course_detail(course_id)
+                    self.course_store.save(detail if detail.get("id") else {**detail, "id": course_id}, detail)
+                    return course_id, detail
+                except Exception as e:
+                    logger.error(f"获取课程 {course_id} 详情失败: {e}")
+                    return course_id, {"id": course_id, "error": str(e)}
+        
+        missing = [course_id for course_id in dict.fromkeys(course_ids) if course_id not in details]
+        details.update(await asyncio.gather(*(fetch(course_id) for course_id in missing)))
+        return [details[course_id] for course_id in course_ids]
+    
+    async def get_recommended_candidates(self, user_id: int, top_k: int = 10) -> List[Dict]:
+        """
+        读取离线预计算的候选课程（按画像向量与课程的相似度排序，已排除课表中的课程）
+        
+        Args:
+            user_id: 用户ID
+            top_k: 返回前k门课程
+        
+        Returns:
+            候选课程列表（id、name、category、score）；没有预计算结果时返回空列表
+        """
+        logger.info(f"读取用户 {user_id} 的预计算候选课程")
+        entry = self.candidate_store.get(user_id)
+        if not entry:
+            return []
+        course_ids = entry["course_ids"][:top_k]
+        # 只返回知识库中仍然存在的课程（计算之后可能已下架）
+        metadata_map = self.vector_store.get_course_metadata(course_ids)
+        return [
+            {
+                "id": course_id,
+                "name": metadata_map[course_id].get("course_name", ""),
+                "category": metadata_map[course_id].get("category", ""),
+                "score": round(score, 3),
+            }
+            for course_id, score in zip(course_ids, entry["scores"])
+            if course_id in metadata_map
+        ]
+    
     async def close(self):
         """关闭工具"""
         await self.java_client.close()
+        self.course_store.close()
+        self.candidate_store.close()
 
 
 # 工具描述（供LangGraph使用）
 TOOLS_DESCRIPTION = [
     {
         "name": "get_user_learning_profile",
-        "description": "获取用户的学习画像，包括学习时长、学习习惯、学习进度等信息",
+        "description": "获取用户的学习画像摘要，包括各状态课程数、学习进度、近期活跃度、主要分类和停滞课程",
         "parameters": {
             "type": "object",
             "properties": {
                 "user_id": {
                     "type": "integer",
                     "description": "用户ID"
+                },
+                "raw": {
+                    "type": "boolean",
+                    "description": "是否返回完整的原始课表数据，默认false（仅在摘要不够用时使用）"
                 }
             },
             "required": ["user_id"]
@@ -144,7 +413,7 @@ TOOLS_DESCRIPTION = [
     },
     {
         "name": "search_courses",
-        "description": "在课程知识库中搜索相关课程，用于推荐和匹配",
+        "description": "在课程知识库中搜索相关课程，用于推荐和匹配；结果只包含与查询相关的摘录，需要完整内容时调用 get_course_details",
         "parameters": {
             "type": "object",
             "properties": {
@@ -155,10 +424,109 @@ TOOLS_DESCRIPTION = [
                 "top_k": {
                     "type": "integer",
                     "description": "返回前k个结果，默认5"
+                },
+                "user_id": {
+                    "type": "integer",
+                    "description": "用户ID（可选），指定时排除该用户已购买的课程"
                 }
             },
             "required": ["query"]
         }
+    },
+    {
+        "name": "get_course_details",
+        "description": "批量获取课程详情（课程介绍、适用人群、大纲等），优先读取本地缓存",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "course_ids": {
+                    "type": "array",
+                    "items": {"type": "integer"},
+                    "description": "课程ID列表"
+                }
+            },
+            "required": ["course_ids"]
+        }
+    },
+    {
+        "name": "get_recommended_candidates",
+        "description": "读取为用户离线预计算的候选课程（与已学课程最相似、且不在课表中的课程，按相似度排序）",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "user_id": {
+                    "type": "integer",
+                    "description": "用户ID"
+                },
+                "top_k": {
+                    "type": "integer",
+                    "description": "返回前k门课程，默认10"
+                }
+            },
+            "required": ["user_id"]
+        }
+    },
+    {
+        "name": "similar_courses",
+        "description": "查询与指定课程最相似的课程（如用户学完某门课后的下一步推荐），读取预计算的相似度图",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "course_ids": {
+                    "type": "array",
+                    "items": {"type": "integer"},
+                    "description": "课程ID列表"
+                },
+                "k": {
+                    "type": "integer",
+                    "description": "每门课程返回的相似课程数，默认5"
+                },
+                "user_id": {
+                    "type": "integer",
+                    "description": "用户ID（可选），指定时排除该用户已购买的课程"
+                }
+            },
+            "required": ["course_ids"]
+        }
+    },
+    {
+        "name": "browse_category",
+        "description": "浏览课程分类树：返回子分类（含课程数）和该分类下按难度排序的课程",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "category": {
+                    "type": "string",
+                    "description": "分类路径（如\"后端开发 > Java\"）或分类名称，为空时返回顶级分类"
+                },
+                "limit": {
+                    "type": "integer",
+                    "description": "最多返回的课程数，默认20"
+                }
+            },
+            "required": []
+        }
+    },
+    {
+        "name": "learning_path",
+        "description": "生成某个方向的学习路径：按入门、基础、进阶、高级分阶段列出课程",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "topic": {
+                    "type": "string",
+                    "description": "学习方向，如\"Java\"、\"前端开发\""
+                },
+                "user_id": {
+                    "type": "integer",
+                    "description": "用户ID（可选），指定时标记该用户已购买的课程"
+                },
+                "per_stage": {
+                    "type": "integer",
+                    "description": "每个阶段最多返回的课程数，默认3"
+                }
+            },
+            "required": ["topic"]
+        }
     }
 ]
-
@@ -13,7 +13,7 @@
     # 配置会自动从 .env 文件或环境变量读取
 """
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, Optional
 
 
 class Settings(BaseSettings):
@@ -30,7 +30,44 @@ class Settings(BaseSettings):
     
     java_service_api_prefix: str = "/api"
     """API路径前缀，如：/api"""
-    
+
+    java_service_mode: str = "live"
+    """
+    Java服务访问模式（用于离线压测和基准测试）
+    - live: 直接访问真实Java服务（默认）
+    - record: 访问真实Java服务，同时把响应录制到 java_stub_fixture_dir
+    - replay: 从 java_stub_fixture_dir 回放录制的响应
+    - synthetic: 使用按规模生成的合成数据
+    详见 services/java_stub.py
+    """
+
+    java_stub_fixture_dir: str = "./data/java_fixtures"
+    """录制/回放模式下fixture文件的存放目录"""
+
+    java_stub_courses: int = 200
+    """合成模式：课程数量"""
+
+    java_stub_users: int = 100
+    """合成模式：用户数量（用户ID为 1..N）"""
+
+    java_stub_chapters: int = 5
+    """合成模式：每门课程的章数"""
+
+    java_stub_sections: int = 4
+    """合成模式：每章的节数"""
+
+    java_stub_latency_ms: float = 0.0
+    """合成模式：每个请求注入的基础延迟（毫秒）"""
+
+    java_stub_latency_jitter_ms: float = 0.0
+    """合成模式：延迟抖动上限（毫秒）"""
+
+    java_stub_error_rate: float = 0.0
+    """合成模式：注入500错误的概率（0~1）"""
+
+    java_stub_seed: int = 42
+    """合成模式：随机种子，相同种子生成相同数据"""
+
     # ========== LLM配置 ==========
     openai_api_key: Optional[str] = None
     """
@@ -60,10 +97,136 @@ class Settings(BaseSettings):
     详见 LLM_CONFIG.md
     """
     
+    llm_router_model: Optional[str] = None
+    """
+    路由模型：决定调用哪些工具的Agent步骤使用的快速、便宜的模型（如 gpt-4o-mini、deepseek-chat）
+    为空时不分层，所有步骤都使用回答模型；路由模型的工具调用校验失败时自动改用回答模型
+    """
+    
+    llm_answer_model: Optional[str] = None
+    """生成最终回答的模型，为空时使用 llm_model"""
+    
+    llm_router_early_stop_chars: int = 200
+    """
+    路由模型输出的文本达到多少字符且仍没有工具调用时提前停止生成，交给回答模型重新决定
+    部分模型会在工具调用前先输出一段说明文字，阈值过小会把这类输出截断、丢掉其后的工具调用；设为0时不提前停止
+    """
+    
+    # ========== LLM服务替身（离线压测） ==========
+    llm_stub_first_token_ms: float = 200
+    """LLM替身（agent/llm_stub.py）返回第一个token前的延迟（毫秒）"""
+    
+    llm_stub_token_ms: float = 15
+    """LLM替身每输出一个token的延迟（毫秒）"""
+    
+    llm_stub_answer_tokens: int = 150
+    """LLM替身默认回答的长度（token数）"""
+    
+    llm_stub_script: Optional[str] = None
+    """LLM替身的回复脚本（JSON文件），为空时使用默认脚本：先调用画像和检索工具，再给出回答"""
+    
+    # ========== LLM调用调度 ==========
+    llm_max_concurrency: int = 8
+    """同时进行中的LLM调用数上限，超出的调用按优先级排队"""
+    
+    llm_requests_per_minute: float = 0
+    """每分钟LLM请求数上限（令牌桶），0表示不限制；按服务商配额设置"""
+    
+    llm_tokens_per_minute: float = 0
+    """每分钟LLM token数上限（令牌桶，按prompt估算加预计输出），0表示不限制"""
+    
+    llm_completion_token_estimate: int = 800
+    """排队时预估的单次输出token数，调用结束后按实际用量修正"""
+    
+    llm_max_retries: int = 3
+    """限流（429）或临时错误时的最大重试次数"""
+    
+    llm_retry_backoff_seconds: float = 2.0
+    """服务商没有返回 Retry-After 时的初始退避时间（秒），每次重试翻倍"""
+    
+    # ========== Agent配置 ==========
+    tool_timeout_seconds: float = 20.0
+    """单个工具调用的默认超时时间（秒），超时后取消该调用并把超时信息返回给LLM"""
+    
+    tool_timeouts: Dict[str, float] = {}
+    """
+    按工具名称覆盖超时时间（秒），环境变量使用JSON格式，如：
+    TOOL_TIMEOUTS={"search_courses": 5, "get_user_learning_records": 10}
+    """
+    
+    agent_max_steps: int = 6
+    """单次请求中Agent最多的推理步数（LLM调用次数），达到后用已有信息生成最终回答"""
+    
+    agent_max_tool_calls: int = 12
+    """单次请求中最多执行的工具调用次数，达到后用已有信息生成最终回答"""
+    
+    agent_deadline_seconds: float = 60.0
+    """单次请求的总时间限制（秒），LLM和工具调用的超时都不会超过该截止时间"""
+    
+    agent_finalize_reserve_seconds: float = 10.0
+    """为最终回答预留的时间（秒），推理步骤和工具调用在截止时间前这么久停止"""
+    
+    tool_result_token_budget: int = 1500
+    """单个工具结果写入prompt的token预算，超出时截断并标注"""
+    
+    tool_result_token_budgets: Dict[str, int] = {}
+    """按工具名称覆盖token预算，环境变量使用JSON格式，如：TOOL_RESULT_TOKEN_BUDGETS={"search_courses": 2000}"""
+    
+    tool_turn_token_budget: int = 6000
+    """一次对话中所有工具结果的token总预算，在各工具调用间分配"""
+    
+    tool_result_text_chars: int = 300
+    """工具结果中课程文本、介绍等长文本字段保留的最大字符数"""
+    
+    session_backend: str = "memory"
+    """多轮会话存储后端：memory（进程内）或 sqlite（持久化，多进程共享）"""
+    
+    session_db_path: str = "./data/sessions.db"
+    """会话存储为sqlite时的数据库文件路径"""
+    
+    session_ttl_seconds: float = 1800.0
+    """会话空闲多久后过期（秒）"""
+    
+    session_max_sessions: int = 10000
+    """内存会话存储最多保存的会话数，超出时淘汰最久未使用的会话"""
+    
+    session_max_turns: int = 4
+    """会话中原样保留的最近轮数，更早的轮次合并进滚动摘要"""
+    
+    session_tool_result_chars: int = 300
+    """会话历史中每条工具结果保留的字符数，其余部分省略（需要时由Agent重新调用工具）"""
+    
+    session_summary_chars: int = 500
+    """会话滚动摘要的目标长度（字）"""
+    
+    answer_cache_enabled: bool = True
+    """是否启用语义回答缓存（相似问题、相同画像状态和知识库代次时复用回答）"""
+    
+    answer_cache_similarity_threshold: float = 0.92
+    """回答缓存命中所需的最小查询向量余弦相似度，越高越保守"""
+    
+    answer_cache_ttl_seconds: float = 3600.0
+    """回答缓存条目的有效期（秒）"""
+    
+    answer_cache_max_entries: int = 5000
+    """回答缓存最多保存的条目数"""
+    
+    answer_cache_max_bytes: int = 64 * 1024 * 1024
+    """回答缓存占用内存上限（字节，按向量和文本长度估算）"""
+    
+    fast_path_enabled: bool = True
+    """是否启用快速路径：识别出的推荐类问题并发获取画像和检索课程，只调用一次LLM"""
+    
+    fast_path_top_k: int = 5
+    """快速路径中检索的课程数量"""
+    
     # ========== 向量数据库配置 ==========
     chroma_db_path: str = "./data/chroma_db"
     """ChromaDB向量数据库的存储路径"""
     
+    chroma_reload_grace_seconds: float = 30.0
+    """知识库被其他进程更新、重新打开Chroma后，旧实例保留多久再关闭（秒），期间进行中的查询可以正常完成"""
+    
     embedding_model: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
     """
     嵌入模型名称（用于文本向量化）
@@ -74,6 +237,107 @@ class Settings(BaseSettings):
     详见 LLM_CONFIG.md
     """
     
+    search_snippet_chars: int = 300
+    """
+    Agent检索课程时每条结果保留的摘录字符数（按查询选出最相关的句子和大纲行）
+    设为0时返回完整文档
+    """
+    
+    knn_graph_enabled: bool = True
+    """是否维护课程相似度图（全量同步后重建，增量同步时只重算受影响的课程），供 similar_courses 工具使用"""
+    
+    knn_graph_path: str = "./data/course_knn.npz"
+    """课程相似度图的存储路径"""
+    
+    knn_graph_k: int = 20
+    """相似度图中每门课程保存的相似课程数"""
+    
+    knn_graph_batch_size: int = 1024
+    """建图时每块计算的课程数（每块与全部课程做一次矩阵乘法，块越大越快、占用内存越多）"""
+    
+    category_index_enabled: bool = True
+    """是否维护课程分类索引（分类树和按难度分组的学习路径），供 browse_category / learning_path 工具使用"""
+    
+    category_index_path: str = "./data/category_index.json"
+    """课程分类索引的存储路径"""
+    
+    owned_courses_cache_ttl_seconds: float = 300
+    """用户已购买课程ID的缓存时间（秒），检索时据此排除已购买的课程；课表变更事件会立即清除对应用户的缓存"""
+    
+    owned_courses_cache_max_users: int = 10000
+    """已购买课程缓存最多保存的用户数，超出时淘汰最久未使用的用户"""
+    
+    profile_cache_ttl_seconds: float = 30
+    """用户原始学习画像的缓存时间（秒）：计算回答缓存键时取到的画像，随后Agent的画像工具直接复用；
+    课表变更事件会立即清除对应用户的缓存，设为0关闭"""
+    
+    profile_cache_max_users: int = 2000
+    """学习画像缓存最多保存的用户数，超出时淘汰最久未使用的用户"""
+    
+    kb_snapshot_path: Optional[str] = None
+    """
+    知识库快照文件路径（可选）
+    启动时如果知识库为空且快照文件存在，直接导入快照而不是从Java端同步并重新向量化
+    快照由 python -m rag.snapshot export 生成
+    """
+    
+    # ========== 数据同步配置 ==========
+    course_store_path: str = "./data/course_store.db"
+    """课程本地存储（SQLite）路径，保存课程列表和详情的原始数据，用于条件重验证和本地读取"""
+    
+    sync_debounce_seconds: float = 2.0
+    """课程变更事件的防抖窗口（秒），事件停止到达后多久开始同步"""
+    
+    sync_max_wait_seconds: float = 10.0
+    """课程变更事件从到达到开始同步的最长等待时间（秒），避免持续的事件流导致同步一直被推迟"""
+    
+    sync_max_batch_size: int = 50
+    """每批增量同步的最大课程数"""
+    
+    sync_max_retries: int = 3
+    """增量同步失败的课程最多自动重试的次数，超过后放弃（等待下一次变更事件或全量同步）"""
+    
+    sync_retry_base_seconds: float = 5.0
+    """增量同步失败后第一次重试前的等待时间（秒），之后每次翻倍"""
+    
+    sync_detail_concurrency: int = 8
+    """同步课程和 get_course_details 工具并发请求课程详情的最大数量"""
+    
+    writer_lease_retry_seconds: float = 5.0
+    """多个进程共用知识库目录时，非写入进程尝试接替写入租约的间隔（秒）"""
+    
+    sync_spool_poll_seconds: float = 1.0
+    """写入进程检查其他进程转交的同步请求的间隔（秒）"""
+    
+    # ========== 离线候选推荐 ==========
+    candidate_db_path: str = "./data/candidates.db"
+    """预计算候选课程的存储（SQLite）路径，由 python -m services.candidates refresh 生成"""
+    
+    candidate_top_n: int = 50
+    """每个用户保存的候选课程数"""
+    
+    candidate_batch_size: int = 256
+    """离线任务每批计算的用户数（整批用户的画像向量与课程矩阵做一次矩阵乘法）"""
+    
+    candidate_fetch_concurrency: int = 16
+    """离线任务并发获取用户课表的最大请求数"""
+    
+    # ========== 批量推荐 ==========
+    batch_recommend_checkpoint_dir: str = "./data/batch_jobs"
+    """批量推荐任务的检查点目录（每个任务一个NDJSON文件，用于断点续跑和下载完整结果）"""
+    
+    batch_recommend_max_users: int = 100000
+    """单次批量推荐请求的最大用户数"""
+    
+    batch_recommend_default_query: str = "零基础入门课程"
+    """没有课表的用户使用的检索词"""
+    
+    batch_recommend_llm_concurrency: int = 4
+    """生成推荐理由时同时进行的LLM调用数（另外受LLM调度器的 batch 优先级限制）"""
+    
+    batch_recommend_reason_chars: int = 60
+    """推荐理由的最大字数"""
+    
     # ========== 服务配置 ==========
     server_host: str = "0.0.0.0"
     """FastAPI服务监听地址，0.0.0.0表示监听所有网络接口"""
@@ -81,6 +345,50 @@ class Settings(BaseSettings):
     server_port: int = 8000
     """FastAPI服务监听端口"""
     
+    server_workers: int = 1
+    """生产启动（python serve.py）的工作进程数；模型在 fork 之前加载，各工作进程写时复制共享权重内存"""
+    
+    server_threads_per_worker: int = 0
+    """每个工作进程的计算线程数（嵌入模型推理线程和默认线程池大小），0表示按 CPU核数 / 工作进程数 计算"""
+    
+    server_graceful_timeout: float = 30.0
+    """工作进程平滑退出的等待时间（秒）：停止接收新连接后等待进行中的请求完成，超时后强制结束"""
+    
+    server_boot_timeout: float = 120.0
+    """平滑重启时等待新工作进程启动完成的最长时间（秒），超时后仍继续替换旧进程"""
+    
+    server_max_requests: int = 0
+    """工作进程处理多少个请求后自动重启（防止内存缓慢增长），0表示不限制"""
+    
+    # ========== 运行指标 ==========
+    metrics_enabled: bool = True
+    """是否记录各处理阶段的耗时和计数并在 /metrics 输出（Prometheus 文本格式，需要安装 prometheus-client）"""
+    
+    metrics_multiproc_dir: str = "./data/metrics"
+    """多进程部署（python serve.py）时各工作进程写入指标文件的目录，主进程启动时清空"""
+    
+    # ========== 请求追踪和采样分析 ==========
+    trace_enabled: bool = True
+    """是否记录请求的调用树（span），结束的追踪可在 /debug/traces 查看"""
+    
+    trace_sample_rate: float = 1.0
+    """没有 X-Debug-Trace 请求头的请求按该比例抽样追踪（0~1）；带请求头的请求总是追踪"""
+    
+    trace_buffer_size: int = 200
+    """每个进程保存的最近追踪数（环形缓冲区）"""
+    
+    trace_max_spans: int = 500
+    """单次请求最多记录的span数，超出的只计数（避免批量推荐等长任务的调用树无限增长）"""
+    
+    debug_endpoints_enabled: bool = True
+    """是否开放 /debug/traces 和 /debug/profile"""
+    
+    debug_token: Optional[str] = None
+    """调试接口的访问令牌，设置后请求需带 X-Debug-Token 请求头"""
+    
+    profile_max_seconds: float = 60.0
+    """单次采样分析（/debug/profile）的最长时长（秒）"""
+    
     # ========== 日志配置 ==========
     log_level: str = "INFO"
     """
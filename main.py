@@ -2,16 +2,31 @@
 FastAPI主服务：提供HTTP接口和生命周期管理
 """
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple
 from loguru import logger
+import asyncio
+import json
+import os
 import sys
 
+import metrics
+import profiler
+import tracing
 from config import settings
 from services.data_sync import DataSyncService
+from services.sync_queue import CourseSyncQueue
+from services.candidates import CandidateBuilder
+from services.batch_recommend import BatchCheckpoint, BatchJobRunningError, BatchRecommender
+from services.sync_spool import SyncSpool
 from rag.vector_store import VectorStore
+from rag.snapshot import import_snapshot
+from rag.knn_graph import CourseKnnGraph
+from rag.category_index import CategoryIndex
+from rag.writer_lease import WriterLease
 from agent.graph import CourseRecommendationAgent
 
 
@@ -27,48 +42,151 @@ logger.add(
 # 全局变量
 agent: Optional[CourseRecommendationAgent] = None
 vector_store: Optional[VectorStore] = None
+sync_queue: Optional[CourseSyncQueue] = None
+candidate_builder: Optional[CandidateBuilder] = None
+batch_recommender: Optional[BatchRecommender] = None
+writer_lease: Optional[WriterLease] = None
+sync_spool: Optional[SyncSpool] = None
+_candidate_tasks: set = set()  # 后台刷新任务（保留引用，避免任务被回收）
+_writer_tasks: set = set()  # 等待写入租约、处理暂存同步请求的后台任务
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """
-    应用生命周期管理
-    在启动时自动同步数据，关闭时清理资源
+async def prepare_knowledge_base(vector_store: VectorStore) -> Tuple[Optional[CourseKnnGraph], Optional[CategoryIndex]]:
     """
-    global agent, vector_store
+    准备知识库：知识库为空时导入快照或从Java端同步，并确保相似度图和分类索引与知识库一致
     
-    # ========== 启动阶段 ==========
-    logger.info("=" * 60)
-    logger.info("Python AI服务启动中...")
-    logger.info("=" * 60)
+    多进程部署时由启动脚本在 fork 工作进程之前执行一次，工作进程启动时不再重复同步。
     
-    # 初始化向量数据库
-    logger.info("初始化向量数据库...")
-    vector_store = VectorStore()
+    Args:
+        vector_store: 课程向量数据库
     
+    Returns:
+        (课程相似度图, 课程分类索引)，未启用的返回None
+    """
     # 检查知识库是否为空
     current_count = vector_store.count()
     logger.info(f"当前知识库文档数量: {current_count}")
     
+    # 知识库为空时优先导入快照，避免重新向量化整个课程目录
+    if current_count == 0 and settings.kb_snapshot_path and os.path.exists(settings.kb_snapshot_path):
+        logger.info(f"检测到知识库快照，开始导入: {settings.kb_snapshot_path}")
+        try:
+            current_count = import_snapshot(vector_store, settings.kb_snapshot_path)
+            logger.success(f"快照导入完成！共导入 {current_count} 条数据。")
+        except Exception as e:
+            logger.error(f"快照导入失败: {e}，将改为从Java端同步")
+            current_count = vector_store.count()
+    
     if current_count == 0:
         logger.warning("检测到知识库为空，开始从Java端同步数据...")
         try:
             # 执行数据同步
-            sync_service = DataSyncService()
-            synced_count = await sync_service.sync_all_courses()
+            sync_service = DataSyncService(vector_store=vector_store)
+            try:
+                synced_count = await sync_service.sync_all_courses()
+            finally:
+                await sync_service.close()
             
             if synced_count > 0:
                 logger.success(f"数据预热完成！共导入 {synced_count} 门课程数据。")
             else:
                 logger.warning("数据同步完成，但未导入任何数据。")
-            
-            await sync_service.close()
         except Exception as e:
             logger.error(f"数据同步失败: {e}")
             logger.warning("服务将继续启动，但知识库为空，可能影响推荐功能。")
     else:
         logger.info(f"知识库状态正常，包含 {current_count} 条数据。")
     
+    # 课程相似度图：不存在或与知识库不一致时（如从快照导入后）重建
+    knn_graph = CourseKnnGraph() if settings.knn_graph_enabled else None
+    if knn_graph:
+        try:
+            knn_graph.ensure_built(vector_store)
+        except Exception as e:
+            logger.error(f"构建课程相似度图失败: {e}")
+    
+    # 课程分类索引：同上
+    category_index = CategoryIndex() if settings.category_index_enabled else None
+    if category_index:
+        try:
+            category_index.ensure_built(vector_store)
+        except Exception as e:
+            logger.error(f"构建课程分类索引失败: {e}")
+    
+    return knn_graph, category_index
+
+
+async def _start_writer():
+    """成为写入进程：预热知识库，启动课程变更队列和暂存同步请求的处理任务"""
+    global sync_queue
+    
+    knn_graph, category_index = await prepare_knowledge_base(vector_store)
+    
+    # 启动课程变更事件队列（增量同步）
+    sync_queue = CourseSyncQueue(
+        DataSyncService(vector_store=vector_store, knn_graph=knn_graph, category_index=category_index)
+    )
+    sync_queue.start()
+    
+    task = asyncio.create_task(_drain_sync_spool())
+    _writer_tasks.add(task)
+    task.add_done_callback(_writer_tasks.discard)
+
+
+async def _wait_for_writer_lease():
+    """非写入进程：定期尝试获取写入租约，写入进程退出后接替"""
+    while not writer_lease.try_acquire():
+        await asyncio.sleep(settings.writer_lease_retry_seconds)
+    logger.info("原写入进程已退出，当前进程接替知识库写入")
+    await _start_writer()
+
+
+async def _drain_sync_spool():
+    """写入进程：执行其他进程暂存的同步请求（执行完成后才删除，失败时停在该请求，下次按顺序重试）"""
+    while True:
+        try:
+            for name, request in sync_spool.pending():
+                if request.get("type") == "full":
+                    await _run_full_sync(request.get("force", False))
+                else:
+                    sync_queue.submit(request.get("course_ids", []), deleted=request.get("deleted", False))
+                sync_spool.ack(name)
+        except Exception as e:
+            logger.error(f"处理暂存的同步请求失败，稍后重试: {e}")
+        await asyncio.sleep(settings.sync_spool_poll_seconds)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用生命周期管理
+    在启动时自动同步数据，关闭时清理资源
+    """
+    global agent, vector_store, sync_queue, candidate_builder, batch_recommender, writer_lease, sync_spool
+    
+    # ========== 启动阶段 ==========
+    logger.info("=" * 60)
+    logger.info("Python AI服务启动中...")
+    logger.info("=" * 60)
+    
+    # 初始化向量数据库
+    logger.info("初始化向量数据库...")
+    vector_store = VectorStore()
+    
+    # 多个进程共用知识库目录时只有持有写入租约的进程预热和同步，其他进程只读
+    sync_spool = SyncSpool()
+    writer_lease = WriterLease()
+    if writer_lease.try_acquire():
+        await _start_writer()
+    else:
+        logger.info(f"知识库写入租约由 {writer_lease.holder()} 持有，当前进程只读，同步请求转交写入进程")
+        task = asyncio.create_task(_wait_for_writer_lease())
+        _writer_tasks.add(task)
+        task.add_done_callback(_writer_tasks.discard)
+    
+    # 离线候选推荐（课表变更事件触发增量刷新）
+    candidate_builder = CandidateBuilder(vector_store=vector_store)
+    
     # 初始化Agent
     logger.info("初始化AI Agent...")
     try:
@@ -78,6 +196,13 @@ async def lifespan(app: FastAPI):
         logger.error(f"AI Agent初始化失败: {e}")
         logger.warning("服务将继续启动，但AI功能可能不可用。")
     
+    # 批量推荐（推荐理由用路由模型生成，未配置时用回答模型；Agent不可用时不生成推荐理由）
+    batch_recommender = BatchRecommender(
+        candidate_builder,
+        llm=(agent.router_llm or agent.llm) if agent else None,
+        governor=agent.governor if agent else None
+    )
+    
     logger.info("=" * 60)
     logger.success("服务启动完成，开始接收请求")
     logger.info("=" * 60)
@@ -86,8 +211,19 @@ async def lifespan(app: FastAPI):
     
     # ========== 关闭阶段 ==========
     logger.info("服务正在关闭...")
+    for task in list(_writer_tasks):
+        task.cancel()
+    if sync_queue:
+        await sync_queue.stop()
+        await sync_queue.sync_service.close()
+    if candidate_builder:
+        for task in list(_candidate_tasks):
+            task.cancel()
+        await candidate_builder.close()
     if agent:
         await agent.close()
+    if writer_lease:
+        writer_lease.release()
     logger.info("服务已关闭")
 
 
@@ -108,6 +244,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求追踪（X-Debug-Trace 请求头或抽样）
+app.add_middleware(tracing.TracingMiddleware)
+
+# 记录各接口耗时（最外层，包含CORS处理和流式响应的发送时间）
+app.add_middleware(metrics.MetricsMiddleware)
+
 
 # ========== 请求模型 ==========
 class ChatRequest(BaseModel):
@@ -115,12 +257,17 @@ class ChatRequest(BaseModel):
     user_id: int
     query: str
     context: Optional[Dict] = None
+    session_id: Optional[str] = None  # 会话ID，指定时支持多轮追问
 
 
 class ChatResponse(BaseModel):
     """聊天响应"""
     answer: str
     user_id: int
+    session_id: Optional[str] = None
+    limit_hit: Optional[str] = None  # 触发的限制（max_steps / max_tool_calls / deadline），回答可能不完整
+    cached: bool = False  # 是否来自回答缓存
+    trace: Optional[Dict] = None  # 请求调用树（仅请求头带 X-Debug-Trace 时返回）
 
 
 class SyncRequest(BaseModel):
@@ -135,6 +282,47 @@ class SyncResponse(BaseModel):
     synced_count: int
 
 
+class CourseSyncRequest(BaseModel):
+    """课程变更事件（批量）"""
+    course_ids: List[int]
+    deleted: bool = False  # 课程是否已下架/删除
+    wait: bool = False  # 是否跳过防抖，立即同步并返回结果
+
+
+class CourseSyncResponse(BaseModel):
+    """课程增量同步响应"""
+    success: bool
+    message: str
+    queued: int = 0
+    upserted: int = 0
+    deleted: int = 0
+    failed: int = 0
+
+
+class LessonEventRequest(BaseModel):
+    """用户课表变更事件（购买、学习状态变化）"""
+    user_ids: List[int]
+    wait: bool = False  # 是否等待刷新完成并返回结果
+
+
+class LessonEventResponse(BaseModel):
+    """候选课程刷新响应"""
+    success: bool
+    message: str
+    refreshed: int = 0
+    skipped: int = 0
+    empty: int = 0
+    failed: int = 0
+
+
+class BatchRecommendRequest(BaseModel):
+    """批量推荐请求"""
+    user_ids: List[int]
+    top_k: int = 5
+    with_reason: bool = False  # 是否调用LLM生成一句推荐理由（batch 优先级）
+    job_id: Optional[str] = None  # 任务ID，中断后用相同的ID重新提交可跳过已完成的用户
+
+
 # ========== API接口 ==========
 @app.get("/")
 async def root():
@@ -185,23 +373,76 @@ async def chat(request: ChatRequest):
         logger.info(f"收到用户 {request.user_id} 的查询: {request.query}")
         
         # 调用Agent
-        answer = await agent.invoke(
+        result = await agent.run(
             user_id=request.user_id,
             query=request.query,
-            context=request.context
+            context=request.context,
+            session_id=request.session_id
         )
+        answer = result["answer"]
         
         logger.info(f"生成回复完成，长度: {len(answer)}")
         
         return ChatResponse(
             answer=answer,
-            user_id=request.user_id
+            user_id=request.user_id,
+            session_id=request.session_id,
+            limit_hit=result["limit_hit"],
+            cached=result["cached"],
+            trace=tracing.debug_trace()
         )
     except Exception as e:
         logger.error(f"处理聊天请求失败: {e}")
         raise HTTPException(status_code=500, detail=f"处理请求失败: {str(e)}")
 
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    流式聊天接口（Server-Sent Events）
+    
+    依次推送工具调用开始/结束事件和LLM输出的token，最后推送 done 事件（完整回复）；
+    请求头带 X-Debug-Trace 时在 done 之后推送 trace 事件（调用树）。
+    客户端断开连接时取消推理和进行中的工具调用。
+    
+    Args:
+        request: 聊天请求
+    
+    Returns:
+        text/event-stream 响应
+    """
+    global agent
+    
+    if not agent:
+        raise HTTPException(status_code=503, detail="AI Agent未初始化")
+    
+    logger.info(f"收到用户 {request.user_id} 的流式查询: {request.query}")
+    
+    async def event_stream():
+        # 客户端断开时Starlette会取消该生成器，agent.stream 的清理逻辑随之取消推理
+        async for event in agent.stream(
+            user_id=request.user_id,
+            query=request.query,
+            context=request.context,
+            session_id=request.session_id
+        ):
+            yield _format_sse(event["event"], event["data"])
+        trace = tracing.debug_trace()
+        if trace:
+            yield _format_sse("trace", trace)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _format_sse(event: str, data: Dict) -> str:
+    """格式化一条SSE消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
 @app.post("/sync", response_model=SyncResponse)
 async def sync_data(request: SyncRequest):
     """
@@ -213,26 +454,22 @@ async def sync_data(request: SyncRequest):
     Returns:
         同步结果
     """
-    global vector_store
+    global vector_store, writer_lease, sync_spool
     
     if not vector_store:
         raise HTTPException(status_code=503, detail="向量数据库未初始化")
     
+    # 非写入进程不直接写知识库，转交写入进程执行
+    if not writer_lease.held:
+        sync_spool.submit_full(force=request.force)
+        return SyncResponse(
+            success=True,
+            message=f"已转交写入进程 {writer_lease.holder()} 执行",
+            synced_count=0
+        )
+    
     try:
-        logger.info("开始手动数据同步...")
-        
-        # 如果强制同步，先清空
-        if request.force:
-            logger.info("强制同步模式：清空现有数据...")
-            vector_store.reset()
-        
-        # 执行同步
-        sync_service = DataSyncService()
-        synced_count = await sync_service.sync_all_courses()
-        await sync_service.close()
-        
-        logger.success(f"数据同步完成，共同步 {synced_count} 门课程")
-        
+        synced_count = await _run_full_sync(request.force)
         return SyncResponse(
             success=True,
             message=f"成功同步 {synced_count} 门课程",
@@ -247,15 +484,375 @@ async def sync_data(request: SyncRequest):
         )
 
 
+async def _run_full_sync(force: bool) -> int:
+    """执行全量同步（仅写入进程），force=True 时先清空"""
+    logger.info("开始手动数据同步...")
+    
+    # 如果强制同步，先清空
+    if force:
+        logger.info("强制同步模式：清空现有数据...")
+        vector_store.reset()
+    
+    # 执行同步：复用增量同步队列的相似度图和分类索引，全量重建后队列不会拿旧的内存副本覆盖新文件
+    queue_service = sync_queue.sync_service if sync_queue else None
+    sync_service = DataSyncService(
+        vector_store=vector_store,
+        knn_graph=queue_service.knn_graph if queue_service else None,
+        category_index=queue_service.category_index if queue_service else None
+    )
+    try:
+        synced_count = await sync_service.sync_all_courses()
+    finally:
+        await sync_service.close()
+    
+    logger.success(f"数据同步完成，共同步 {synced_count} 门课程")
+    return synced_count
+
+
+@app.post("/sync/courses/{course_id}", response_model=CourseSyncResponse)
+async def sync_course(course_id: int, deleted: bool = False, wait: bool = False):
+    """
+    单门课程变更事件：课程上架、修改或下架时由Java端推送
+    
+    Args:
+        course_id: 课程ID
+        deleted: 课程是否已下架/删除
+        wait: 是否跳过防抖，立即同步并返回结果
+    
+    Returns:
+        同步结果
+    """
+    return await _submit_course_sync([course_id], deleted, wait)
+
+
+@app.post("/sync/courses", response_model=CourseSyncResponse)
+async def sync_courses(request: CourseSyncRequest):
+    """
+    批量课程变更事件
+    
+    Args:
+        request: 课程变更事件
+    
+    Returns:
+        同步结果
+    """
+    return await _submit_course_sync(request.course_ids, request.deleted, request.wait)
+
+
+async def _submit_course_sync(course_ids: List[int], deleted: bool, wait: bool) -> CourseSyncResponse:
+    """把课程变更事件提交到防抖队列，wait=True 时立即同步；非写入进程转交写入进程（不支持 wait）"""
+    global sync_queue, writer_lease, sync_spool
+    
+    if writer_lease and not writer_lease.held:
+        sync_spool.submit(course_ids, deleted=deleted)
+        return CourseSyncResponse(
+            success=True,
+            message=f"已接收 {len(course_ids)} 门课程的变更事件，转交写入进程 {writer_lease.holder()} 处理",
+            queued=len(course_ids)
+        )
+    if not sync_queue:
+        raise HTTPException(status_code=503, detail="课程变更队列未初始化")
+    
+    queued = sync_queue.submit(course_ids, deleted=deleted)
+    if not wait:
+        return CourseSyncResponse(
+            success=True,
+            message=f"已接收 {len(course_ids)} 门课程的变更事件",
+            queued=queued
+        )
+    
+    result = await sync_queue.flush()
+    return CourseSyncResponse(
+        success=result["failed"] == 0,
+        message=f"更新 {result['upserted']} 门，删除 {result['deleted']} 门，失败 {result['failed']} 门",
+        **result
+    )
+
+
+@app.get("/courses/{course_id}/similar")
+async def similar_courses(course_id: int, k: int = 5, user_id: Optional[int] = None):
+    """
+    查询相似课程（读取预计算的课程相似度图）
+    
+    Args:
+        course_id: 课程ID
+        k: 返回的相似课程数
+        user_id: 用户ID（可选），指定时排除该用户已购买的课程
+    
+    Returns:
+        相似课程列表
+    """
+    global agent
+    
+    if not agent:
+        raise HTTPException(status_code=503, detail="Agent未初始化")
+    
+    return {"course_id": course_id, "similar": await agent.tools.similar_courses([course_id], k, user_id)}
+
+
+@app.get("/categories")
+async def browse_categories(path: Optional[str] = None, limit: int = 20):
+    """
+    浏览课程分类树（读取预计算的分类索引）
+    
+    Args:
+        path: 分类路径（如"后端开发 > Java"）或分类名称，为空时返回顶级分类
+        limit: 最多返回的课程数
+    
+    Returns:
+        子分类（含课程数）和按难度排序的课程
+    """
+    global agent
+    
+    if not agent:
+        raise HTTPException(status_code=503, detail="Agent未初始化")
+    
+    result = await agent.tools.browse_category(path, limit)
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+
+@app.get("/learning-path")
+async def learning_path(topic: str, user_id: Optional[int] = None, per_stage: int = 3):
+    """
+    生成学习路径（按入门→基础→进阶→高级分阶段列出课程）
+    
+    Args:
+        topic: 学习方向（分类名称）
+        user_id: 用户ID（可选），指定时标记该用户已购买的课程
+        per_stage: 每个阶段最多返回的课程数
+    
+    Returns:
+        分阶段的课程列表
+    """
+    global agent
+    
+    if not agent:
+        raise HTTPException(status_code=503, detail="Agent未初始化")
+    
+    result = await agent.tools.learning_path(topic, user_id, per_stage)
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+
+@app.post("/users/lessons/events", response_model=LessonEventResponse)
+async def lesson_events(request: LessonEventRequest):
+    """
+    用户课表变更事件：刷新相关用户的预计算候选课程
+    
+    Args:
+        request: 课表变更事件
+    
+    Returns:
+        刷新结果（wait=False 时只返回已接收）
+    """
+    global agent, candidate_builder
+    
+    if not candidate_builder:
+        raise HTTPException(status_code=503, detail="候选推荐任务未初始化")
+    
+    if agent:
+        agent.tools.invalidate_owned_courses(request.user_ids)
+    
+    if not request.wait:
+        task = asyncio.create_task(candidate_builder.refresh(request.user_ids))
+        _candidate_tasks.add(task)
+        task.add_done_callback(_candidate_tasks.discard)
+        return LessonEventResponse(success=True, message=f"已接收 {len(request.user_ids)} 个用户的课表变更事件")
+    
+    result = await candidate_builder.refresh(request.user_ids)
+    return LessonEventResponse(
+        success=result["failed"] == 0,
+        message=f"重新计算 {result['refreshed']} 个用户，未变化 {result['skipped']} 个，失败 {result['failed']} 个",
+        refreshed=result["refreshed"],
+        skipped=result["skipped"],
+        empty=result["empty"],
+        failed=result["failed"]
+    )
+
+
+@app.post("/recommend/batch")
+async def recommend_batch(request: BatchRecommendRequest):
+    """
+    批量推荐（营销活动）：结果以NDJSON逐个用户输出
+    
+    第一行为任务信息（job_id），最后一行为统计（done=true）。结果同时写入检查点，
+    用相同的 job_id 重新提交时跳过已完成的用户。
+    
+    Args:
+        request: 批量推荐请求
+    
+    Returns:
+        application/x-ndjson 响应
+    """
+    global batch_recommender
+    
+    if not batch_recommender:
+        raise HTTPException(status_code=503, detail="批量推荐未初始化")
+    if len(request.user_ids) > settings.batch_recommend_max_users:
+        raise HTTPException(status_code=400, detail=f"用户数超过上限 {settings.batch_recommend_max_users}")
+    # 开始响应前锁定检查点：同一任务正在运行（任一工作进程）时直接返回409
+    try:
+        checkpoint = batch_recommender.start(request.job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except BatchJobRunningError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    logger.info(f"收到批量推荐请求: 用户 {len(request.user_ids)}，任务 {request.job_id or '(新任务)'}")
+    
+    async def ndjson_stream():
+        # 客户端断开时生成器被取消，已完成的批次已写入检查点；结束时释放检查点的锁
+        async for row in batch_recommender.run(
+            request.user_ids,
+            top_k=request.top_k,
+            with_reason=request.with_reason,
+            checkpoint=checkpoint
+        ):
+            yield json.dumps(row, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(
+        ndjson_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/recommend/batch/{job_id}")
+async def download_batch_result(job_id: str):
+    """
+    下载批量推荐任务的完整结果（检查点文件，NDJSON）
+    
+    Args:
+        job_id: 任务ID
+    
+    Returns:
+        application/x-ndjson 文件
+    """
+    try:
+        checkpoint = BatchCheckpoint(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not checkpoint.exists():
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return FileResponse(checkpoint.path, media_type="application/x-ndjson", filename=f"{job_id}.ndjson")
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """运行指标（Prometheus 文本格式）：各处理阶段耗时直方图、LLM往返次数和token用量、缓存命中、同步吞吐"""
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="运行指标未启用（METRICS_ENABLED=false 或未安装 prometheus-client）")
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
+def _check_debug_access(token: Optional[str]):
+    """调试接口的访问控制：未开放时返回404，配置了令牌时校验 X-Debug-Token"""
+    if not settings.debug_endpoints_enabled:
+        raise HTTPException(status_code=404, detail="调试接口未开放")
+    if settings.debug_token and token != settings.debug_token:
+        raise HTTPException(status_code=403, detail="X-Debug-Token 无效")
+
+
+@app.get("/debug/traces")
+async def list_traces(
+    limit: int = 50,
+    min_ms: float = 0.0,
+    name: Optional[str] = None,
+    x_debug_token: Optional[str] = Header(None)
+):
+    """
+    最近的请求追踪（当前工作进程，按时间倒序）
+    
+    Args:
+        limit: 最多返回的条数
+        min_ms: 只返回耗时不小于该值的请求，用于查找慢请求
+        name: 只返回名称包含该文本的请求（如 /chat）
+    """
+    _check_debug_access(x_debug_token)
+    return {"pid": os.getpid(), "traces": tracing.TRACES.recent(limit, min_ms, name)}
+
+
+@app.get("/debug/traces/{trace_id}")
+async def get_trace(trace_id: str, x_debug_token: Optional[str] = Header(None)):
+    """单个请求的完整调用树"""
+    _check_debug_access(x_debug_token)
+    trace = tracing.TRACES.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"追踪不存在或已被淘汰（当前进程 {os.getpid()}）: {trace_id}")
+    return trace.to_dict()
+
+
+@app.get("/debug/profile")
+async def profile_process(
+    seconds: float = 10.0,
+    interval_ms: float = 5.0,
+    include_idle: bool = False,
+    x_debug_token: Optional[str] = Header(None)
+):
+    """
+    对当前工作进程采样分析，返回折叠调用栈（可直接用 flamegraph.pl / speedscope 生成火焰图）
+    
+    Args:
+        seconds: 采样时长（秒），不超过 profile_max_seconds
+        interval_ms: 采样间隔（毫秒）
+        include_idle: 是否包含空闲线程（等待IO、线程池空闲）的样本
+    """
+    _check_debug_access(x_debug_token)
+    seconds = min(max(seconds, 0.1), settings.profile_max_seconds)
+    try:
+        result = await profiler.sample(seconds, max(interval_ms, 1.0), include_idle)
+    except profiler.ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(
+        result["folded"],
+        headers={
+            "X-Profile-Samples": str(result["samples"]),
+            "X-Profile-Rounds": str(result["rounds"]),
+            "X-Worker-Pid": str(os.getpid()),
+        }
+    )
+
+
 @app.get("/stats")
 async def get_stats():
     """获取统计信息"""
-    global vector_store
+    global agent, vector_store, sync_queue, candidate_builder, batch_recommender, writer_lease, sync_spool
     
     stats = {
         "vector_store": {
             "document_count": vector_store.count() if vector_store else 0
-        }
+        },
+        "sync_queue": {
+            "pending": sync_queue.pending_count,
+            **sync_queue.stats
+        } if sync_queue else {},
+        "writer": {
+            "is_writer": writer_lease.held,
+            "holder": writer_lease.holder(),
+            "spool_pending": sync_spool.pending_count(),
+            **sync_spool.stats
+        } if writer_lease else {},
+        "tool_results": agent.serializer.stats if agent else {},
+        "candidates": {
+            "users": candidate_builder.store.count(),
+            **candidate_builder.stats
+        } if candidate_builder else {},
+        "batch_recommend": batch_recommender.stats if batch_recommender else {},
+        "sessions": {
+            "active": agent.sessions.count()
+        } if agent else {},
+        "answer_cache": agent.answer_cache.snapshot() if agent and agent.answer_cache else {},
+        "llm": agent.governor.snapshot() if agent else {},
+        "model_tiers": agent.tier_snapshot() if agent else {},
+        "routing": {
+            **agent.route_stats,
+            "fast_path_ratio": round(agent.route_stats["fast_path"] / agent.route_stats["requests"], 4)
+            if agent.route_stats["requests"] else 0.0
+        } if agent else {}
     }
     
     return stats
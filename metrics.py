@@ -0,0 +1,196 @@
+"""
+运行指标：各处理阶段的耗时直方图和计数器，以 Prometheus 文本格式在 /metrics 输出
+
+/stats 只能看到累计值和平均值，一次慢的 /chat 到底耗在嵌入编码、向量检索、Java接口、LLM调用还是
+工具结果序列化上无从得知。各模块在阶段边界记录耗时和计数：
+- 嵌入模型（EmbeddingModel）：编码耗时、编码文本数
+- 向量数据库（VectorStore）：检索、按ID读取、写入、删除的耗时
+- Java服务（JavaServiceClient）：按接口（路径中的ID归一为 {id}）和状态码统计耗时
+- LLM（CourseRecommendationAgent / LLMGovernor）：各层级模型耗时、token用量、调度排队时间、
+  每次请求的LLM往返次数、工具调用耗时、工具结果序列化耗时、回答缓存命中
+- 数据同步（DataSyncService）：全量/增量同步耗时和课程数
+- HTTP接口：按路由模板（如 /courses/{course_id}/similar）和状态码统计耗时
+
+记录一次指标只是在进程内更新几个数值（不做网络请求、不写日志），开销在微秒级。
+未安装 prometheus-client 或 METRICS_ENABLED=false 时所有指标为空操作。
+
+多进程部署（serve.py）时各工作进程的指标写入 PROMETHEUS_MULTIPROC_DIR 目录，任一工作进程的
+/metrics 都输出全部进程的汇总值；该环境变量必须在导入 prometheus_client 之前设置（serve.py 负责）。
+
+使用示例：
+    from metrics import EMBED_SECONDS, timed
+    
+    with timed(EMBED_SECONDS, op="query"):
+        vector = model.encode([text])
+    
+    body, content_type = render()           # /metrics 接口
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional, Sequence, Tuple
+from config import settings
+
+try:
+    import prometheus_client
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+
+ENABLED = prometheus_client is not None and settings.metrics_enabled
+MULTIPROCESS = ENABLED and bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+# 耗时分桶（秒）：本地阶段（编码、检索、序列化）在毫秒级，LLM调用在秒级
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0, 120.0)
+
+
+class _NoopMetric:
+    """未启用指标时的替身，接口与 prometheus_client 的指标一致"""
+    
+    def labels(self, *args, **kwargs) -> "_NoopMetric":
+        return self
+    
+    def observe(self, amount: float):
+        pass
+    
+    def inc(self, amount: float = 1):
+        pass
+
+
+_NOOP = _NoopMetric()
+
+
+def _histogram(name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+    """创建直方图（未启用时返回空操作替身）"""
+    if not ENABLED:
+        return _NOOP
+    return Histogram(name, documentation, labelnames, buckets=buckets)
+
+
+def _counter(name: str, documentation: str, labelnames: Sequence[str] = ()):
+    """创建计数器（未启用时返回空操作替身）"""
+    if not ENABLED:
+        return _NOOP
+    return Counter(name, documentation, labelnames)
+
+
+# ========== 嵌入模型 / 向量数据库 ==========
+EMBED_SECONDS = _histogram("tianji_embed_seconds", "嵌入模型编码耗时", ["op"], FAST_BUCKETS)
+EMBED_TEXTS = _counter("tianji_embed_texts", "嵌入模型编码的文本数", ["op"])
+VECTOR_STORE_SECONDS = _histogram(
+    "tianji_vector_store_seconds", "向量数据库操作耗时（不含查询编码）", ["op"], FAST_BUCKETS
+)
+
+# ========== Java服务 ==========
+JAVA_REQUEST_SECONDS = _histogram(
+    "tianji_java_request_seconds", "Java服务接口耗时", ["method", "endpoint", "status"]
+)
+
+# ========== LLM / Agent ==========
+LLM_SECONDS = _histogram("tianji_llm_seconds", "LLM调用耗时（含调度排队）", ["tier"], LLM_BUCKETS)
+LLM_TOKENS = _counter("tianji_llm_tokens", "LLM token用量（服务商未返回时按文本长度估算）", ["tier", "kind"])
+LLM_QUEUE_WAIT_SECONDS = _histogram(
+    "tianji_llm_queue_wait_seconds", "LLM调度排队时间", ["priority"], FAST_BUCKETS + (10.0, 30.0)
+)
+LLM_CALLS = _counter("tianji_llm_calls", "LLM调度器执行的调用次数", ["result"])
+AGENT_LLM_ROUND_TRIPS = _histogram(
+    "tianji_agent_llm_round_trips", "每次对话请求的LLM往返次数", ["path"], (0, 1, 2, 3, 4, 5, 6, 8, 10, 15)
+)
+AGENT_REQUEST_SECONDS = _histogram("tianji_agent_request_seconds", "Agent推理耗时", ["path"], LLM_BUCKETS)
+TOOL_SECONDS = _histogram("tianji_tool_seconds", "工具调用耗时", ["tool", "status"])
+TOOL_SERIALIZE_SECONDS = _histogram("tianji_tool_serialize_seconds", "工具结果投影和序列化耗时", (), FAST_BUCKETS)
+ANSWER_CACHE = _counter("tianji_answer_cache", "回答缓存查询结果", ["result"])
+
+# ========== 数据同步 ==========
+SYNC_SECONDS = _histogram("tianji_sync_seconds", "课程同步耗时", ["kind"], LLM_BUCKETS + (300.0, 900.0))
+SYNC_COURSES = _counter("tianji_sync_courses", "课程同步处理的课程数", ["kind", "result"])
+
+# ========== HTTP接口 ==========
+HTTP_REQUEST_SECONDS = _histogram(
+    "tianji_http_request_seconds", "HTTP接口耗时（流式响应到最后一个数据块发送完）", ["method", "route", "status"]
+)
+
+
+@contextmanager
+def timed(metric, **labels):
+    """
+    记录代码块耗时（异常退出时同样记录）
+    
+    Args:
+        metric: 直方图
+        **labels: 标签值
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        (metric.labels(**labels) if labels else metric).observe(time.perf_counter() - started)
+
+
+def render() -> Tuple[bytes, str]:
+    """
+    输出全部指标（Prometheus 文本格式）
+    
+    Returns:
+        (响应内容, Content-Type)
+    """
+    registry = REGISTRY
+    if MULTIPROCESS:
+        # 汇总所有工作进程（包括已退出进程的计数器）写入目录的指标
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    """工作进程退出后清理它的实时指标文件（多进程模式，由 serve.py 的主进程调用）"""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
+
+
+class MetricsMiddleware:
+    """
+    记录HTTP接口耗时的ASGI中间件
+    
+    直接包装ASGI调用而不是使用 BaseHTTPMiddleware：流式响应（SSE、NDJSON）的耗时计到最后一个
+    数据块发送完，也不会为每个请求多创建一个任务。路由按模板聚合，未匹配任何路由的请求记为 unmatched，
+    避免路径中的ID产生大量标签组合。
+    """
+    
+    def __init__(self, app):
+        """
+        初始化中间件
+        
+        Args:
+            app: 被包装的ASGI应用
+        """
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        """处理一次ASGI调用（非HTTP请求直接转发）"""
+        if scope["type"] != "http" or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+        
+        status: Optional[int] = None
+        
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status or 500)
+            ).observe(time.perf_counter() - started)
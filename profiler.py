@@ -0,0 +1,159 @@
+"""
+采样分析：对运行中的进程按固定间隔采集所有线程的调用栈，输出火焰图格式（folded stacks）
+
+追踪（tracing.py）说明一次请求时间花在哪个阶段，但解释不了某个阶段内部为什么慢（序列化里哪个函数、
+事件循环是否被同步代码阻塞）。采样分析不需要重启服务或预先插桩：在独立线程中每隔 interval 读取一次
+sys._current_frames()，把每个线程的调用栈折叠为一行 "线程;函数1;函数2 次数"，可以直接交给
+flamegraph.pl、speedscope（https://www.speedscope.app）或 inferno 生成火焰图。
+
+只采集Python调用栈：事件循环线程上只能看到正在执行的协程（挂起等待的协程不占用CPU，不会出现），
+C扩展内部（如模型推理）显示为调用它的Python函数。默认排除空闲线程的样本（阻塞在 select、条件变量
+等待、线程池取任务上），需要分析墙钟时间时可以包含。
+
+同一时间只运行一个采样，每次采样在专用线程中执行，不占用事件循环和默认线程池。
+
+使用示例：
+    from profiler import sample
+    
+    result = await sample(seconds=10, interval_ms=5)
+    print(result["folded"])
+    # curl "localhost:8000/debug/profile?seconds=10" > out.folded
+    # flamegraph.pl out.folded > flame.svg
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
+
+
+# 调用栈叶子处于这些函数时视为空闲线程：(文件名, 函数名)
+_IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+}
+
+_ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profiler")
+_running = threading.Lock()
+
+
+class ProfilerBusyError(RuntimeError):
+    """已有采样在进行中"""
+
+
+def _frame_label(code) -> str:
+    """函数标签：函数名 (相对路径:首行号)；去掉分号和空格以免破坏 folded 格式"""
+    filename = code.co_filename
+    if filename.startswith(_ROOT_DIR):
+        filename = os.path.relpath(filename, _ROOT_DIR)
+    else:
+        filename = "/".join(filename.replace("\\", "/").split("/")[-2:])
+    return f"{code.co_name}({filename}:{code.co_firstlineno})".replace(";", ":").replace(" ", "_")
+
+
+def _collect(seconds: float, interval: float, include_idle: bool) -> Tuple[Counter, int]:
+    """
+    采样循环（在采样线程中执行）
+    
+    Returns:
+        (折叠调用栈 -> 样本数, 采样次数)
+    """
+    own_ident = threading.get_ident()
+    stacks: Counter = Counter()
+    rounds = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            code = frame.f_code
+            if not include_idle and (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            thread_name = names.get(ident, str(ident)).replace(";", ":").replace(" ", "_")
+            stacks[";".join([thread_name] + labels[::-1])] += 1
+        rounds += 1
+        time.sleep(interval)
+    return stacks, rounds
+
+
+def _acquire():
+    """占用采样（在提交到采样线程之前检查，同时到达的第二个请求直接失败而不是排队）"""
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusyError("已有采样在进行中，请稍后再试")
+
+
+def _run(seconds: float, interval_ms: float, include_idle: bool) -> Dict:
+    """
+    采样并格式化为折叠调用栈（调用方已 _acquire，结束时在采样线程中释放）
+    
+    请求被取消时 await 的 future 随之取消，但采样线程仍会运行到结束，由这里释放才能保证采样结束前
+    不会开始下一次采样。
+    """
+    try:
+        stacks, rounds = _collect(seconds, interval_ms / 1000, include_idle)
+    finally:
+        _running.release()
+    lines = [f"{stack} {count}" for stack, count in stacks.most_common()]
+    return {"folded": "\n".join(lines) + ("\n" if lines else ""), "samples": sum(stacks.values()), "rounds": rounds}
+
+
+def profile(seconds: float, interval_ms: float = 5.0, include_idle: bool = False) -> Dict:
+    """
+    同步执行一次采样（阻塞 seconds 秒）
+    
+    Args:
+        seconds: 采样时长（秒）
+        interval_ms: 采样间隔（毫秒）
+        include_idle: 是否包含空闲线程的样本
+    
+    Returns:
+        {"folded": 折叠调用栈文本（每行 "栈 样本数"，按样本数降序）, "samples": 样本数, "rounds": 采样次数}
+    
+    Raises:
+        ProfilerBusyError: 已有采样在进行中
+    """
+    _acquire()
+    return _run(seconds, interval_ms, include_idle)
+
+
+async def sample(seconds: float, interval_ms: float = 5.0, include_idle: bool = False) -> Dict:
+    """
+    在专用线程中执行一次采样，不阻塞事件循环
+    
+    Args:
+        seconds: 采样时长（秒）
+        interval_ms: 采样间隔（毫秒）
+        include_idle: 是否包含空闲线程的样本
+    
+    Returns:
+        同 profile()
+    
+    Raises:
+        ProfilerBusyError: 已有采样在进行中
+    """
+    _acquire()
+    try:
+        future = asyncio.get_running_loop().run_in_executor(_executor, _run, seconds, interval_ms, include_idle)
+    except BaseException:
+        # 没有提交到采样线程（如执行器已关闭），锁不会被 _run 释放
+        _running.release()
+        raise
+    return await future
+
+
+def is_running() -> bool:
+    """是否有采样在进行中"""
+    return _running.locked()
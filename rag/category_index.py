@@ -0,0 +1,326 @@
+"""
+课程分类树和学习路径索引
+
+同步时分类只被拼成 "后端开发 > Java > Java并发" 这样的字符串写进元数据和文档文本，
+"Java方向从入门到进阶怎么学"这类问题只能让LLM反复检索。分类索引在同步后根据知识库元数据
+建好分类树，每个节点记录子分类和整棵子树的课程（按难度排序），学习路径按难度阶段分组，
+一次本地查询即可回答。
+
+课程难度从课程名称中的关键词推断（入门、基础、进阶/实战、高级/架构），没有关键词的课程归入"综合"阶段。
+分类名称本身可能包含关键词（如"Java基础"分类），推断前先去掉分类名称。
+
+使用示例：
+    from rag.category_index import CategoryIndex
+    
+    index = CategoryIndex()
+    index.build(vector_store)                     # 全量同步后
+    index.update(vector_store, [101], [102])      # 增量同步后
+    index.browse("后端开发 > Java")
+    index.learning_path("Java方向从入门到进阶怎么学")
+"""
+import json
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
+from config import settings
+from rag.vector_store import VectorStore
+
+
+# 难度阶段：(等级, 阶段名称, 课程名称中的关键词)
+STAGES = [
+    (1, "入门", re.compile(r"入门|零基础|新手|小白|初级|初识")),
+    (2, "基础", re.compile(r"基础|核心|必备")),
+    (3, "进阶", re.compile(r"进阶|中级|提升|实战|项目|案例")),
+    (4, "高级", re.compile(r"高级|精通|架构|源码|原理|调优|深入")),
+]
+STAGE_NAMES = {level: name for level, name, _ in STAGES}
+STAGE_NAMES[0] = "综合"
+
+_PATH_SEPARATOR = " > "
+
+
+def infer_level(course_name: str, category_names: Tuple[str, ...] = ()) -> int:
+    """
+    从课程名称推断难度等级
+    
+    Args:
+        course_name: 课程名称
+        category_names: 课程所属的各级分类名称，推断前从课程名称中去掉
+    
+    Returns:
+        难度等级（1~4），有多个关键词时取最靠后的一个；没有难度关键词时返回0
+    """
+    name = course_name or ""
+    for category_name in sorted(category_names, key=len, reverse=True):
+        name = name.replace(category_name, " ")
+    best_level, best_position = 0, -1
+    for level, _, pattern in STAGES:
+        for match in pattern.finditer(name):
+            if match.start() > best_position:
+                best_level, best_position = level, match.start()
+    return best_level
+
+
+class CategoryIndex:
+    """课程分类树索引"""
+    
+    def __init__(self, path: Optional[str] = None):
+        """
+        初始化索引（存储文件存在时直接加载）
+        
+        Args:
+            path: 存储文件路径（JSON），默认使用配置
+        """
+        self.path = path or settings.category_index_path
+        self.generation: Optional[str] = None
+        
+        # 课程ID -> {"name", "path", "level"}
+        self._courses: Dict[int, Dict] = {}
+        # 分类路径 -> {"children": 子分类名称列表, "courses": 子树中的课程ID（按难度排序）}
+        self._nodes: Dict[Tuple[str, ...], Dict] = {}
+        
+        self._file_mtime: Optional[int] = None
+        self._checked_at = 0.0
+        self._load()
+    
+    @property
+    def size(self) -> int:
+        """索引中的课程数"""
+        return len(self._courses)
+    
+    def build(self, vector_store: VectorStore) -> int:
+        """
+        全量构建：读取知识库中全部课程的元数据
+        
+        Args:
+            vector_store: 课程向量数据库
+        
+        Returns:
+            索引中的课程数
+        """
+        courses = {}
+        for _, _, metadatas, _ in vector_store.iter_all(include_embeddings=False):
+            for metadata in metadatas:
+                if metadata and metadata.get("course_id"):
+                    courses[int(metadata["course_id"])] = self._course_entry(metadata)
+        self._courses = courses
+        self._save(vector_store.generation)
+        logger.info(f"课程分类索引构建完成: {len(courses)} 门课程，{len(self._nodes)} 个分类节点")
+        return len(courses)
+    
+    def update(self, vector_store: VectorStore, course_ids: List[int], deleted_ids: Optional[List[int]] = None):
+        """
+        增量更新：重新读取变化课程的元数据，删除下架课程
+        
+        Args:
+            vector_store: 课程向量数据库
+            course_ids: 新增或修改的课程ID
+            deleted_ids: 删除的课程ID
+        """
+        # 文件可能已被其他实例（如全量同步）重建，先加载最新内容再修改，避免用旧副本覆盖
+        self._reload_if_changed(force=True)
+        metadata_map = vector_store.get_course_metadata(course_ids)
+        for course_id in set(course_ids) | set(deleted_ids or []):
+            if course_id in metadata_map:
+                self._courses[course_id] = self._course_entry(metadata_map[course_id])
+            else:
+                self._courses.pop(course_id, None)
+        self._save(vector_store.generation)
+    
+    def ensure_built(self, vector_store: VectorStore) -> bool:
+        """
+        索引文件不存在或与知识库代次不一致时重建（服务启动时调用）
+        
+        Returns:
+            是否重建
+        """
+        if self._courses and self.generation == vector_store.generation:
+            return False
+        if vector_store.count() == 0:
+            return False
+        self.build(vector_store)
+        return True
+    
+    def browse(self, category: Optional[str] = None, limit: int = 20) -> Optional[Dict]:
+        """
+        浏览分类：返回子分类（含课程数）和子树中的课程（按难度排序）
+        
+        Args:
+            category: 分类路径（"后端开发 > Java"）或分类名称（"Java"），为空时返回顶级分类
+            limit: 最多返回的课程数
+        
+        Returns:
+            {"path", "children", "courses"}；找不到分类时返回None
+        """
+        self._reload_if_changed()
+        node_path = self.find_node(category) if category else ()
+        if node_path is None:
+            return None
+        node = self._nodes.get(node_path, {"children": [], "courses": []})
+        return {
+            "path": _PATH_SEPARATOR.join(node_path),
+            "children": [
+                {"name": name, "course_count": len(self._nodes[node_path + (name,)]["courses"])}
+                for name in node["children"]
+            ],
+            "course_count": len(node["courses"]),
+            "courses": [self._course_row(course_id) for course_id in node["courses"][:limit]],
+        }
+    
+    def learning_path(self, topic: str, per_stage: int = 3) -> Optional[Dict]:
+        """
+        生成学习路径：找到与主题匹配的分类，把子树中的课程按难度阶段分组
+        
+        Args:
+            topic: 学习方向（分类名称，或包含分类名称的问题，如"Java方向从入门到进阶怎么学"）
+            per_stage: 每个阶段最多返回的课程数
+        
+        Returns:
+            {"path", "stages": [{"stage", "courses"}]}，阶段按入门→基础→进阶→高级→综合排列；
+            找不到分类时返回None
+        """
+        node_path = self.find_node(topic)
+        if not node_path:
+            return None
+        stages: Dict[int, List[int]] = {}
+        for course_id in self._nodes[node_path]["courses"]:
+            stages.setdefault(self._courses[course_id]["level"], []).append(course_id)
+        order = [level for level, _, _ in STAGES] + [0]
+        return {
+            "path": _PATH_SEPARATOR.join(node_path),
+            "stages": [
+                {
+                    "stage": STAGE_NAMES[level],
+                    "course_count": len(stages[level]),
+                    "courses": [self._course_row(course_id) for course_id in stages[level][:per_stage]],
+                }
+                for level in order
+                if stages.get(level)
+            ],
+        }
+    
+    def find_node(self, text: str) -> Optional[Tuple[str, ...]]:
+        """
+        查找与文本匹配的分类节点
+        
+        依次尝试：完整路径、分类名称完全相同、文本中包含的最长分类名称、名称中包含文本的分类；
+        同名时取层级较浅（范围较大）的分类。
+        
+        Args:
+            text: 分类路径、分类名称或包含分类名称的问题
+        
+        Returns:
+            分类路径，找不到时返回None
+        """
+        # 快速路径直接调用（判断是否提供学习路径），同样需要感知其他进程的更新
+        self._reload_if_changed()
+        text = (text or "").strip()
+        if not text:
+            return None
+        parts = tuple(part.strip() for part in re.split(r"\s*[>＞]\s*", text) if part.strip())
+        if parts in self._nodes:
+            return parts
+        
+        lowered = text.lower()
+        candidates = [path for path in self._nodes if path]
+        exact = [path for path in candidates if path[-1].lower() == lowered]
+        if exact:
+            return min(exact, key=len)
+        contained = [path for path in candidates if path[-1].lower() in lowered]
+        if contained:
+            return min(contained, key=lambda path: (-len(path[-1]), len(path)))
+        containing = [path for path in candidates if lowered in path[-1].lower()]
+        if containing:
+            return min(containing, key=len)
+        return None
+    
+    def _course_row(self, course_id: int) -> Dict:
+        """课程的紧凑表示"""
+        course = self._courses[course_id]
+        return {
+            "id": course_id,
+            "name": course["name"],
+            "category": course["path"][-1] if course["path"] else "",
+            "stage": STAGE_NAMES[course["level"]],
+        }
+    
+    @staticmethod
+    def _course_entry(metadata: Dict) -> Dict:
+        """从知识库元数据构建课程条目"""
+        name = metadata.get("course_name", "")
+        path = [part.strip() for part in metadata.get("category", "").split(">") if part.strip()]
+        return {
+            "name": name,
+            "path": path,
+            "level": infer_level(name, tuple(path)),
+        }
+    
+    def _index(self):
+        """根据课程条目构建分类树（每个节点的课程列表包含整棵子树，按难度、分类、课程ID排序）"""
+        nodes: Dict[Tuple[str, ...], Dict] = {(): {"children": [], "courses": []}}
+        ordered = sorted(
+            self._courses.items(),
+            key=lambda item: (item[1]["level"] or 5, item[1]["path"], item[0])
+        )
+        for course_id, course in ordered:
+            path = tuple(course["path"])
+            for depth in range(len(path) + 1):
+                node_path = path[:depth]
+                if node_path not in nodes:
+                    nodes[node_path] = {"children": [], "courses": []}
+                    nodes[node_path[:-1]]["children"].append(node_path[-1])
+                nodes[node_path]["courses"].append(course_id)
+        for node in nodes.values():
+            node["children"].sort()
+        self._nodes = nodes
+    
+    def _save(self, generation: str):
+        """保存到文件（先写临时文件再替换），并重建分类树"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"generation": generation, "courses": self._courses},
+                f,
+                ensure_ascii=False,
+                separators=(",", ":")
+            )
+        os.replace(tmp_path, self.path)
+        self._file_mtime = os.stat(self.path).st_mtime_ns
+        self.generation = generation
+        self._index()
+    
+    def _load(self):
+        """从文件加载（文件不存在时为空索引）"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._file_mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"加载课程分类索引失败: {e}")
+            return
+        self.generation = data.get("generation")
+        self._courses = {int(course_id): course for course_id, course in data.get("courses", {}).items()}
+        self._index()
+    
+    def _reload_if_changed(self, force: bool = False):
+        """
+        文件被其他进程更新时重新加载
+        
+        Args:
+            force: 是否立即检查；默认最多每秒检查一次（查询路径），写入前需要立即检查
+        """
+        now = time.monotonic()
+        if not force and now - self._checked_at <= 1.0:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._file_mtime:
+            self._load()
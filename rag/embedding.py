@@ -2,10 +2,38 @@
 嵌入模型封装
 """
 from sentence_transformers import SentenceTransformer
-from typing import List
+from typing import Dict, List
+import threading
 import numpy as np
 from config import settings
 from loguru import logger
+from metrics import EMBED_SECONDS, EMBED_TEXTS, timed
+from tracing import span
+
+
+# 进程内共享的模型实例：同一个进程中的多个 EmbeddingModel（各个 VectorStore）只加载一次权重；
+# 多进程部署时由启动脚本在 fork 之前加载，工作进程通过写时复制共享权重内存
+_models: Dict[str, SentenceTransformer] = {}
+_models_lock = threading.Lock()
+
+
+def load_model(model_name: str = None) -> SentenceTransformer:
+    """
+    获取共享的模型实例（首次调用时加载）
+    
+    Args:
+        model_name: 模型名称，默认使用配置中的模型
+    
+    Returns:
+        SentenceTransformer 模型
+    """
+    model_name = model_name or settings.embedding_model
+    with _models_lock:
+        if model_name not in _models:
+            logger.info(f"正在加载嵌入模型: {model_name}")
+            _models[model_name] = SentenceTransformer(model_name)
+            logger.info("嵌入模型加载完成")
+        return _models[model_name]
 
 
 class EmbeddingModel:
@@ -19,9 +47,7 @@ class EmbeddingModel:
             model_name: 模型名称，默认使用配置中的模型
         """
         self.model_name = model_name or settings.embedding_model
-        logger.info(f"正在加载嵌入模型: {self.model_name}")
-        self.model = SentenceTransformer(self.model_name)
-        logger.info("嵌入模型加载完成")
+        self.model = load_model(self.model_name)
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """
@@ -36,7 +62,9 @@ class EmbeddingModel:
         if not texts:
             return []
         
-        embeddings = self.model.encode(texts, show_progress_bar=True)
+        EMBED_TEXTS.labels(op="documents").inc(len(texts))
+        with timed(EMBED_SECONDS, op="documents"), span("embed.documents", texts=len(texts)):
+            embeddings = self.model.encode(texts, show_progress_bar=True)
         return embeddings.tolist()
     
     def embed_query(self, text: str) -> List[float]:
@@ -49,12 +77,35 @@ class EmbeddingModel:
         Returns:
             向量
         """
-        embedding = self.model.encode([text])
+        EMBED_TEXTS.labels(op="query").inc()
+        with timed(EMBED_SECONDS, op="query"), span("embed.query"):
+            embedding = self.model.encode([text])
         return embedding[0].tolist()
     
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        将一批查询文本转换为向量（一次编码，不显示进度条）
+        
+        Args:
+            texts: 查询文本列表
+        
+        Returns:
+            向量列表
+        """
+        if not texts:
+            return []
+        EMBED_TEXTS.labels(op="queries").inc(len(texts))
+        with timed(EMBED_SECONDS, op="queries"), span("embed.queries", texts=len(texts)):
+            embeddings = self.model.encode(texts)
+        return embeddings.tolist()
+    
     @property
     def dimension(self) -> int:
         """获取向量维度"""
+        # 优先读取模型配置，避免为了获取维度而运行一次编码
+        dimension = self.model.get_sentence_embedding_dimension()
+        if dimension:
+            return dimension
         # 使用一个测试文本获取维度
         test_embedding = self.embed_query("test")
         return len(test_embedding)
@@ -0,0 +1,274 @@
+"""
+课程相似度图：预先计算每门课程的k个最相似课程（kNN）
+
+"我学完了X，下一步学什么"是最常见的问题之一，原本需要先查画像、再由LLM构造检索词做向量检索、
+最后过滤。相似度图在全量同步后用一次向量化计算（分块矩阵乘法）建好，增量同步时只重算受影响的课程，
+查询时只是一次字典读取。
+
+存储格式（npz，紧凑的数组）：
+- course_ids: int64 (n,)
+- neighbor_ids: int64 (n, k)，不足k个时用 -1 填充
+- neighbor_scores: float16 (n, k)，余弦相似度
+- generation: 建图时的知识库代次
+
+使用示例：
+    from rag.knn_graph import CourseKnnGraph
+    
+    graph = CourseKnnGraph()
+    graph.build(vector_store)                      # 全量同步后
+    graph.update(vector_store, [101], [102])       # 增量同步后（更新101，删除102）
+    graph.similar([101], k=5)                      # {101: [(205, 0.91), ...]}
+"""
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from loguru import logger
+from config import settings
+from rag.vector_store import VectorStore
+
+
+class CourseKnnGraph:
+    """课程kNN相似度图"""
+    
+    def __init__(self, path: Optional[str] = None, k: Optional[int] = None):
+        """
+        初始化相似度图（存储文件存在时直接加载）
+        
+        Args:
+            path: 存储文件路径，默认使用配置
+            k: 每门课程保存的相似课程数，默认使用配置
+        """
+        self.path = path or settings.knn_graph_path
+        self.k = k or settings.knn_graph_k
+        self.generation: Optional[str] = None
+        
+        # 查询用：课程ID -> [(相似课程ID, 相似度), ...]
+        self._neighbors: Dict[int, List[Tuple[int, float]]] = {}
+        # 增量更新用：课程ID、归一化向量矩阵和邻居数组（按需从知识库加载）
+        self._course_ids: Optional[np.ndarray] = None
+        self._matrix: Optional[np.ndarray] = None
+        self._neighbor_ids: Optional[np.ndarray] = None
+        self._neighbor_scores: Optional[np.ndarray] = None
+        
+        self._file_mtime: Optional[int] = None
+        self._checked_at = 0.0
+        self._load()
+    
+    @property
+    def size(self) -> int:
+        """图中的课程数"""
+        return len(self._neighbors)
+    
+    def similar(self, course_ids: List[int], k: Optional[int] = None) -> Dict[int, List[Tuple[int, float]]]:
+        """
+        查询课程的相似课程
+        
+        其他进程（同步任务）重建图后，最多延迟1秒加载新文件。
+        
+        Args:
+            course_ids: 课程ID列表
+            k: 每门课程返回的相似课程数，默认返回全部（最多为建图时的k）
+        
+        Returns:
+            课程ID到 [(相似课程ID, 相似度)] 的映射，按相似度从高到低；不在图中的课程不出现在结果中
+        """
+        now = time.monotonic()
+        if now - self._checked_at > 1.0:
+            self._checked_at = now
+            self._reload_if_changed()
+        return {
+            course_id: self._neighbors[course_id][:k] if k else self._neighbors[course_id]
+            for course_id in course_ids
+            if course_id in self._neighbors
+        }
+    
+    def build(self, vector_store: VectorStore) -> int:
+        """
+        全量建图：加载全部课程向量，分块计算相似度并取每行前k个
+        
+        Args:
+            vector_store: 课程向量数据库
+        
+        Returns:
+            图中的课程数
+        """
+        started = time.time()
+        self._load_matrix(vector_store)
+        count = len(self._course_ids)
+        self._neighbor_ids = np.full((count, self.k), -1, dtype=np.int64)
+        self._neighbor_scores = np.full((count, self.k), -np.inf, dtype=np.float32)
+        self._compute_rows(np.arange(count))
+        self._save(vector_store.generation)
+        logger.info(f"课程相似度图构建完成: {count} 门课程，k={self.k}，耗时 {time.time() - started:.2f}s")
+        return count
+    
+    def update(self, vector_store: VectorStore, course_ids: List[int], deleted_ids: Optional[List[int]] = None) -> int:
+        """
+        增量更新：写入新增/修改课程的向量，删除下架课程，只重算受影响的课程
+        
+        受影响的课程包括：新增/修改的课程本身、邻居中包含变化课程的课程，
+        以及与变化课程的相似度超过自身第k个邻居的课程。
+        
+        Args:
+            vector_store: 课程向量数据库
+            course_ids: 新增或修改的课程ID
+            deleted_ids: 删除的课程ID
+        
+        Returns:
+            重新计算的课程数
+        """
+        # 文件可能已被其他实例（如全量同步）重建：加载最新的图（向量矩阵随之清空，下面全量重建），
+        # 避免在旧的矩阵上做增量、把重建时新增的课程覆盖掉
+        self._reload_if_changed()
+        if self._matrix is None or self._neighbor_ids is None or len(self._neighbor_ids) != len(self._course_ids):
+            # 进程内还没有向量矩阵（例如刚启动），从知识库加载后全量重建
+            return self.build(vector_store)
+        
+        deleted = set(deleted_ids or [])
+        embeddings = vector_store.get_course_embeddings([cid for cid in course_ids if cid not in deleted])
+        # 请求更新但知识库中已经不存在的课程同样按删除处理
+        deleted |= {cid for cid in course_ids if cid not in embeddings}
+        changed_ids = np.asarray(list(deleted | set(embeddings)), dtype=np.int64)
+        
+        keep = ~np.isin(self._course_ids, list(deleted))
+        self._course_ids = self._course_ids[keep]
+        self._matrix = self._matrix[keep]
+        self._neighbor_ids = self._neighbor_ids[keep]
+        self._neighbor_scores = self._neighbor_scores[keep]
+        
+        row_index = {int(course_id): row for row, course_id in enumerate(self._course_ids)}
+        new_ids, new_rows = [], []
+        for course_id, embedding in embeddings.items():
+            vector = self._normalize(np.asarray(embedding, dtype=np.float32).reshape(1, -1))[0]
+            if course_id in row_index:
+                self._matrix[row_index[course_id]] = vector
+            else:
+                new_ids.append(course_id)
+                new_rows.append(vector)
+        if new_ids:
+            self._course_ids = np.concatenate([self._course_ids, np.asarray(new_ids, dtype=np.int64)])
+            self._matrix = np.vstack([self._matrix, np.asarray(new_rows, dtype=np.float32)])
+            self._neighbor_ids = np.vstack([self._neighbor_ids, np.full((len(new_ids), self.k), -1, dtype=np.int64)])
+            self._neighbor_scores = np.vstack(
+                [self._neighbor_scores, np.full((len(new_ids), self.k), -np.inf, dtype=np.float32)]
+            )
+            row_index.update({course_id: len(row_index) + i for i, course_id in enumerate(new_ids)})
+        
+        affected = np.isin(self._course_ids, changed_ids)
+        affected |= np.isin(self._neighbor_ids, changed_ids).any(axis=1)
+        if embeddings:
+            changed_rows = [row_index[course_id] for course_id in embeddings]
+            similarity = self._matrix @ self._matrix[changed_rows].T  # (课程数, 变化课程数)
+            similarity[changed_rows, np.arange(len(changed_rows))] = -np.inf
+            affected |= similarity.max(axis=1) > self._neighbor_scores[:, -1]
+        rows = np.flatnonzero(affected)
+        self._compute_rows(rows)
+        self._save(vector_store.generation)
+        logger.info(f"课程相似度图增量更新: 变化 {len(changed_ids)} 门，重新计算 {len(rows)}/{len(self._course_ids)} 门")
+        return len(rows)
+    
+    def ensure_built(self, vector_store: VectorStore) -> bool:
+        """
+        图文件不存在或与知识库代次不一致时重建（服务启动时调用，覆盖从快照导入等情况）
+        
+        Returns:
+            是否重建
+        """
+        if self._neighbors and self.generation == vector_store.generation:
+            return False
+        if vector_store.count() == 0:
+            return False
+        self.build(vector_store)
+        return True
+    
+    def _compute_rows(self, rows: np.ndarray):
+        """分块计算指定行的前k个邻居（排除自身）"""
+        count = len(self._course_ids)
+        top_k = min(self.k, count - 1)
+        self._neighbor_ids[rows] = -1
+        self._neighbor_scores[rows] = -np.inf
+        if top_k <= 0:
+            return
+        batch_size = settings.knn_graph_batch_size
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            similarity = self._matrix[batch] @ self._matrix.T
+            similarity[np.arange(len(batch)), batch] = -np.inf
+            top = np.argpartition(-similarity, top_k - 1, axis=1)[:, :top_k]
+            top_scores = np.take_along_axis(similarity, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            self._neighbor_ids[batch, :top_k] = self._course_ids[top]
+            self._neighbor_scores[batch, :top_k] = np.take_along_axis(top_scores, order, axis=1)
+    
+    def _load_matrix(self, vector_store: VectorStore):
+        """从知识库加载全部课程向量（行归一化）"""
+        course_ids, rows = [], []
+        for _, _, metadatas, embeddings in vector_store.iter_all(include_embeddings=True):
+            for metadata, embedding in zip(metadatas, embeddings):
+                if metadata and metadata.get("course_id"):
+                    course_ids.append(int(metadata["course_id"]))
+                    rows.append(embedding)
+        dimension = len(rows[0]) if rows else vector_store.embedding_model.dimension
+        self._course_ids = np.asarray(course_ids, dtype=np.int64)
+        self._matrix = self._normalize(np.asarray(rows, dtype=np.float32).reshape(len(rows), dimension))
+    
+    def _save(self, generation: str):
+        """保存到文件（先写临时文件再替换），并刷新查询用的字典"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            course_ids=self._course_ids,
+            neighbor_ids=self._neighbor_ids,
+            neighbor_scores=self._neighbor_scores.astype(np.float16),
+            generation=np.asarray(generation)
+        )
+        os.replace(tmp_path, self.path)
+        self._file_mtime = os.stat(self.path).st_mtime_ns
+        self.generation = generation
+        self._index(self._course_ids, self._neighbor_ids, self._neighbor_scores)
+    
+    def _load(self):
+        """从文件加载（文件不存在时为空图）"""
+        try:
+            with np.load(self.path) as data:
+                course_ids = data["course_ids"]
+                neighbor_ids = data["neighbor_ids"]
+                neighbor_scores = data["neighbor_scores"].astype(np.float32)
+                generation = str(data["generation"])
+            self._file_mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"加载课程相似度图失败: {e}")
+            return
+        self.generation = generation
+        self._course_ids, self._neighbor_ids, self._neighbor_scores = course_ids, neighbor_ids, neighbor_scores
+        # 向量矩阵不随文件保存，增量更新前需要重新加载
+        self._matrix = None
+        self._index(course_ids, neighbor_ids, neighbor_scores)
+        logger.info(f"已加载课程相似度图: {len(course_ids)} 门课程")
+    
+    def _reload_if_changed(self):
+        """文件被其他进程更新时重新加载"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._file_mtime:
+            self._load()
+    
+    def _index(self, course_ids: np.ndarray, neighbor_ids: np.ndarray, neighbor_scores: np.ndarray):
+        """把邻居数组转换为查询用的字典（查询时不再涉及numpy）"""
+        neighbors = {}
+        for course_id, ids, scores in zip(course_ids.tolist(), neighbor_ids.tolist(), neighbor_scores.tolist()):
+            neighbors[course_id] = [(nid, round(score, 4)) for nid, score in zip(ids, scores) if nid >= 0]
+        self._neighbors = neighbors
+    
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        """行归一化，点积即余弦相似度"""
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms > 0, norms, 1.0)
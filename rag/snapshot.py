@@ -0,0 +1,185 @@
+"""
+知识库快照：导出/导入课程文档、元数据和向量
+
+新副本启动时不必重新同步并向量化整个课程目录，也不必复制 Chroma 目录，
+只需导入由同步任务生成的一个快照文件。导入时直接写入向量，不运行嵌入模型。
+
+快照格式（ZIP，DEFLATE压缩）：
+- manifest.json: 格式版本、嵌入模型名称、向量维度、文档数量、创建时间等
+- documents.jsonl: 每行一个文档 {"id", "text", "metadata"}，顺序与向量一致
+- embeddings.f32: 连续的 float32 小端二进制数组，形状为 (count, dimension)
+
+使用示例：
+    # 同步任务中导出
+    python -m rag.snapshot export ./data/kb.snapshot
+    
+    # 新副本启动前导入（或配置 KB_SNAPSHOT_PATH，知识库为空时自动导入）
+    python -m rag.snapshot import ./data/kb.snapshot
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from typing import Dict
+import numpy as np
+from loguru import logger
+from rag.vector_store import VectorStore
+
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+_MANIFEST_FILE = "manifest.json"
+_DOCUMENTS_FILE = "documents.jsonl"
+_EMBEDDINGS_FILE = "embeddings.f32"
+
+
+class SnapshotError(Exception):
+    """快照格式或内容与当前知识库不兼容"""
+
+
+def _model_version() -> str:
+    """获取嵌入模型运行库版本"""
+    try:
+        import sentence_transformers
+        return getattr(sentence_transformers, "__version__", "unknown")
+    except ImportError:
+        return "unknown"
+
+
+def export_snapshot(vector_store: VectorStore, path: str, batch_size: int = 1000) -> Dict:
+    """
+    导出知识库快照
+    
+    Args:
+        vector_store: 向量数据库
+        path: 快照文件路径
+        batch_size: 每批从集合读取的文档数
+    
+    Returns:
+        快照清单（manifest）
+    """
+    dimension = vector_store.embedding_model.dimension
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    
+    count = 0
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as zf, tempfile.TemporaryFile() as emb_buffer:
+        # ZIP同一时间只能写一个条目，向量先写入临时文件，文档写完后再整体写入
+        with zf.open(_DOCUMENTS_FILE, "w", force_zip64=True) as doc_file:
+            for ids, texts, metadatas, embeddings in vector_store.iter_all(batch_size=batch_size):
+                matrix = np.asarray(embeddings, dtype="<f4")
+                if matrix.ndim != 2 or matrix.shape[1] != dimension:
+                    raise SnapshotError(f"向量维度不一致: 期望 {dimension}，实际 {matrix.shape}")
+                for doc_id, text, metadata in zip(ids, texts, metadatas):
+                    line = json.dumps({"id": doc_id, "text": text, "metadata": metadata}, ensure_ascii=False)
+                    doc_file.write(line.encode("utf-8") + b"\n")
+                emb_buffer.write(np.ascontiguousarray(matrix).tobytes())
+                count += len(ids)
+        
+        emb_buffer.seek(0)
+        with zf.open(_EMBEDDINGS_FILE, "w", force_zip64=True) as emb_file:
+            shutil.copyfileobj(emb_buffer, emb_file)
+        
+        manifest = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "collection": vector_store.collection_name,
+            "embedding_model": vector_store.embedding_model.model_name,
+            "model_version": _model_version(),
+            "dimension": dimension,
+            "dtype": "float32",
+            "count": count,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        zf.writestr(_MANIFEST_FILE, json.dumps(manifest, ensure_ascii=False, indent=2))
+    
+    os.replace(tmp_path, path)
+    logger.info(f"知识库快照导出完成: {path}，共 {count} 个文档")
+    return manifest
+
+
+def read_manifest(path: str) -> Dict:
+    """
+    读取快照清单
+    
+    Args:
+        path: 快照文件路径
+    
+    Returns:
+        快照清单（manifest）
+    """
+    with zipfile.ZipFile(path, "r") as zf:
+        return json.loads(zf.read(_MANIFEST_FILE))
+
+
+def import_snapshot(vector_store: VectorStore, path: str, force: bool = False, batch_size: int = 1000) -> int:
+    """
+    导入知识库快照（直接写入向量，不运行嵌入模型）
+    
+    Args:
+        vector_store: 向量数据库
+        path: 快照文件路径
+        force: 嵌入模型不一致时是否仍然导入（查询向量与文档向量将不可比，仅用于调试）
+        batch_size: 每批写入的文档数
+    
+    Returns:
+        导入的文档数量
+    """
+    with zipfile.ZipFile(path, "r") as zf:
+        manifest = json.loads(zf.read(_MANIFEST_FILE))
+        if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+            raise SnapshotError(f"不支持的快照格式版本: {manifest.get('format_version')}")
+        
+        model_name = vector_store.embedding_model.model_name
+        if manifest["embedding_model"] != model_name and not force:
+            raise SnapshotError(f"快照的嵌入模型 {manifest['embedding_model']} 与当前模型 {model_name} 不一致")
+        
+        count, dimension = manifest["count"], manifest["dimension"]
+        embeddings = np.frombuffer(zf.read(_EMBEDDINGS_FILE), dtype="<f4")
+        if embeddings.size != count * dimension:
+            raise SnapshotError(f"向量数据长度不正确: 期望 {count * dimension}，实际 {embeddings.size}")
+        embeddings = embeddings.reshape(count, dimension)
+        
+        ids, texts, metadatas = [], [], []
+        with zf.open(_DOCUMENTS_FILE, "r") as doc_file:
+            for line in doc_file:
+                doc = json.loads(line)
+                ids.append(doc["id"])
+                texts.append(doc["text"])
+                metadatas.append(doc["metadata"])
+        if len(ids) != count:
+            raise SnapshotError(f"文档数量不正确: 期望 {count}，实际 {len(ids)}")
+    
+    logger.info(f"开始导入知识库快照: {path}，共 {count} 个文档（创建于 {manifest.get('created_at')}）")
+    vector_store.add_embeddings(ids, texts, metadatas, embeddings, batch_size=batch_size)
+    logger.info("知识库快照导入完成")
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="知识库快照导出/导入")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="导出知识库快照")
+    export_parser.add_argument("path", help="快照文件路径")
+    import_parser = subparsers.add_parser("import", help="导入知识库快照")
+    import_parser.add_argument("path", help="快照文件路径")
+    import_parser.add_argument("--reset", action="store_true", help="导入前清空现有集合")
+    import_parser.add_argument("--force", action="store_true", help="嵌入模型不一致时仍然导入")
+    info_parser = subparsers.add_parser("info", help="查看快照清单")
+    info_parser.add_argument("path", help="快照文件路径")
+    args = parser.parse_args()
+    
+    if args.command == "info":
+        print(json.dumps(read_manifest(args.path), ensure_ascii=False, indent=2))
+    else:
+        store = VectorStore()
+        if args.command == "export":
+            export_snapshot(store, args.path)
+        else:
+            if args.reset:
+                store.reset()
+            import_snapshot(store, args.path, force=args.force)
@@ -0,0 +1,134 @@
+"""
+检索结果摘录：从课程文档中选出与查询最相关的句子或大纲行
+
+VectorStore.search 默认返回完整文档，大纲较长的课程每条结果有数KB，再乘以 top_k 全部进入prompt。
+摘录按词汇重叠给文档片段打分（中文按字二元组，英文按单词），在字符预算内选出得分最高的片段，
+按原文顺序拼接；课程名称行始终保留，命中的大纲小节会带上所属章名。
+
+使用示例：
+    from rag.snippet import extract_snippet
+    
+    snippet = extract_snippet(document_text, "Java多线程 并发", max_chars=300)
+"""
+import re
+from typing import List, Set, Tuple
+
+
+# 片段之间省略的内容用该标记连接
+GAP_MARKER = " … "
+
+_SENTENCE_PATTERN = re.compile(r"[^。！？；!?;\n]+[。！？；!?;]?")
+_WORD_PATTERN = re.compile(r"[a-z0-9+#.]+|[\u4e00-\u9fff]+")
+_CJK_PATTERN = re.compile(r"[\u4e00-\u9fff]")
+
+
+def tokenize(text: str) -> Set[str]:
+    """
+    把文本切分为用于重叠比较的词项
+    
+    英文和数字按单词切分（转小写），中文连续串切分为字二元组（单字串保留单字）。
+    
+    Args:
+        text: 文本
+    
+    Returns:
+        词项集合
+    """
+    terms = set()
+    for word in _WORD_PATTERN.findall(text.lower()):
+        if _CJK_PATTERN.match(word):
+            if len(word) == 1:
+                terms.add(word)
+            terms.update(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            terms.add(word)
+    return terms
+
+
+def _split_segments(text: str) -> List[Tuple[str, int, int]]:
+    """
+    把文档切分为片段
+    
+    每行是一个片段，长行再按句子切分；大纲中的小节行记录所属章所在片段的下标。
+    
+    Returns:
+        (片段文本, 所属章片段下标（无则为-1）, 行号) 列表
+    """
+    segments = []
+    chapter_index = -1
+    for line_no, line in enumerate(text.split("\n")):
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped.startswith("章："):
+            chapter_index = len(segments)
+            segments.append((stripped, -1, line_no))
+        elif stripped.startswith(("节：", "测试：")):
+            segments.append((stripped, chapter_index, line_no))
+        else:
+            for sentence in _SENTENCE_PATTERN.findall(stripped):
+                sentence = sentence.strip()
+                if sentence:
+                    segments.append((sentence, -1, line_no))
+    return segments
+
+
+def extract_snippet(text: str, query: str, max_chars: int = 300) -> str:
+    """
+    从文档中提取与查询相关的摘录
+    
+    Args:
+        text: 完整文档文本
+        query: 查询文本
+        max_chars: 摘录的最大字符数
+    
+    Returns:
+        摘录文本；文档本身不超过预算时原样返回
+    """
+    if len(text) <= max_chars:
+        return text
+    segments = _split_segments(text)
+    if not segments:
+        return text[:max_chars]
+    
+    query_terms = tokenize(query)
+    scored = []
+    for index, (segment, _, _) in enumerate(segments):
+        terms = tokenize(segment)
+        overlap = len(terms & query_terms)
+        if overlap:
+            # 命中词项越多越好；同样命中数时偏向短片段，留出预算给更多片段
+            scored.append((overlap / (len(terms) ** 0.5), index))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    
+    # 课程名称（第一行）始终保留，作为摘录的标题
+    selected = {0}
+    used = len(segments[0][0])
+    for _, index in scored:
+        needed = [i for i in (segments[index][1], index) if i >= 0 and i not in selected]
+        cost = sum(len(segments[i][0]) + len(GAP_MARKER) for i in needed)
+        if used + cost > max_chars:
+            continue
+        selected.update(needed)
+        used += cost
+    
+    # 没有任何命中时依次补充开头的片段（通常是课程介绍）
+    if not scored:
+        for index in range(1, len(segments)):
+            if used + len(segments[index][0]) + len(GAP_MARKER) > max_chars:
+                break
+            selected.add(index)
+            used += len(segments[index][0]) + len(GAP_MARKER)
+    
+    parts = []
+    previous = None
+    for index in sorted(selected):
+        if previous is not None and index != previous + 1:
+            parts.append(GAP_MARKER)
+        elif previous is not None:
+            # 同一行内相邻的句子直接连接
+            parts.append("" if segments[index][2] == segments[previous][2] else "\n")
+        parts.append(segments[index][0])
+        previous = index
+    snippet = "".join(parts)
+    return snippet if len(snippet) <= max_chars else snippet[:max_chars]
@@ -2,12 +2,53 @@
 向量数据库封装（ChromaDB）
 """
 import chromadb
-from chromadb.config import Settings as ChromaSettings
-from typing import List, Dict, Optional
+from chromadb.api import ServerAPI
+from chromadb.api.client import Client as ChromaClient
+from chromadb.config import Settings as ChromaSettings, System
+from chromadb.telemetry.product import ProductTelemetryClient
+from typing import Collection, List, Dict, Optional
 from loguru import logger
 import os
+import threading
+import time
 from config import settings
+from metrics import VECTOR_STORE_SECONDS, timed
+from tracing import span
 from rag.embedding import EmbeddingModel
+from rag.snippet import extract_snippet
+
+
+# 进程内各数据库目录的打开状态：
+# 路径 -> {"generation": 打开时或本进程最后写入的代次, "epoch": 重新打开的次数, "system": 当前的Chroma系统}
+# 同一进程中的多个 VectorStore 共用Chroma按路径缓存的客户端，其他进程写入后一起切换到重新打开的客户端
+_open_states: Dict[str, Dict] = {}
+_open_lock = threading.Lock()
+
+
+def _start_system(path: str) -> System:
+    """
+    为数据库目录新建并启动Chroma系统，登记为该路径的共享系统（之后 PersistentClient 打开的都是它）
+    
+    Args:
+        path: 数据库目录
+    
+    Returns:
+        Chroma系统
+    """
+    system = System(ChromaSettings(anonymized_telemetry=False, is_persistent=True, persist_directory=path))
+    system.instance(ProductTelemetryClient)
+    system.instance(ServerAPI)
+    system.start()
+    ChromaClient.from_system(system)
+    return system
+
+
+def _stop_system(system: System):
+    """关闭被替换的Chroma系统（释放SQLite连接和加载在内存中的索引）"""
+    try:
+        system.stop()
+    except Exception as e:
+        logger.warning(f"关闭旧的Chroma实例失败: {e}")
 
 
 class VectorStore:
@@ -26,22 +67,110 @@ class VectorStore:
         # 确保目录存在
         os.makedirs(self.db_path, exist_ok=True)
         
-        # 初始化ChromaDB客户端
+        # 初始化嵌入模型
+        self.embedding_model = EmbeddingModel()
+        
+        # 初始化ChromaDB客户端并获取或创建集合
+        self.client = None
+        self._collection = None
+        self._epoch = -1
+        self._checked_at = time.monotonic()
+        with _open_lock:
+            if self.db_path not in _open_states:
+                _open_states[self.db_path] = {
+                    "generation": self.generation,
+                    "epoch": 0,
+                    "system": _start_system(self.db_path),
+                }
+            self._open()
+        
+        logger.info(f"向量数据库初始化完成，集合: {self.collection_name}")
+    
+    @property
+    def collection(self):
+        """
+        Chroma集合
+        
+        多个进程共用数据库目录时只有一个进程写入（见 rag.writer_lease），其他进程的客户端把索引加载在内存中，
+        看不到新写入的文档。访问集合时（最多每秒一次）检查代次标记，被其他进程更新后重新打开客户端。
+        """
+        self._reload_if_changed()
+        return self._collection
+    
+    def _open(self):
+        """打开客户端和集合（调用方持有 _open_lock）"""
         self.client = chromadb.PersistentClient(
             path=self.db_path,
             settings=ChromaSettings(anonymized_telemetry=False)
         )
-        
-        # 初始化嵌入模型
-        self.embedding_model = EmbeddingModel()
-        
-        # 获取或创建集合
-        self.collection = self.client.get_or_create_collection(
+        self._collection = self.client.get_or_create_collection(
             name=self.collection_name,
             metadata={"hnsw:space": "cosine"}  # 使用余弦相似度
         )
+        self._epoch = _open_states[self.db_path]["epoch"]
+    
+    def _reload_if_changed(self):
+        """其他进程写入后（代次标记与本进程已知的不一致）重新打开客户端"""
+        state = _open_states[self.db_path]
+        now = time.monotonic()
+        if now - self._checked_at > 1.0:
+            self._checked_at = now
+            generation = self.generation
+            if generation != state["generation"]:
+                with _open_lock:
+                    if generation != state["generation"]:
+                        self._replace_system(state)
+                        state["generation"] = generation
+                        state["epoch"] += 1
+                        logger.info(f"知识库已被其他进程更新，重新加载集合: {self.collection_name}")
+        if self._epoch != state["epoch"]:
+            with _open_lock:
+                self._open()
+    
+    def _replace_system(self, state: Dict):
+        """
+        为本数据库目录新建Chroma系统（调用方持有 _open_lock）
         
-        logger.info(f"向量数据库初始化完成，集合: {self.collection_name}")
+        PersistentClient 按路径缓存在进程内，换成新系统后再打开客户端才会从磁盘重新加载索引；
+        其他路径的客户端不受影响。旧系统在 chroma_reload_grace_seconds 后关闭：各实例下次访问集合时
+        已切换到新系统，宽限期内仍在使用旧系统的查询可以正常完成。
+        
+        Args:
+            state: 本数据库目录的打开状态
+        """
+        previous = state["system"]
+        state["system"] = _start_system(self.db_path)
+        timer = threading.Timer(settings.chroma_reload_grace_seconds, _stop_system, args=(previous,))
+        timer.daemon = True
+        timer.start()
+    
+    @property
+    def generation(self) -> str:
+        """
+        知识库代次标记：每次写入或删除文档后变化，用于判断依赖知识库内容的缓存是否失效
+        
+        标记保存在数据库目录下的文件中，共享同一目录的其他进程也能感知变化。
+        """
+        try:
+            with open(self._generation_path, "r", encoding="utf-8") as f:
+                return f.read().strip() or "0"
+        except FileNotFoundError:
+            return "0"
+    
+    @property
+    def _generation_path(self) -> str:
+        """代次标记文件路径"""
+        return os.path.join(self.db_path, f"{self.collection_name}.generation")
+    
+    def _bump_generation(self):
+        """更新代次标记（先写临时文件再替换，读取方不会读到半个值）"""
+        generation = str(time.time_ns())
+        tmp_path = f"{self._generation_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(generation)
+        os.replace(tmp_path, self._generation_path)
+        # 本进程的写入对进程内共用的客户端可见，不需要重新打开
+        _open_states[self.db_path]["generation"] = generation
     
     def add_documents(self, documents: List[Dict[str, str]], batch_size: int = 100):
         """
@@ -51,12 +180,102 @@ class VectorStore:
             documents: 文档列表，每个文档包含 id, text, metadata
             batch_size: 批次大小
         """
+        self._write_documents(documents, batch_size, self.collection.add)
+    
+    def upsert_documents(self, documents: List[Dict[str, str]], batch_size: int = 100):
+        """
+        批量新增或更新文档（ID已存在时覆盖）
+        
+        Args:
+            documents: 文档列表，每个文档包含 id, text, metadata
+            batch_size: 批次大小
+        """
+        self._write_documents(documents, batch_size, self.collection.upsert)
+    
+    def delete_documents(self, ids: List[str]):
+        """
+        按文档ID删除文档
+        
+        Args:
+            ids: 文档ID列表，不存在的ID会被忽略
+        """
+        if not ids:
+            return
+        with timed(VECTOR_STORE_SECONDS, op="delete"), span("vector_store.delete"):
+            self.collection.delete(ids=ids)
+        self._bump_generation()
+        logger.info(f"已删除 {len(ids)} 个文档")
+    
+    def add_embeddings(
+        self,
+        ids: List[str],
+        texts: List[str],
+        metadatas: List[Dict],
+        embeddings,
+        batch_size: int = 1000
+    ):
+        """
+        直接写入已经计算好的向量（不运行嵌入模型），用于快照导入等批量加载场景
+        
+        Args:
+            ids: 文档ID列表
+            texts: 文档文本列表
+            metadatas: 元数据列表
+            embeddings: 向量矩阵（numpy数组或嵌套列表），行数与ids一致
+            batch_size: 批次大小
+        """
+        total = len(ids)
+        for i in range(0, total, batch_size):
+            batch_embeddings = embeddings[i:i + batch_size]
+            if hasattr(batch_embeddings, "tolist"):
+                batch_embeddings = batch_embeddings.tolist()
+            with timed(VECTOR_STORE_SECONDS, op="write"), span("vector_store.write"):
+                self.collection.upsert(
+                    embeddings=batch_embeddings,
+                    documents=texts[i:i + batch_size],
+                    ids=ids[i:i + batch_size],
+                    metadatas=metadatas[i:i + batch_size]
+                )
+            logger.info(f"已导入 {min(i + batch_size, total)}/{total} 个向量")
+        self._bump_generation()
+    
+    def iter_all(self, batch_size: int = 1000, include_embeddings: bool = True):
+        """
+        分批遍历集合中的全部文档
+        
+        Args:
+            batch_size: 每批读取的文档数
+            include_embeddings: 是否同时读取向量
+        
+        Yields:
+            每批的 (ids, texts, metadatas, embeddings)，不读取向量时 embeddings 为 None
+        """
+        include = ["documents", "metadatas"] + (["embeddings"] if include_embeddings else [])
+        offset = 0
+        while True:
+            batch = self.collection.get(limit=batch_size, offset=offset, include=include)
+            ids = batch.get("ids") or []
+            if not ids:
+                break
+            embeddings = batch.get("embeddings") if include_embeddings else None
+            yield ids, batch.get("documents") or [], batch.get("metadatas") or [], embeddings
+            offset += len(ids)
+    
+    def _write_documents(self, documents: List[Dict[str, str]], batch_size: int, write_func):
+        """
+        向量化并分批写入文档
+        
+        Args:
+            documents: 文档列表，每个文档包含 id, text, metadata
+            batch_size: 批次大小
+            write_func: 集合的写入方法（add 或 upsert）
+        """
         if not documents:
             logger.warning("文档列表为空，跳过添加")
             return
         
         total = len(documents)
-        logger.info(f"开始添加 {total} 个文档到向量数据库...")
+        logger.info(f"开始写入 {total} 个文档到向量数据库...")
         
         # 提取文本
         texts = [doc["text"] for doc in documents]
@@ -72,19 +291,28 @@ class VectorStore:
             # 生成嵌入向量
             embeddings = self.embedding_model.embed_documents(batch_texts)
             
-            # 添加到集合
-            self.collection.add(
-                embeddings=embeddings,
-                documents=batch_texts,
-                ids=batch_ids,
-                metadatas=batch_metadatas
-            )
+            # 写入集合
+            with timed(VECTOR_STORE_SECONDS, op="write"), span("vector_store.write"):
+                write_func(
+                    embeddings=embeddings,
+                    documents=batch_texts,
+                    ids=batch_ids,
+                    metadatas=batch_metadatas
+                )
             
-            logger.info(f"已添加 {min(i + batch_size, total)}/{total} 个文档")
+            logger.info(f"已写入 {min(i + batch_size, total)}/{total} 个文档")
         
-        logger.info("所有文档添加完成")
+        self._bump_generation()
+        logger.info("所有文档写入完成")
     
-    def search(self, query: str, top_k: int = 5, filter_metadata: Optional[Dict] = None) -> List[Dict]:
+    def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        filter_metadata: Optional[Dict] = None,
+        snippet_chars: Optional[int] = None,
+        exclude_course_ids: Optional[Collection[int]] = None
+    ) -> List[Dict]:
         """
         搜索相似文档
         
@@ -92,32 +320,143 @@ class VectorStore:
             query: 查询文本
             top_k: 返回前k个结果
             filter_metadata: 元数据过滤条件
+            snippet_chars: 摘录的最大字符数（可选）；指定时 text 为与查询相关的摘录而不是完整文档，
+                完整文档可通过 get_documents 按课程ID获取
+            exclude_course_ids: 需要排除的课程ID（如用户已购买的课程）；多取 len(exclude_course_ids) 条后过滤，
+                保证一次查询就能返回 top_k 条可用结果
             
         Returns:
-            搜索结果列表，每个结果包含 text, metadata, distance
+            搜索结果列表，每个结果包含 text, metadata, distance；返回摘录时另有 snippet=True
         """
         # 生成查询向量
         query_embedding = self.embedding_model.embed_query(query)
         
-        # 执行搜索
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=top_k,
-            where=filter_metadata
-        )
+        # 执行搜索（有排除的课程时多取，被排除的课程最多占用 len(exclude_course_ids) 个位置）
+        exclude = {str(course_id) for course_id in exclude_course_ids or ()}
+        with timed(VECTOR_STORE_SECONDS, op="query"), span("vector_store.query"):
+            results = self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=top_k + len(exclude),
+                where=filter_metadata
+            )
         
         # 格式化结果
         search_results = []
         if results["documents"] and len(results["documents"][0]) > 0:
             for i in range(len(results["documents"][0])):
-                search_results.append({
+                if len(search_results) >= top_k:
+                    break
+                metadata = results["metadatas"][0][i] if results["metadatas"] else {}
+                if exclude and str((metadata or {}).get("course_id")) in exclude:
+                    continue
+                result = {
                     "text": results["documents"][0][i],
-                    "metadata": results["metadatas"][0][i] if results["metadatas"] else {},
+                    "metadata": metadata,
                     "distance": results["distances"][0][i] if results["distances"] else 0.0
-                })
+                }
+                if snippet_chars and len(result["text"]) > snippet_chars:
+                    result["text"] = extract_snippet(result["text"], query, snippet_chars)
+                    result["snippet"] = True
+                search_results.append(result)
         
         return search_results
     
+    def search_many(self, queries: List[str], top_k: int = 5) -> List[List[Dict]]:
+        """
+        批量检索：所有查询一次编码、一次向量检索（用于批量推荐，相同的查询由调用方去重）
+        
+        Args:
+            queries: 查询文本列表
+            top_k: 每个查询返回前k个结果
+        
+        Returns:
+            与 queries 一一对应的结果列表，每个结果包含 metadata, distance（不返回文档文本）
+        """
+        if not queries:
+            return []
+        query_embeddings = self.embedding_model.embed_queries(queries)
+        with timed(VECTOR_STORE_SECONDS, op="query_many"), span("vector_store.query_many"):
+            results = self.collection.query(
+                query_embeddings=query_embeddings,
+                n_results=top_k,
+                include=["metadatas", "distances"]
+            )
+        return [
+            [{"metadata": metadata or {}, "distance": distance} for metadata, distance in zip(metadatas, distances)]
+            for metadatas, distances in zip(results["metadatas"], results["distances"])
+        ]
+    
+    def get_documents(self, course_ids: List[int]) -> Dict[int, Dict]:
+        """
+        按课程ID批量获取完整文档（不做向量检索）
+        
+        Args:
+            course_ids: 课程ID列表
+        
+        Returns:
+            课程ID到文档的映射，每个文档包含 id, text, metadata
+        """
+        if not course_ids:
+            return {}
+        with timed(VECTOR_STORE_SECONDS, op="get"), span("vector_store.get"):
+            results = self.collection.get(
+                ids=[f"course_{course_id}" for course_id in course_ids],
+                include=["documents", "metadatas"]
+            )
+        documents = {}
+        for doc_id, text, metadata in zip(results["ids"], results["documents"], results["metadatas"]):
+            if metadata and metadata.get("course_id"):
+                documents[int(metadata["course_id"])] = {"id": doc_id, "text": text, "metadata": metadata}
+        return documents
+    
+    def get_course_metadata(self, course_ids: List[int]) -> Dict[int, Dict]:
+        """
+        按课程ID批量获取元数据（不做向量检索）
+        
+        Args:
+            course_ids: 课程ID列表
+        
+        Returns:
+            课程ID到元数据的映射，知识库中不存在的课程不会出现在结果中
+        """
+        if not course_ids:
+            return {}
+        with timed(VECTOR_STORE_SECONDS, op="get"), span("vector_store.get"):
+            results = self.collection.get(
+                ids=[f"course_{course_id}" for course_id in course_ids],
+                include=["metadatas"]
+            )
+        metadata_map = {}
+        for metadata in results.get("metadatas") or []:
+            if metadata and metadata.get("course_id"):
+                metadata_map[int(metadata["course_id"])] = metadata
+        return metadata_map
+    
+    def get_course_embeddings(self, course_ids: List[int]) -> Dict[int, List[float]]:
+        """
+        按课程ID批量获取向量（不做向量检索）
+        
+        Args:
+            course_ids: 课程ID列表
+        
+        Returns:
+            课程ID到向量的映射，知识库中不存在的课程不会出现在结果中
+        """
+        if not course_ids:
+            return {}
+        with timed(VECTOR_STORE_SECONDS, op="get"), span("vector_store.get"):
+            results = self.collection.get(
+                ids=[f"course_{course_id}" for course_id in course_ids],
+                include=["metadatas", "embeddings"]
+            )
+        # 新版本的Chroma返回numpy数组，不能直接做真值判断
+        vectors = results.get("embeddings")
+        embeddings = {}
+        for metadata, embedding in zip(results.get("metadatas") or [], vectors if vectors is not None else []):
+            if metadata and metadata.get("course_id"):
+                embeddings[int(metadata["course_id"])] = embedding
+        return embeddings
+    
     def count(self) -> int:
         """
         获取集合中的文档数量
@@ -138,9 +477,10 @@ class VectorStore:
             self.delete_collection()
         except:
             pass
-        self.collection = self.client.get_or_create_collection(
-            name=self.collection_name,
-            metadata={"hnsw:space": "cosine"}
-        )
+        with _open_lock:
+            # 进程内其他 VectorStore 持有的集合对象已被删除，一起重新获取
+            _open_states[self.db_path]["epoch"] += 1
+            self._open()
+        self._bump_generation()
         logger.info("集合已重置")
 
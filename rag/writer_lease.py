@@ -0,0 +1,103 @@
+"""
+知识库写入租约：多个进程共用同一个Chroma目录时，只允许一个进程写入
+
+多个工作进程或副本共用 chroma_db_path 时，每个进程都可能在启动时执行空库预热，或者处理 /sync
+和课程变更事件，同时写同一组SQLite/HNSW文件轻则互相等待，重则损坏索引。租约用数据库目录下的锁文件
+（fcntl.flock）选出唯一的写入进程：
+- 拿到租约的进程负责预热、全量同步和增量同步
+- 其他进程只读：通过代次标记感知写入并重新加载集合（见 VectorStore.collection），
+  收到的同步请求写入同步暂存目录（services.sync_spool），由写入进程执行
+- 写入进程退出（包括崩溃）时操作系统释放锁，其他进程定期重试即可接替
+
+flock 只在同一台机器（或支持flock的共享文件系统）上的进程之间生效；不支持 fcntl 的系统上总是拿到租约。
+
+使用示例：
+    from rag.writer_lease import WriterLease
+    
+    lease = WriterLease()
+    if lease.try_acquire():
+        ...  # 写入知识库
+    else:
+        print(f"写入进程: {lease.holder()}")
+"""
+import os
+import socket
+from typing import Optional
+from loguru import logger
+from config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class WriterLease:
+    """基于文件锁的写入租约（持有期间为进程级，进程退出时自动释放）"""
+    
+    def __init__(self, path: Optional[str] = None):
+        """
+        初始化租约
+        
+        Args:
+            path: 锁文件路径，默认为数据库目录下的 writer.lock
+        """
+        self.path = path or os.path.join(settings.chroma_db_path, "writer.lock")
+        self._fd: Optional[int] = None
+    
+    @property
+    def held(self) -> bool:
+        """当前进程是否持有租约"""
+        return self._fd is not None
+    
+    def try_acquire(self) -> bool:
+        """
+        尝试获取租约（不阻塞）
+        
+        Returns:
+            是否持有租约
+        """
+        if self._fd is not None:
+            return True
+        if fcntl is None:
+            logger.warning("当前系统不支持 fcntl，跳过写入租约（请勿让多个进程共用知识库目录）")
+            self._fd = -1
+            return True
+        
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # 写入持有者信息，便于其他进程和运维查看
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{socket.gethostname()}:{os.getpid()}".encode("utf-8"))
+        os.fsync(fd)
+        self._fd = fd
+        logger.info(f"已获取知识库写入租约: {self.path}")
+        return True
+    
+    def release(self):
+        """释放租约"""
+        if self._fd is None:
+            return
+        if self._fd >= 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        self._fd = None
+        logger.info("已释放知识库写入租约")
+    
+    def holder(self) -> Optional[str]:
+        """
+        读取租约持有者（主机名:进程ID）
+        
+        Returns:
+            持有者信息；锁文件不存在时返回None
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
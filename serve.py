@@ -0,0 +1,344 @@
+"""
+生产环境启动脚本：预加载模型后 fork 多个工作进程
+
+run.py 以 reload 模式单进程启动，适合开发。直接用 uvicorn --workers 启动多个进程时，每个进程在
+lifespan 中各自加载一份嵌入模型，内存随进程数成倍增长。本脚本：
+1. 主进程绑定监听端口，导入应用并加载嵌入模型权重，然后 gc.freeze()；fork 出的工作进程通过
+   写时复制共享这部分内存（权重只读，GC也不再扫描这些对象，页面不会被复制）
+2. 在一个临时子进程中准备知识库（导入快照或同步、构建相似度图和分类索引），工作进程启动时不再重复同步
+3. fork N 个工作进程，共用同一个监听socket；工作进程异常退出时自动拉起
+
+ChromaDB 客户端（SQLite连接和HNSW索引）不能跨 fork 使用，仍由每个工作进程在 lifespan 中各自打开；
+主进程在 fork 之前不运行模型推理，避免推理线程池在子进程中失效。
+
+信号：
+- SIGHUP：逐个平滑重启工作进程（先启动新进程并等待就绪，再让旧进程处理完进行中的请求后退出）
+- SIGTERM / SIGINT：平滑关闭全部工作进程后退出
+
+使用示例：
+    python serve.py                           # 使用配置中的进程数（SERVER_WORKERS）
+    python serve.py --workers 4 --threads 2
+    kill -HUP <主进程PID>                      # 平滑重启（不重新加载代码和模型）
+"""
+import argparse
+import asyncio
+import gc
+import os
+import select
+import signal
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+import uvicorn
+from loguru import logger
+from config import settings
+
+
+def _bind_socket(host: str, port: int) -> socket.socket:
+    """绑定监听socket（由主进程持有，重启工作进程期间新连接在backlog中排队，不会被拒绝）"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _preload():
+    """导入应用并加载嵌入模型（在 fork 之前执行）"""
+    import main  # noqa: F401  导入应用及其依赖的全部模块，模块对象同样由工作进程共享
+    from rag.embedding import load_model
+    
+    load_model()
+    gc.collect()
+    gc.freeze()
+
+
+def _prepare_knowledge_base() -> bool:
+    """
+    在临时子进程中准备知识库（Chroma客户端不能在主进程中打开，否则会被 fork 到工作进程）
+    
+    Returns:
+        是否成功；失败时工作进程在 lifespan 中会再次尝试
+    """
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            import main
+            from rag.vector_store import VectorStore
+            from rag.writer_lease import WriterLease
+            
+            # 其他副本正在写入同一个知识库目录时跳过，由持有写入租约的进程负责
+            if WriterLease().try_acquire():
+                asyncio.run(main.prepare_knowledge_base(VectorStore()))
+            else:
+                logger.info("知识库写入租约由其他进程持有，跳过预热")
+        except Exception as e:
+            logger.error(f"准备知识库失败: {e}")
+            code = 1
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status) == 0
+
+
+def _prepare_metrics_dir():
+    """
+    多进程指标目录：必须在导入 prometheus_client（导入应用）之前设置环境变量；
+    清空上次运行留下的文件，否则计数器会从上次的值累加
+    """
+    if not settings.metrics_enabled:
+        return
+    directory = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.abspath(settings.metrics_multiproc_dir))
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith(".db"):
+            os.remove(os.path.join(directory, name))
+
+
+def _set_threads(threads: int):
+    """设置工作进程的推理线程数"""
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+async def _notify_ready(server: uvicorn.Server, ready_fd: int):
+    """lifespan 启动完成后通知主进程（平滑重启时主进程据此替换旧进程）"""
+    try:
+        while not server.started and not server.should_exit:
+            await asyncio.sleep(0.05)
+        if server.started:
+            os.write(ready_fd, b"1")
+    except OSError:
+        pass
+    finally:
+        os.close(ready_fd)
+
+
+def _run_worker(sock: socket.socket, threads: int, ready_fd: int):
+    """工作进程：运行uvicorn服务，退出时结束进程（不返回）"""
+    code = 0
+    try:
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, signal.SIG_DFL)
+        _set_threads(threads)
+        
+        import main
+        config = uvicorn.Config(
+            main.app,
+            log_level=settings.log_level.lower(),
+            timeout_graceful_shutdown=settings.server_graceful_timeout,
+            limit_max_requests=settings.server_max_requests or None
+        )
+        server = uvicorn.Server(config)
+        
+        async def serve():
+            # 默认线程池（run_in_executor / to_thread）与推理线程数一致，多个进程之间不争抢CPU
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=threads))
+            ready_task = asyncio.create_task(_notify_ready(server, ready_fd))
+            await server.serve(sockets=[sock])
+            ready_task.cancel()
+        
+        asyncio.run(serve())
+    except Exception as e:
+        logger.error(f"工作进程异常退出: {e}")
+        code = 1
+    finally:
+        os._exit(code)
+
+
+class Arbiter:
+    """主进程：启动、监控和重启工作进程"""
+    
+    def __init__(self, sock: socket.socket, workers: int, threads: int):
+        """
+        初始化主进程
+        
+        Args:
+            sock: 监听socket
+            workers: 工作进程数
+            threads: 每个工作进程的计算线程数
+        """
+        self.sock = sock
+        self.workers = workers
+        self.threads = threads
+        
+        # 工作进程PID -> 启动时间
+        self._children: Dict[int, float] = {}
+        # 正在平滑退出的工作进程PID -> 强制结束的时间
+        self._retiring: Dict[int, float] = {}
+        self._reload = False
+        self._shutdown = False
+    
+    def run(self):
+        """运行主进程（收到 SIGTERM / SIGINT 后返回）"""
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        
+        logger.info(f"主进程 {os.getpid()} 启动 {self.workers} 个工作进程，每个进程 {self.threads} 个计算线程")
+        for _ in range(self.workers):
+            self._spawn()
+        
+        while not self._shutdown:
+            self._reap()
+            self._kill_overdue()
+            if self._reload:
+                self._reload = False
+                self._rolling_restart()
+            # 补足异常退出的工作进程
+            while not self._shutdown and len(self._children) - len(self._retiring) < self.workers:
+                self._spawn()
+            time.sleep(0.5)
+        
+        self._stop_all()
+    
+    def _on_reload(self, signum, frame):
+        """SIGHUP：平滑重启"""
+        self._reload = True
+    
+    def _on_stop(self, signum, frame):
+        """SIGTERM / SIGINT：平滑关闭"""
+        self._shutdown = True
+    
+    def _spawn(self, wait_ready: bool = False) -> int:
+        """
+        启动一个工作进程
+        
+        Args:
+            wait_ready: 是否等待工作进程启动完成（最长 server_boot_timeout 秒）
+        
+        Returns:
+            工作进程PID
+        """
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            _run_worker(self.sock, self.threads, write_fd)
+        os.close(write_fd)
+        self._children[pid] = time.monotonic()
+        logger.info(f"工作进程 {pid} 已启动")
+        try:
+            if wait_ready and not self._wait_ready(read_fd):
+                logger.warning(f"工作进程 {pid} 未在 {settings.server_boot_timeout}s 内启动完成")
+        finally:
+            os.close(read_fd)
+        return pid
+    
+    def _wait_ready(self, read_fd: int) -> bool:
+        """等待工作进程通知启动完成（进程退出或收到关闭信号时提前返回）"""
+        deadline = time.monotonic() + settings.server_boot_timeout
+        while not self._shutdown and time.monotonic() < deadline:
+            readable, _, _ = select.select([read_fd], [], [], 0.5)
+            if readable:
+                return os.read(read_fd, 1) == b"1"
+        return False
+    
+    def _rolling_restart(self):
+        """逐个替换工作进程：新进程就绪后，旧进程停止接收连接并处理完进行中的请求"""
+        old_pids = [pid for pid in self._children if pid not in self._retiring]
+        logger.info(f"开始平滑重启 {len(old_pids)} 个工作进程")
+        for pid in old_pids:
+            if self._shutdown:
+                return
+            self._spawn(wait_ready=True)
+            self._retire(pid)
+    
+    def _retire(self, pid: int):
+        """通知工作进程平滑退出，超过 server_graceful_timeout 后强制结束"""
+        self._retiring[pid] = time.monotonic() + settings.server_graceful_timeout + 5
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    
+    def _kill_overdue(self):
+        """强制结束超时未退出的工作进程"""
+        now = time.monotonic()
+        for pid, deadline in list(self._retiring.items()):
+            if now > deadline:
+                logger.warning(f"工作进程 {pid} 平滑退出超时，强制结束")
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+    
+    def _reap(self):
+        """回收已退出的工作进程"""
+        from metrics import mark_process_dead  # 在 _prepare_metrics_dir 之后导入
+        
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            started = self._children.pop(pid, None)
+            mark_process_dead(pid)
+            if started is None or self._retiring.pop(pid, None) is not None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if code == 0:
+                # 达到 server_max_requests 后正常退出
+                logger.info(f"工作进程 {pid} 已退出，重新启动")
+            else:
+                logger.warning(f"工作进程 {pid} 异常退出（退出码 {code}），重新启动")
+                # 启动后很快就退出（如配置错误）时放慢重启，避免反复 fork
+                if time.monotonic() - started < 5:
+                    time.sleep(1)
+    
+    def _stop_all(self):
+        """平滑关闭全部工作进程"""
+        logger.info("正在关闭工作进程...")
+        for pid in self._children:
+            if pid not in self._retiring:
+                self._retire(pid)
+        while self._children:
+            self._reap()
+            self._kill_overdue()
+            time.sleep(0.1)
+        logger.info("所有工作进程已退出")
+
+
+def main():
+    """解析参数，预加载后启动工作进程"""
+    parser = argparse.ArgumentParser(description="生产环境启动（预加载模型，多进程）")
+    parser.add_argument("--host", default=settings.server_host, help="监听地址")
+    parser.add_argument("--port", type=int, default=settings.server_port, help="监听端口")
+    parser.add_argument("--workers", type=int, default=settings.server_workers, help="工作进程数")
+    parser.add_argument("--threads", type=int, default=settings.server_threads_per_worker,
+                        help="每个工作进程的计算线程数，0表示按 CPU核数 / 工作进程数 计算")
+    args = parser.parse_args()
+    
+    if not hasattr(os, "fork"):
+        sys.exit("serve.py 需要支持 fork 的系统（Linux/macOS），其他系统请使用 run.py")
+    
+    workers = max(1, args.workers)
+    threads = args.threads or max(1, (os.cpu_count() or 1) // workers)
+    # 线程数环境变量需要在导入 numpy / torch 之前设置才对其线程池生效
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ.setdefault(name, str(threads))
+    # tokenizers 的并行线程在 fork 之后不可用，关闭以免工作进程卡住
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    
+    _prepare_metrics_dir()
+    
+    sock = _bind_socket(args.host, args.port)
+    logger.info(f"监听 {args.host}:{args.port}，预加载应用和嵌入模型...")
+    _preload()
+    _prepare_knowledge_base()
+    Arbiter(sock, workers, threads).run()
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
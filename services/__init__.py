@@ -4,6 +4,7 @@
 本模块提供与Java服务的交互功能，包括：
 - JavaServiceClient: Java服务HTTP客户端（调用Spring Cloud接口）
 - DataSyncService: 数据同步服务（从Java端同步课程数据到RAG知识库）
+- summarize_learning_profile: 学习画像摘要（把原始课表压缩为紧凑特征）
 
 使用示例：
     from services import JavaServiceClient, DataSyncService
@@ -24,10 +25,12 @@
 
 from services.java_client import JavaServiceClient
 from services.data_sync import DataSyncService
+from services.profile_summary import summarize_learning_profile
 
 __version__ = "1.0.0"
 __all__ = [
     "JavaServiceClient",
     "DataSyncService",
+    "summarize_learning_profile",
 ]
 
@@ -0,0 +1,373 @@
+"""
+批量推荐：为营销活动（邮件、推送）一次性给大量用户生成个性化课程推荐
+
+逐个用户调用 /chat 需要为每个用户跑一遍Agent循环，几万个用户会把LLM配额占满。批量推荐不走Agent：
+- 并发获取用户课表（并发数受 candidate_fetch_concurrency 限制）
+- 有学习记录的用户：复用离线候选推荐的打分，整批用户与课程矩阵做一次矩阵乘法
+- 没有学习记录的用户：按课表中课程的分类（没有课表时用默认查询）生成检索词，相同的检索词只检索一次，
+  整批检索词一次编码、一次向量检索
+- 需要推荐理由（with_reason）时才调用LLM，以 batch 优先级排队，不影响在线对话
+
+结果逐个用户以NDJSON输出，同时追加写入检查点文件（每批写入一次）。任务中断后用相同的 job_id
+再次提交，已完成的用户直接跳过；完整结果可以通过 GET /recommend/batch/{job_id} 下载。
+任务运行期间对检查点文件加文件锁（fcntl.flock），多个工作进程或副本共用检查点目录时同一任务也只能运行一次；
+进程退出（包括崩溃）时操作系统自动释放锁。
+
+使用示例：
+    from services.batch_recommend import BatchRecommender
+    
+    recommender = BatchRecommender(candidate_builder, llm=agent.llm, governor=agent.governor)
+    checkpoint = recommender.start("spring-campaign")    # 任务已在运行时抛出 BatchJobRunningError
+    async for line in recommender.run(range(1, 50001), top_k=5, checkpoint=checkpoint):
+        print(line)
+"""
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from collections import Counter
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set
+from langchain_core.messages import HumanMessage
+from loguru import logger
+from config import settings
+from agent.llm_governor import llm_priority
+from services.candidates import CandidateBuilder
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+_JOB_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class BatchJobRunningError(RuntimeError):
+    """任务已在运行（本进程或共用检查点目录的其他进程）"""
+
+
+class BatchCheckpoint:
+    """批量推荐任务的检查点（NDJSON文件，每行一个已完成用户的结果）"""
+    
+    def __init__(self, job_id: str, directory: Optional[str] = None):
+        """
+        初始化检查点
+        
+        Args:
+            job_id: 任务ID（字母、数字、下划线和连字符）
+            directory: 检查点目录，默认使用配置
+        """
+        if not _JOB_ID_PATTERN.match(job_id):
+            raise ValueError(f"无效的任务ID: {job_id}")
+        self.job_id = job_id
+        self.path = os.path.join(directory or settings.batch_recommend_checkpoint_dir, f"{job_id}.ndjson")
+        self._lock_file = None
+    
+    def try_lock(self) -> bool:
+        """
+        尝试锁定检查点文件（不阻塞，文件不存在时创建）
+        
+        锁跟随打开的文件：unlock() 或检查点对象被回收时关闭文件即释放，进程退出时由操作系统释放。
+        不支持 fcntl 的系统上总是成功（只能保证单进程部署时同一任务不重复运行）。
+        
+        Returns:
+            是否拿到锁
+        """
+        if self._lock_file is not None:
+            return True
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        lock_file = open(self.path, "a", encoding="utf-8")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        self._lock_file = lock_file
+        return True
+    
+    def unlock(self):
+        """释放检查点文件的锁"""
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+    
+    def exists(self) -> bool:
+        """检查点文件是否存在"""
+        return os.path.exists(self.path)
+    
+    def completed_user_ids(self) -> Set[int]:
+        """
+        读取已完成的用户ID（进程中断时最后一行可能不完整，忽略无法解析的行）
+        
+        Returns:
+            用户ID集合
+        """
+        completed = set()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        completed.add(int(json.loads(line)["user_id"]))
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+        return completed
+    
+    def append(self, rows: List[Dict]):
+        """
+        追加写入一批结果
+        
+        Args:
+            rows: 用户结果列表
+        """
+        if not rows:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class BatchRecommender:
+    """批量推荐任务"""
+    
+    def __init__(self, candidate_builder: CandidateBuilder, llm=None, governor=None):
+        """
+        初始化任务
+        
+        Args:
+            candidate_builder: 离线候选推荐任务（复用其课程矩阵、打分和课表获取）
+            llm: 生成推荐理由的LLM（可选），未提供时不生成推荐理由
+            governor: LLM调用调度器（可选），提供时推荐理由以 batch 优先级排队
+        """
+        self.builder = candidate_builder
+        self.vector_store = candidate_builder.vector_store
+        self.llm = llm
+        self.governor = governor
+        
+        self.stats = {"jobs": 0, "users": 0, "profile": 0, "query": 0, "failed": 0, "reasons": 0}
+    
+    def start(self, job_id: Optional[str] = None) -> BatchCheckpoint:
+        """
+        锁定任务的检查点（同一个任务同时只能运行一次，避免重复写入检查点）
+        
+        接口在返回流式响应之前调用，任务已在运行时可以直接返回409，而不是在响应开始后才失败。
+        
+        Args:
+            job_id: 任务ID，为空时生成新的任务ID
+        
+        Returns:
+            已锁定的检查点，交给 run()，任务结束时释放
+        
+        Raises:
+            ValueError: 任务ID无效
+            BatchJobRunningError: 任务正在运行
+        """
+        checkpoint = BatchCheckpoint(job_id or uuid.uuid4().hex[:16])
+        if not checkpoint.try_lock():
+            raise BatchJobRunningError(f"任务 {checkpoint.job_id} 正在运行")
+        return checkpoint
+    
+    async def run(
+        self,
+        user_ids: Iterable[int],
+        top_k: int = 5,
+        with_reason: bool = False,
+        job_id: Optional[str] = None,
+        checkpoint: Optional[BatchCheckpoint] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        运行批量推荐，逐个输出结果
+        
+        第一行为任务信息 {"job_id", "users", "resumed"}，之后每个用户一行
+        {"user_id", "source", "courses", "reason"?}，获取课表失败的用户输出 {"user_id", "error"}
+        （不写入检查点，续跑时重试），最后一行为 {"job_id", "done": true, 统计}。
+        
+        Args:
+            user_ids: 用户ID列表
+            top_k: 每个用户推荐的课程数（不超过 candidate_top_n）
+            with_reason: 是否调用LLM生成一句推荐理由
+            job_id: 任务ID，用于断点续跑；为空时生成新的任务ID
+            checkpoint: start() 返回的已锁定检查点（可选），提供时忽略 job_id
+        
+        Yields:
+            结果字典
+        
+        Raises:
+            BatchJobRunningError: 未提供检查点且任务正在运行
+        """
+        checkpoint = checkpoint or self.start(job_id)
+        job_id = checkpoint.job_id
+        try:
+            user_ids = list(dict.fromkeys(user_ids))
+            completed = checkpoint.completed_user_ids()
+            pending = [user_id for user_id in user_ids if user_id not in completed]
+            top_k = max(1, min(top_k, self.builder.top_n))
+            with_reason = with_reason and self.llm is not None
+            result = {
+                "users": len(user_ids),
+                "resumed": len(user_ids) - len(pending),
+                "profile": 0,
+                "query": 0,
+                "failed": 0,
+                "reasons": 0,
+            }
+            self.stats["jobs"] += 1
+            logger.info(f"批量推荐任务 {job_id} 开始: 用户 {len(user_ids)}，已完成 {result['resumed']}")
+            yield {"job_id": job_id, "users": len(user_ids), "resumed": result["resumed"]}
+            
+            started = time.time()
+            batch_size = settings.candidate_batch_size
+            for i in range(0, len(pending), batch_size):
+                rows, failed = await self._recommend_batch(pending[i:i + batch_size], top_k, with_reason)
+                checkpoint.append(rows)
+                for row in rows:
+                    result[row["source"]] += 1
+                    result["reasons"] += 1 if row.get("reason") else 0
+                result["failed"] += len(failed)
+                for row in rows + failed:
+                    yield row
+            
+            for key in ("profile", "query", "failed", "reasons"):
+                self.stats[key] += result[key]
+            self.stats["users"] += len(pending)
+            logger.info(
+                f"批量推荐任务 {job_id} 完成: 用户 {len(user_ids)}，按学习记录 {result['profile']}，"
+                f"按检索 {result['query']}，失败 {result['failed']}，耗时 {time.time() - started:.2f}s"
+            )
+            yield {"job_id": job_id, "done": True, **result}
+        finally:
+            checkpoint.unlock()
+    
+    async def _recommend_batch(self, user_ids: List[int], top_k: int, with_reason: bool):
+        """
+        为一批用户生成推荐
+        
+        Returns:
+            (成功的用户结果列表, 失败的用户结果列表)
+        """
+        lessons_list = await self.builder.fetch_lessons(user_ids)
+        failed = [
+            {"user_id": user_id, "error": "获取用户课表失败"}
+            for user_id, lessons in zip(user_ids, lessons_list)
+            if lessons is None
+        ]
+        lessons_by_user = {user_id: lessons for user_id, lessons in zip(user_ids, lessons_list) if lessons is not None}
+        
+        # 有学习记录的用户：整批一次矩阵乘法打分（已排除课表中的课程）
+        loop = asyncio.get_running_loop()
+        scored = await loop.run_in_executor(None, self.builder.score, lessons_by_user)
+        picks: Dict[int, Dict] = {
+            user_id: {"source": "profile", "course_ids": course_ids[:top_k].tolist(), "scores": scores[:top_k].tolist()}
+            for user_id, (course_ids, scores) in scored.items()
+        }
+        
+        # 没有学习记录的用户：按分类生成检索词，相同的检索词只检索一次
+        cold = {user_id: lessons for user_id, lessons in lessons_by_user.items() if user_id not in scored}
+        if cold:
+            picks.update(await loop.run_in_executor(None, self._recommend_by_query, cold, top_k))
+        
+        metadata_map = self.vector_store.get_course_metadata(
+            list({course_id for pick in picks.values() for course_id in pick["course_ids"]})
+        )
+        rows = []
+        for user_id in lessons_by_user:
+            pick = picks.get(user_id, {"source": "query", "course_ids": [], "scores": []})
+            row = {
+                "user_id": user_id,
+                "source": pick["source"],
+                "courses": [
+                    {
+                        "id": course_id,
+                        "name": metadata_map[course_id].get("course_name", ""),
+                        "category": metadata_map[course_id].get("category", ""),
+                        "score": round(float(score), 3),
+                    }
+                    for course_id, score in zip(pick["course_ids"], pick["scores"])
+                    if course_id in metadata_map
+                ],
+            }
+            if pick.get("query"):
+                row["query"] = pick["query"]
+            rows.append(row)
+        
+        if with_reason:
+            await self._add_reasons(rows, lessons_by_user)
+        return rows, failed
+    
+    def _recommend_by_query(self, lessons_by_user: Dict[int, List[Dict]], top_k: int) -> Dict[int, Dict]:
+        """
+        为没有学习记录的用户检索课程：检索词为课表中最常见的课程分类，没有课表时使用默认查询
+        
+        Args:
+            lessons_by_user: 用户ID到课表的映射
+            top_k: 每个用户推荐的课程数
+        
+        Returns:
+            用户ID到 {"source", "query", "course_ids", "scores"} 的映射
+        """
+        metadata_map = self.vector_store.get_course_metadata(
+            list({l["courseId"] for lessons in lessons_by_user.values() for l in lessons if l.get("courseId") is not None})
+        )
+        queries: Dict[int, str] = {}
+        owned: Dict[int, Set[int]] = {}
+        for user_id, lessons in lessons_by_user.items():
+            owned[user_id] = {l["courseId"] for l in lessons if l.get("courseId") is not None}
+            categories = Counter(
+                metadata_map[course_id]["category"] for course_id in owned[user_id]
+                if metadata_map.get(course_id, {}).get("category")
+            )
+            queries[user_id] = categories.most_common(1)[0][0] if categories else settings.batch_recommend_default_query
+        
+        unique_queries = list(dict.fromkeys(queries.values()))
+        max_owned = max((len(course_ids) for course_ids in owned.values()), default=0)
+        results = self.vector_store.search_many(unique_queries, top_k + max_owned)
+        results_by_query = dict(zip(unique_queries, results))
+        
+        picks = {}
+        for user_id, query in queries.items():
+            course_ids, scores = [], []
+            for item in results_by_query[query]:
+                course_id = item["metadata"].get("course_id")
+                if course_id is None or int(course_id) in owned[user_id]:
+                    continue
+                course_ids.append(int(course_id))
+                scores.append(1.0 - item["distance"])
+                if len(course_ids) >= top_k:
+                    break
+            picks[user_id] = {"source": "query", "query": query, "course_ids": course_ids, "scores": scores}
+        logger.info(f"批量推荐: {len(lessons_by_user)} 个无学习记录的用户共用 {len(unique_queries)} 个检索词")
+        return picks
+    
+    async def _add_reasons(self, rows: List[Dict], lessons_by_user: Dict[int, List[Dict]]):
+        """调用LLM为每个用户生成一句推荐理由（batch 优先级，失败时不输出理由）"""
+        semaphore = asyncio.Semaphore(settings.batch_recommend_llm_concurrency)
+        max_chars = settings.batch_recommend_reason_chars
+        
+        async def write_reason(row: Dict):
+            if not row["courses"]:
+                return
+            learned = [l.get("courseName") for l in lessons_by_user.get(row["user_id"], []) if l.get("courseName")]
+            prompt = (
+                f"用户已购买的课程：{'、'.join(learned[:10]) or '无'}\n"
+                f"为用户推荐的课程：{'、'.join(course['name'] for course in row['courses'])}\n"
+                f"请用一句话（不超过{max_chars}字）写出面向该用户的推荐理由，用于营销推送，只输出这句话。"
+            )
+            llm_messages = [HumanMessage(content=prompt)]
+            try:
+                async with semaphore:
+                    with llm_priority("batch"):
+                        if self.governor:
+                            response = await self.governor.call(lambda: self.llm.ainvoke(llm_messages), llm_messages)
+                        else:
+                            response = await self.llm.ainvoke(llm_messages)
+                row["reason"] = str(response.content).strip()[:max_chars * 2]
+            except Exception as e:
+                logger.warning(f"生成用户 {row['user_id']} 的推荐理由失败: {e}")
+        
+        await asyncio.gather(*(write_reason(row) for row in rows))
@@ -0,0 +1,424 @@
+"""
+离线候选推荐：为活跃用户预先计算候选课程
+
+用户课表和课程知识库变化都很慢，但每次推荐都要实时跑一遍LLM和RAG。离线任务为每个用户
+用已学完和学习中课程的向量求平均得到画像向量，与整个课程矩阵做一次矩阵乘法打分，排除课表中
+已有的课程后，把前N门候选课程和分数紧凑地保存在本地（SQLite，课程ID为int64、分数为float16）。
+Agent通过 get_recommended_candidates 工具或快速路径按用户ID直接读取。
+
+刷新是增量的：按用户课表指纹（课程ID和学习状态）和知识库代次判断，未变化的用户跳过；
+课表变化时可以调用 POST /users/lessons/events 只刷新相关用户。
+
+使用示例：
+    # 定时任务：刷新指定用户（1~500号）
+    python -m services.candidates refresh --users 1-500
+    
+    # 刷新已有候选的全部用户（知识库更新后）
+    python -m services.candidates refresh --known
+    
+    # 查看某个用户的候选
+    python -m services.candidates show 42
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from loguru import logger
+from config import settings
+from rag.vector_store import VectorStore
+from services.course_store import content_hash
+from services.java_client import JavaServiceClient
+
+
+# 参与画像向量计算的课表状态：1-学习中，2-已学完
+_PROFILE_STATUSES = {1, 2}
+
+
+def lesson_fingerprint(lessons: List[Dict]) -> str:
+    """计算课表指纹（课程ID和学习状态），课表变化时指纹随之变化"""
+    return content_hash(sorted((l.get("courseId"), l.get("status")) for l in lessons if l.get("courseId") is not None))
+
+
+class CandidateStore:
+    """候选课程存储（SQLite）"""
+    
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        初始化存储
+        
+        Args:
+            db_path: SQLite文件路径，默认使用配置中的路径
+        """
+        self.db_path = db_path or settings.candidate_db_path
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS user_candidates (
+                user_id INTEGER PRIMARY KEY,
+                course_ids BLOB,
+                scores BLOB,
+                lesson_fingerprint TEXT,
+                generation TEXT,
+                updated_at REAL
+            )
+            """
+        )
+        self._conn.commit()
+    
+    def get(self, user_id: int) -> Optional[Dict]:
+        """
+        读取用户的候选课程
+        
+        Args:
+            user_id: 用户ID
+        
+        Returns:
+            {"course_ids", "scores", "lesson_fingerprint", "generation", "updated_at"}，
+            候选按分数从高到低排列；没有候选时返回None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT course_ids, scores, lesson_fingerprint, generation, updated_at "
+                "FROM user_candidates WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return {
+            "course_ids": np.frombuffer(row[0], dtype=np.int64).tolist(),
+            "scores": np.frombuffer(row[1], dtype=np.float16).astype(float).tolist(),
+            "lesson_fingerprint": row[2],
+            "generation": row[3],
+            "updated_at": row[4],
+        }
+    
+    def has(self, user_id: int) -> bool:
+        """用户是否有预计算的候选课程"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM user_candidates WHERE user_id = ?", (user_id,)
+            ).fetchone() is not None
+    
+    def fingerprints(self, user_ids: List[int]) -> Dict[int, Tuple[str, str]]:
+        """
+        批量读取用户的课表指纹和知识库代次（用于判断是否需要刷新）
+        
+        Args:
+            user_ids: 用户ID列表
+        
+        Returns:
+            用户ID到 (课表指纹, 知识库代次) 的映射
+        """
+        result = {}
+        with self._lock:
+            for i in range(0, len(user_ids), 500):
+                batch = user_ids[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT user_id, lesson_fingerprint, generation FROM user_candidates "
+                    f"WHERE user_id IN ({placeholders})",
+                    batch
+                ).fetchall()
+                result.update({row[0]: (row[1], row[2]) for row in rows})
+        return result
+    
+    def save_many(self, entries: List[Tuple[int, np.ndarray, np.ndarray, str, str]]):
+        """
+        批量保存候选课程（覆盖原有内容）
+        
+        Args:
+            entries: (用户ID, 课程ID数组, 分数数组, 课表指纹, 知识库代次) 列表
+        """
+        now = time.time()
+        rows = [
+            (
+                user_id,
+                np.asarray(course_ids, dtype=np.int64).tobytes(),
+                np.asarray(scores, dtype=np.float16).tobytes(),
+                fingerprint,
+                generation,
+                now,
+            )
+            for user_id, course_ids, scores, fingerprint, generation in entries
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO user_candidates "
+                "(user_id, course_ids, scores, lesson_fingerprint, generation, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+    
+    def delete(self, user_ids: List[int]):
+        """
+        删除用户的候选课程
+        
+        Args:
+            user_ids: 用户ID列表
+        """
+        with self._lock:
+            self._conn.executemany("DELETE FROM user_candidates WHERE user_id = ?", [(u,) for u in user_ids])
+            self._conn.commit()
+    
+    def user_ids(self) -> List[int]:
+        """获取所有有候选课程的用户ID"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT user_id FROM user_candidates ORDER BY user_id")]
+    
+    def count(self) -> int:
+        """获取有候选课程的用户数量"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM user_candidates").fetchone()[0]
+    
+    def close(self):
+        """关闭存储"""
+        with self._lock:
+            self._conn.close()
+
+
+class CandidateBuilder:
+    """候选课程计算任务"""
+    
+    def __init__(
+        self,
+        vector_store: Optional[VectorStore] = None,
+        store: Optional[CandidateStore] = None,
+        java_client: Optional[JavaServiceClient] = None,
+        top_n: Optional[int] = None
+    ):
+        """
+        初始化任务
+        
+        Args:
+            vector_store: 课程向量数据库
+            store: 候选课程存储
+            java_client: 获取用户课表的Java服务客户端
+            top_n: 每个用户保存的候选课程数，默认使用配置
+        """
+        self.vector_store = vector_store or VectorStore()
+        self.store = store or CandidateStore()
+        self.java_client = java_client or JavaServiceClient()
+        self.top_n = top_n or settings.candidate_top_n
+        
+        # 课程矩阵（按知识库代次缓存）
+        self._matrix_generation: Optional[str] = None
+        self._course_ids: Optional[np.ndarray] = None
+        self._matrix: Optional[np.ndarray] = None
+        self._row_index: Dict[int, int] = {}
+        self.stats = {"runs": 0, "refreshed": 0, "skipped": 0, "empty": 0, "failed": 0}
+    
+    def load_course_matrix(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        加载课程向量矩阵（行已归一化），知识库代次不变时复用已加载的矩阵
+        
+        Returns:
+            (课程ID数组, 向量矩阵)
+        """
+        generation = self.vector_store.generation
+        if self._matrix is not None and generation == self._matrix_generation:
+            return self._course_ids, self._matrix
+        
+        course_ids, rows = [], []
+        for _, _, metadatas, embeddings in self.vector_store.iter_all(include_embeddings=True):
+            for metadata, embedding in zip(metadatas, embeddings):
+                if metadata and metadata.get("course_id"):
+                    course_ids.append(int(metadata["course_id"]))
+                    rows.append(embedding)
+        dimension = self.vector_store.embedding_model.dimension if not rows else len(rows[0])
+        matrix = np.asarray(rows, dtype=np.float32).reshape(len(rows), dimension)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms > 0, norms, 1.0)
+        
+        self._course_ids = np.asarray(course_ids, dtype=np.int64)
+        self._matrix = matrix
+        self._row_index = {course_id: row for row, course_id in enumerate(course_ids)}
+        self._matrix_generation = generation
+        logger.info(f"已加载课程向量矩阵: {matrix.shape[0]} 门课程，维度 {matrix.shape[1]}")
+        return self._course_ids, self._matrix
+    
+    def score(self, lessons_by_user: Dict[int, List[Dict]]) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        """
+        为一批用户计算候选课程（一次矩阵乘法完成整批打分）
+        
+        Args:
+            lessons_by_user: 用户ID到课表的映射
+        
+        Returns:
+            用户ID到 (课程ID数组, 分数数组) 的映射；没有学习中或已学完课程的用户不在结果中
+        """
+        course_ids, matrix = self.load_course_matrix()
+        if not len(course_ids):
+            return {}
+        
+        users, profiles, owned_rows = [], [], []
+        for user_id, lessons in lessons_by_user.items():
+            rows = [
+                self._row_index[l["courseId"]] for l in lessons
+                if l.get("status") in _PROFILE_STATUSES and l.get("courseId") in self._row_index
+            ]
+            if not rows:
+                continue
+            users.append(user_id)
+            profiles.append(matrix[rows].mean(axis=0))
+            owned_rows.append([self._row_index[l["courseId"]] for l in lessons if l.get("courseId") in self._row_index])
+        if not users:
+            return {}
+        
+        profile_matrix = np.asarray(profiles, dtype=np.float32)
+        norms = np.linalg.norm(profile_matrix, axis=1, keepdims=True)
+        profile_matrix /= np.where(norms > 0, norms, 1.0)
+        scores = profile_matrix @ matrix.T  # (用户数, 课程数) 余弦相似度
+        
+        # 排除课表中已有的课程（包括未学习和已失效的课程）
+        for index, rows in enumerate(owned_rows):
+            scores[index, rows] = -np.inf
+        
+        top_n = min(self.top_n, scores.shape[1])
+        top = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+        results = {}
+        for index, user_id in enumerate(users):
+            order = top[index][np.argsort(-scores[index, top[index]])]
+            order = order[np.isfinite(scores[index, order])]
+            results[user_id] = (course_ids[order], scores[index, order])
+        return results
+    
+    async def fetch_lessons(self, user_ids: List[int]) -> List[Optional[List[Dict]]]:
+        """
+        并发获取一批用户的课表（并发数受 candidate_fetch_concurrency 限制）
+        
+        Args:
+            user_ids: 用户ID列表
+        
+        Returns:
+            与 user_ids 顺序一致的课表列表，获取失败的用户为 None
+        """
+        semaphore = asyncio.Semaphore(settings.candidate_fetch_concurrency)
+        
+        async def fetch(user_id: int) -> Optional[List[Dict]]:
+            try:
+                async with semaphore:
+                    profile = await self.java_client.get_user_learning_profile(user_id)
+                return profile.get("lessons") or []
+            except Exception as e:
+                logger.error(f"获取用户 {user_id} 的课表失败: {e}")
+                return None
+        
+        return await asyncio.gather(*(fetch(user_id) for user_id in user_ids))
+    
+    async def refresh(self, user_ids: Iterable[int], force: bool = False) -> Dict[str, int]:
+        """
+        刷新用户的候选课程：课表指纹和知识库代次都未变化的用户跳过
+        
+        Args:
+            user_ids: 用户ID列表
+            force: 是否忽略指纹，强制重新计算
+        
+        Returns:
+            统计 {"users", "refreshed", "skipped", "empty", "failed"}
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        result = {"users": len(user_ids), "refreshed": 0, "skipped": 0, "empty": 0, "failed": 0}
+        if not user_ids:
+            return result
+        
+        # 课程矩阵加载是同步的CPU/磁盘操作，放到线程池中执行
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.load_course_matrix)
+        generation = self._matrix_generation
+        known = {} if force else self.store.fingerprints(user_ids)
+        
+        batch_size = settings.candidate_batch_size
+        for i in range(0, len(user_ids), batch_size):
+            batch = user_ids[i:i + batch_size]
+            lessons_list = await self.fetch_lessons(batch)
+            
+            changed: Dict[int, List[Dict]] = {}
+            fingerprints: Dict[int, str] = {}
+            for user_id, lessons in zip(batch, lessons_list):
+                if lessons is None:
+                    result["failed"] += 1
+                    continue
+                fingerprints[user_id] = lesson_fingerprint(lessons)
+                if known.get(user_id) == (fingerprints[user_id], generation):
+                    result["skipped"] += 1
+                else:
+                    changed[user_id] = lessons
+            if not changed:
+                continue
+            
+            scored = await loop.run_in_executor(None, self.score, changed)
+            self.store.save_many([
+                (user_id, course_ids, scores, fingerprints[user_id], generation)
+                for user_id, (course_ids, scores) in scored.items()
+            ])
+            # 没有学习记录的用户不保存候选，删除旧数据，由Agent实时推荐
+            empty = [user_id for user_id in changed if user_id not in scored]
+            if empty:
+                self.store.delete(empty)
+            result["refreshed"] += len(scored)
+            result["empty"] += len(empty)
+        
+        self.stats["runs"] += 1
+        for key in ("refreshed", "skipped", "empty", "failed"):
+            self.stats[key] += result[key]
+        logger.info(
+            f"候选课程刷新完成: 用户 {result['users']}，重新计算 {result['refreshed']}，"
+            f"未变化 {result['skipped']}，无学习记录 {result['empty']}，失败 {result['failed']}"
+        )
+        return result
+    
+    async def close(self):
+        """关闭任务"""
+        await self.java_client.close()
+        self.store.close()
+
+
+def _parse_user_ids(spec: str) -> List[int]:
+    """解析用户ID列表，例如 "1-100,205,300-310" """
+    user_ids = []
+    for part in spec.split(","):
+        part = part.strip()
+        if "-" in part:
+            start, end = part.split("-", 1)
+            user_ids.extend(range(int(start), int(end) + 1))
+        elif part:
+            user_ids.append(int(part))
+    return user_ids
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    
+    parser = argparse.ArgumentParser(description="离线候选推荐")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    refresh_parser = subparsers.add_parser("refresh", help="刷新用户的候选课程")
+    refresh_parser.add_argument("--users", help="用户ID列表，例如 1-500,888")
+    refresh_parser.add_argument("--known", action="store_true", help="刷新已有候选的全部用户")
+    refresh_parser.add_argument("--force", action="store_true", help="忽略课表指纹，全部重新计算")
+    show_parser = subparsers.add_parser("show", help="查看用户的候选课程")
+    show_parser.add_argument("user_id", type=int)
+    args = parser.parse_args()
+    
+    if args.command == "show":
+        candidate_store = CandidateStore()
+        print(json.dumps(candidate_store.get(args.user_id), ensure_ascii=False, indent=2))
+    else:
+        async def main():
+            builder = CandidateBuilder()
+            try:
+                user_ids = _parse_user_ids(args.users) if args.users else []
+                if args.known:
+                    user_ids += builder.store.user_ids()
+                print(json.dumps(await builder.refresh(user_ids, force=args.force), ensure_ascii=False))
+            finally:
+                await builder.close()
+        
+        asyncio.run(main())
@@ -0,0 +1,232 @@
+"""
+课程本地存储：持久化Java端返回的课程列表和详情原始数据
+
+每次同步都会为每门课程调用 /course/{id}?withCatalogue=true，重启后之前的结果全部丢失。
+本地存储（SQLite）记录每门课程的列表项、详情、内容哈希、更新时间以及ETag/Last-Modified，
+同步时据此跳过未变化课程的详情请求，Agent也可以直接从本地读取课程详情。
+
+使用示例：
+    from services.course_store import CourseStore
+    
+    store = CourseStore()
+    store.save(course, detail, etag='"abc"')
+    
+    # 列表项的更新时间没变，直接使用本地详情
+    if store.is_unchanged(course):
+        detail = store.get(course["id"])["detail"]
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+from config import settings
+
+
+def content_hash(payload) -> str:
+    """计算JSON数据的内容哈希（键排序后序列化，保证相同内容得到相同哈希）"""
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class CourseStore:
+    """课程本地存储（SQLite）"""
+    
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        初始化存储
+        
+        Args:
+            db_path: SQLite文件路径，默认使用配置中的路径
+        """
+        self.db_path = db_path or settings.course_store_path
+        directory = os.path.dirname(os.path.abspath(self.db_path))
+        os.makedirs(directory, exist_ok=True)
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS courses (
+                course_id INTEGER PRIMARY KEY,
+                list_payload TEXT,
+                list_hash TEXT,
+                list_update_time TEXT,
+                detail_payload TEXT,
+                detail_hash TEXT,
+                document_hash TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL,
+                updated_at REAL
+            )
+            """
+        )
+        self._conn.commit()
+    
+    def get(self, course_id: int) -> Optional[Dict]:
+        """
+        获取单门课程的存储记录
+        
+        Args:
+            course_id: 课程ID
+        
+        Returns:
+            存储记录（course、detail为解析后的JSON），不存在时返回None
+        """
+        return self.get_many([course_id]).get(course_id)
+    
+    def get_many(self, course_ids: List[int]) -> Dict[int, Dict]:
+        """
+        批量获取课程存储记录
+        
+        Args:
+            course_ids: 课程ID列表
+        
+        Returns:
+            课程ID到存储记录的映射，不存在的课程不会出现在结果中
+        """
+        if not course_ids:
+            return {}
+        placeholders = ",".join("?" for _ in course_ids)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM courses WHERE course_id IN ({placeholders})",
+                [int(course_id) for course_id in course_ids]
+            ).fetchall()
+        return {row["course_id"]: self._row_to_record(row) for row in rows}
+    
+    def is_unchanged(self, course: Dict, record: Optional[Dict] = None) -> bool:
+        """
+        判断课程列表项相对本地记录是否没有变化（可直接使用本地详情）
+        
+        优先比较列表项的更新时间；列表项没有更新时间字段时比较内容哈希。
+        
+        Args:
+            course: /courses/page 返回的课程列表项
+            record: 本地存储记录（可选，未传入时自动查询）
+        
+        Returns:
+            是否未变化
+        """
+        record = record if record is not None else self.get(course.get("id"))
+        if not record or record.get("detail") is None:
+            return False
+        update_time = course.get("updateTime")
+        if update_time:
+            return str(update_time) == record.get("list_update_time")
+        return content_hash(course) == record.get("list_hash")
+    
+    def save(
+        self,
+        course: Dict,
+        detail: Dict,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        document_hash: Optional[str] = None
+    ):
+        """
+        保存课程列表项和详情
+        
+        Args:
+            course: 课程列表项
+            detail: 课程详情
+            etag: 详情响应的ETag（可选）
+            last_modified: 详情响应的Last-Modified（可选）
+            document_hash: 已写入知识库的文档哈希（可选，未传入时保留原值）
+        """
+        now = time.time()
+        detail_hash = content_hash(detail)
+        with self._lock:
+            previous = self._conn.execute(
+                "SELECT detail_hash, document_hash, updated_at FROM courses WHERE course_id = ?",
+                (int(course["id"]),)
+            ).fetchone()
+            updated_at = previous["updated_at"] if previous and previous["detail_hash"] == detail_hash else now
+            if document_hash is None and previous:
+                document_hash = previous["document_hash"]
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO courses (
+                    course_id, list_payload, list_hash, list_update_time,
+                    detail_payload, detail_hash, document_hash, etag, last_modified,
+                    fetched_at, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    int(course["id"]),
+                    json.dumps(course, ensure_ascii=False),
+                    content_hash(course),
+                    str(course["updateTime"]) if course.get("updateTime") else None,
+                    json.dumps(detail, ensure_ascii=False),
+                    detail_hash,
+                    document_hash,
+                    etag,
+                    last_modified,
+                    now,
+                    updated_at,
+                )
+            )
+            self._conn.commit()
+    
+    def set_document_hashes(self, document_hashes: Dict[int, str]):
+        """
+        记录已写入知识库的文档哈希（向量写入成功后调用）
+        
+        Args:
+            document_hashes: 课程ID到文档哈希的映射
+        """
+        if not document_hashes:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE courses SET document_hash = ? WHERE course_id = ?",
+                [(doc_hash, int(course_id)) for course_id, doc_hash in document_hashes.items()]
+            )
+            self._conn.commit()
+    
+    def delete(self, course_ids: List[int]):
+        """
+        删除课程记录
+        
+        Args:
+            course_ids: 课程ID列表
+        """
+        if not course_ids:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM courses WHERE course_id = ?",
+                [(int(course_id),) for course_id in course_ids]
+            )
+            self._conn.commit()
+    
+    def count(self) -> int:
+        """获取存储的课程数量"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM courses").fetchone()[0]
+    
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+    
+    def _row_to_record(self, row: sqlite3.Row) -> Dict:
+        """把数据库行转换为存储记录"""
+        return {
+            "course_id": row["course_id"],
+            "course": json.loads(row["list_payload"]) if row["list_payload"] else None,
+            "detail": json.loads(row["detail_payload"]) if row["detail_payload"] else None,
+            "list_hash": row["list_hash"],
+            "list_update_time": row["list_update_time"],
+            "detail_hash": row["detail_hash"],
+            "document_hash": row["document_hash"],
+            "etag": row["etag"],
+            "last_modified": row["last_modified"],
+            "fetched_at": row["fetched_at"],
+            "updated_at": row["updated_at"],
+        }
@@ -1,19 +1,49 @@
 """
 数据同步服务：从Java端同步课程数据到RAG知识库
 """
-from typing import List, Dict
+import asyncio
+import time
+import httpx
+from typing import List, Dict, Optional
 from loguru import logger
+from config import settings
+from metrics import SYNC_COURSES, SYNC_SECONDS
 from services.java_client import JavaServiceClient
+from services.course_store import CourseStore, content_hash
 from rag.vector_store import VectorStore
+from rag.knn_graph import CourseKnnGraph
+from rag.category_index import CategoryIndex
+
+
+# 课程状态：2=已上架，其他状态（待上架、下架等）不应出现在知识库中
+COURSE_STATUS_ON_SHELF = 2
 
 
 class DataSyncService:
     """数据同步服务"""
     
-    def __init__(self):
-        """初始化服务"""
+    def __init__(
+        self,
+        vector_store: Optional[VectorStore] = None,
+        course_store: Optional[CourseStore] = None,
+        knn_graph: Optional[CourseKnnGraph] = None,
+        category_index: Optional[CategoryIndex] = None
+    ):
+        """
+        初始化服务
+        
+        Args:
+            vector_store: 复用已有的向量数据库实例（可选），避免重复加载嵌入模型
+            course_store: 课程本地存储（可选），未传入时由服务创建并在 close() 时关闭
+            knn_graph: 课程相似度图（可选），未启用时不维护
+            category_index: 课程分类索引（可选），未启用时不维护
+        """
         self.java_client = JavaServiceClient()
-        self.vector_store = VectorStore()
+        self.vector_store = vector_store or VectorStore()
+        self.course_store = course_store or CourseStore()
+        self._owns_course_store = course_store is None
+        self.knn_graph = knn_graph or (CourseKnnGraph() if settings.knn_graph_enabled else None)
+        self.category_index = category_index or (CategoryIndex() if settings.category_index_enabled else None)
     
     async def sync_all_courses(self) -> int:
         """
@@ -23,6 +53,7 @@ class DataSyncService:
             同步的课程数量
         """
         logger.info("开始从Java端同步课程数据...")
+        started = time.perf_counter()
         
         try:
             # 1. 获取所有课程
@@ -33,46 +64,63 @@ class DataSyncService:
                 logger.warning("未获取到任何课程数据")
                 return 0
             
-            # 2. 获取每门课程的详细信息
-            documents = []
-            for course in courses:
+            # 2. 获取每门课程的详细信息（本地存储中未变化的课程跳过详情请求）
+            courses = [course for course in courses if course.get("id")]
+            records = self.course_store.get_many([course["id"] for course in courses])
+            semaphore = asyncio.Semaphore(settings.sync_detail_concurrency)
+            stats = {"cached": 0, "not_modified": 0, "fetched": 0}
+            
+            async def load_entry(course: Dict) -> Optional[Dict]:
+                course_id = course["id"]
+                record = records.get(course_id)
                 try:
-                    course_id = course.get("id")
-                    if not course_id:
-                        continue
-                    
-                    # 获取课程详情（包含内容和大纲）
-                    course_detail = await self.java_client.get_course_detail(course_id)
-                    
-                    # 构建文档文本
-                    doc_text = self._build_course_document(course, course_detail)
-                    
-                    # 构建元数据
-                    metadata = {
-                        "course_id": str(course_id),
-                        "course_name": course.get("name", ""),
-                        "course_type": str(course.get("courseType", "")),
-                        "category": self._get_category_path(course),
-                        "price": str(course.get("price", 0)),
-                        "status": str(course.get("status", ""))
-                    }
-                    
-                    documents.append({
-                        "id": f"course_{course_id}",
-                        "text": doc_text,
-                        "metadata": metadata
-                    })
+                    if self.course_store.is_unchanged(course, record):
+                        stats["cached"] += 1
+                        course_detail = record["detail"]
+                    else:
+                        # 获取课程详情（包含内容和大纲），带上ETag/Last-Modified做条件请求
+                        async with semaphore:
+                            course_detail, headers = await self.java_client.get_course_detail_conditional(
+                                course_id,
+                                etag=record["etag"] if record else None,
+                                last_modified=record["last_modified"] if record else None
+                            )
+                        if course_detail is None and record and record["detail"] is not None:
+                            stats["not_modified"] += 1
+                            course_detail = record["detail"]
+                        elif course_detail is None:
+                            # 没有本地数据却收到304，退回到普通请求
+                            course_detail = await self.java_client.get_course_detail(course_id)
+                            stats["fetched"] += 1
+                        else:
+                            stats["fetched"] += 1
+                        self.course_store.save(
+                            course,
+                            course_detail,
+                            etag=headers.get("etag"),
+                            last_modified=headers.get("last-modified")
+                        )
                     
                     logger.debug(f"已处理课程: {course.get('name', 'Unknown')}")
-                    
+                    return self._build_course_entry(course, course_detail)
                 except Exception as e:
-                    logger.error(f"处理课程 {course.get('id')} 时出错: {e}")
-                    continue
+                    logger.error(f"处理课程 {course_id} 时出错: {e}")
+                    return None
             
-            # 3. 批量添加到向量数据库
+            entries = await asyncio.gather(*(load_entry(course) for course in courses))
+            documents = [entry for entry in entries if entry]
+            logger.info(
+                f"课程详情：本地命中 {stats['cached']} 门，304未变化 {stats['not_modified']} 门，"
+                f"重新获取 {stats['fetched']} 门"
+            )
+            for result, count in stats.items():
+                SYNC_COURSES.labels(kind="full", result=result).inc(count)
+            
+            # 3. 只对内容有变化或知识库中缺失的文档重新向量化
             if documents:
-                self.vector_store.add_documents(documents)
+                self._upsert_changed_documents(documents, records)
                 logger.info(f"成功同步 {len(documents)} 门课程到RAG知识库")
+                self._rebuild_indexes()
                 return len(documents)
             else:
                 logger.warning("没有可同步的文档")
@@ -82,8 +130,153 @@ class DataSyncService:
             logger.error(f"同步课程数据失败: {e}")
             raise
         finally:
+            SYNC_SECONDS.labels(kind="full").observe(time.perf_counter() - started)
             await self.java_client.close()
     
+    async def sync_courses(self, course_ids: List[int], deleted_ids: Optional[List[int]] = None) -> Dict[str, int]:
+        """
+        增量同步指定课程（课程上架、修改、下架事件）
+        
+        逐门课程调用 get_course_detail 重建文档并upsert；课程不存在或已不是上架状态时
+        从知识库中删除。已知被删除的课程直接删除，不再请求Java端。
+        
+        Args:
+            course_ids: 需要重新同步的课程ID列表
+            deleted_ids: 已确认下架/删除的课程ID列表（可选）
+        
+        Returns:
+            同步结果统计：upserted、deleted、failed，以及失败的课程ID列表 failed_ids
+        """
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(settings.sync_detail_concurrency)
+        deleted = set(deleted_ids or [])
+        
+        async def fetch(course_id: int):
+            async with semaphore:
+                try:
+                    return course_id, await self.java_client.get_course_detail(course_id)
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code == 404:
+                        return course_id, None
+                    logger.error(f"获取课程 {course_id} 详情失败: {e}")
+                    return course_id, e
+                except Exception as e:
+                    logger.error(f"获取课程 {course_id} 详情失败: {e}")
+                    return course_id, e
+        
+        pending_ids = [cid for cid in dict.fromkeys(course_ids) if cid not in deleted]
+        fetched = await asyncio.gather(*(fetch(cid) for cid in pending_ids))
+        
+        documents = []
+        failed_ids = []
+        for course_id, detail in fetched:
+            if isinstance(detail, Exception):
+                failed_ids.append(course_id)
+            elif not detail or detail.get("status", COURSE_STATUS_ON_SHELF) != COURSE_STATUS_ON_SHELF:
+                deleted.add(course_id)
+            else:
+                self.course_store.save(detail, detail)
+                documents.append(self._build_course_entry(detail, detail))
+        
+        if documents:
+            self.vector_store.upsert_documents(documents)
+            self.course_store.set_document_hashes(
+                {int(doc["metadata"]["course_id"]): content_hash(doc) for doc in documents}
+            )
+        if deleted:
+            self.vector_store.delete_documents([f"course_{course_id}" for course_id in deleted])
+            self.course_store.delete(list(deleted))
+        if documents or deleted:
+            self._update_indexes([int(doc["metadata"]["course_id"]) for doc in documents], list(deleted))
+        
+        logger.info(f"增量同步完成：更新 {len(documents)} 门，删除 {len(deleted)} 门，失败 {len(failed_ids)} 门")
+        result = {"upserted": len(documents), "deleted": len(deleted), "failed": len(failed_ids)}
+        for key, count in result.items():
+            SYNC_COURSES.labels(kind="incremental", result=key).inc(count)
+        SYNC_SECONDS.labels(kind="incremental").observe(time.perf_counter() - started)
+        return {**result, "failed_ids": failed_ids}
+    
+    def _rebuild_indexes(self):
+        """全量同步后重建课程相似度图和分类索引（失败不影响同步结果）"""
+        if self.knn_graph:
+            try:
+                self.knn_graph.build(self.vector_store)
+            except Exception as e:
+                logger.error(f"构建课程相似度图失败: {e}")
+        if self.category_index:
+            try:
+                self.category_index.build(self.vector_store)
+            except Exception as e:
+                logger.error(f"构建课程分类索引失败: {e}")
+    
+    def _update_indexes(self, course_ids: List[int], deleted_ids: List[int]):
+        """增量同步后更新课程相似度图和分类索引（失败不影响同步结果）"""
+        if self.knn_graph:
+            try:
+                self.knn_graph.update(self.vector_store, course_ids, deleted_ids)
+            except Exception as e:
+                logger.error(f"增量更新课程相似度图失败: {e}")
+        if self.category_index:
+            try:
+                self.category_index.update(self.vector_store, course_ids, deleted_ids)
+            except Exception as e:
+                logger.error(f"增量更新课程分类索引失败: {e}")
+    
+    def _upsert_changed_documents(self, documents: List[Dict], records: Dict[int, Dict]):
+        """
+        只向量化内容变化或知识库中缺失的文档
+        
+        Args:
+            documents: 本次同步构建的全部文档
+            records: 同步开始前的本地存储记录（用于比较文档哈希）
+        """
+        course_ids = [int(doc["metadata"]["course_id"]) for doc in documents]
+        existing = self.vector_store.get_documents(course_ids)
+        document_hashes = {}
+        changed = []
+        for course_id, doc in zip(course_ids, documents):
+            doc_hash = content_hash(doc)
+            document_hashes[course_id] = doc_hash
+            if course_id not in existing:
+                changed.append(doc)
+                continue
+            # 本地存储没有记录时（如从快照导入的副本），与知识库中的现有文档比较
+            previous_hash = (records.get(course_id) or {}).get("document_hash") or content_hash(existing[course_id])
+            if doc_hash != previous_hash:
+                changed.append(doc)
+        
+        logger.info(f"需要重新向量化的文档: {len(changed)}/{len(documents)}")
+        SYNC_COURSES.labels(kind="full", result="embedded").inc(len(changed))
+        if changed:
+            self.vector_store.upsert_documents(changed)
+        self.course_store.set_document_hashes(document_hashes)
+    
+    def _build_course_entry(self, course: Dict, course_detail: Dict) -> Dict:
+        """
+        构建写入知识库的文档（id、文本、元数据）
+        
+        Args:
+            course: 课程基本信息
+            course_detail: 课程详细信息
+        
+        Returns:
+            文档字典
+        """
+        course_id = course.get("id")
+        metadata = {
+            "course_id": str(course_id),
+            "course_name": course.get("name", ""),
+            "course_type": str(course.get("courseType", "")),
+            "category": self._get_category_path(course),
+            "price": str(course.get("price", 0)),
+            "status": str(course.get("status", ""))
+        }
+        return {
+            "id": f"course_{course_id}",
+            "text": self._build_course_document(course, course_detail),
+            "metadata": metadata
+        }
+    
     def _build_course_document(self, course: Dict, course_detail: Dict) -> str:
         """
         构建课程文档文本
@@ -186,6 +379,8 @@ class DataSyncService:
         return "\n".join(lines)
     
     async def close(self):
-        """关闭服务"""
+        """关闭服务（同时关闭自行创建的课程存储连接）"""
         await self.java_client.close()
+        if self._owns_course_store:
+            self.course_store.close()
 
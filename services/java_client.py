@@ -1,22 +1,47 @@
 """
 Java服务客户端：调用Spring Cloud接口
 """
+import re
+import time
 import httpx
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from loguru import logger
 from config import settings
+from metrics import JAVA_REQUEST_SECONDS
+from tracing import span
+
+
+# 指标中的接口名：路径中的数字ID归一为 {id}，避免每门课程产生一组标签
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def _observe(method: str, path: str, status, started: float):
+    """记录一次Java接口调用的耗时"""
+    JAVA_REQUEST_SECONDS.labels(
+        method=method, endpoint=_ID_SEGMENT.sub("/{id}", path), status=str(status)
+    ).observe(time.perf_counter() - started)
 
 
 class JavaServiceClient:
     """Java服务客户端"""
     
-    def __init__(self):
-        """初始化客户端"""
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None):
+        """
+        初始化客户端
+
+        Args:
+            transport: 自定义httpx transport（可选），用于注入Java服务替身；
+                未指定时根据 settings.java_service_mode 决定
+        """
         self.base_url = settings.java_service_base_url
         self.api_prefix = settings.java_service_api_prefix
+        if transport is None and settings.java_service_mode != "live":
+            from services.java_stub import build_transport
+            transport = build_transport(settings.java_service_mode)
         self.client = httpx.AsyncClient(
             base_url=self.base_url,
-            timeout=30.0
+            timeout=30.0,
+            transport=transport
         )
         logger.info(f"Java服务客户端初始化，base_url: {self.base_url}")
     
@@ -37,13 +62,21 @@ class JavaServiceClient:
             响应数据
         """
         url = f"{self.api_prefix}{path}"
-        try:
-            response = await self.client.request(method, url, **kwargs)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPError as e:
-            logger.error(f"请求失败: {method} {url}, 错误: {e}")
-            raise
+        started = time.perf_counter()
+        status = "error"
+        with span(f"java {method} {_ID_SEGMENT.sub('/{id}', path)}", path=path) as java_span:
+            try:
+                response = await self.client.request(method, url, **kwargs)
+                status = response.status_code
+                response.raise_for_status()
+                return response.json()
+            except httpx.HTTPError as e:
+                logger.error(f"请求失败: {method} {url}, 错误: {e}")
+                raise
+            finally:
+                _observe(method, path, status, started)
+                if java_span:
+                    java_span.set(status=status)
     
     async def get_user_learning_profile(self, user_id: int) -> Dict:
         """
@@ -205,4 +238,49 @@ class JavaServiceClient:
         # 如果还需要获取课程内容（介绍、详情等），可能需要额外调用
         # 这里假设返回的数据已包含基本信息
         return data
-
+    
+    async def get_course_detail_conditional(
+        self,
+        course_id: int,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None
+    ) -> Tuple[Optional[Dict], httpx.Headers]:
+        """
+        条件请求课程详情（If-None-Match / If-Modified-Since）
+        
+        Args:
+            course_id: 课程ID
+            etag: 本地保存的ETag（可选）
+            last_modified: 本地保存的Last-Modified（可选）
+            
+        Returns:
+            (课程详情, 响应头)；Java端返回304时课程详情为None，表示本地数据仍然有效
+        """
+        path = f"{self.api_prefix}/course/{course_id}"
+        params = {
+            "withCatalogue": True,
+            "withTeachers": False
+        }
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        
+        started = time.perf_counter()
+        status = "error"
+        with span("java GET /course/{id}", path=path, conditional=True) as java_span:
+            try:
+                response = await self.client.get(path, params=params, headers=headers)
+                status = response.status_code
+                if response.status_code == 304:
+                    return None, response.headers
+                response.raise_for_status()
+                return response.json(), response.headers
+            except httpx.HTTPError as e:
+                logger.error(f"请求失败: GET {path}, 错误: {e}")
+                raise
+            finally:
+                _observe("GET", "/course/{id}", status, started)
+                if java_span:
+                    java_span.set(status=status)
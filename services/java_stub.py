@@ -0,0 +1,477 @@
+"""
+Java服务替身：录制/回放真实响应，或按规模生成合成数据
+
+用于在不访问真实 Spring Cloud 服务的情况下进行压测和同步基准测试。
+支持三种模式：
+- record: 透传到真实Java服务，同时把响应录制为fixture文件
+- replay: 从fixture目录回放录制的响应
+- synthetic: 按配置规模（课程数、大纲深度、用户数）生成确定性的合成数据
+
+既可以作为 httpx 的 transport 注入 JavaServiceClient，也可以作为独立的ASGI应用启动。
+
+使用示例：
+    from services.java_stub import SyntheticCatalog, SyntheticJavaBackend, StubTransport
+    from services.java_client import JavaServiceClient
+
+    backend = SyntheticJavaBackend(SyntheticCatalog(num_courses=1000, num_users=200))
+    client = JavaServiceClient(transport=StubTransport(backend))
+
+    # 或以独立服务方式启动（监听8080端口，替代真实Java服务）
+    # python -m services.java_stub --courses 1000 --users 200 --port 8080
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import httpx
+from loguru import logger
+from config import settings
+
+
+# 接口路由（忽略API前缀，只匹配路径末尾）
+_ROUTES = [
+    ("courses_page", re.compile(r"/courses/page$")),
+    ("course_detail", re.compile(r"/course/(\d+)$")),
+    ("lessons_page", re.compile(r"/lessons/page$")),
+    ("learning_records", re.compile(r"/learning-records/course/(\d+)$")),
+]
+
+_CATEGORIES = [
+    ("后端开发", "Java", ["Java基础", "Java并发", "JVM", "Spring"]),
+    ("后端开发", "微服务", ["Spring Cloud", "消息队列", "分布式事务"]),
+    ("前端开发", "Web前端", ["HTML/CSS", "JavaScript", "Vue"]),
+    ("数据库", "关系型数据库", ["MySQL", "SQL优化"]),
+    ("数据库", "NoSQL", ["Redis", "MongoDB"]),
+    ("人工智能", "机器学习", ["Python", "深度学习", "大模型应用"]),
+]
+
+_LEVELS = ["入门", "基础", "进阶", "高级", "实战"]
+
+
+def _fixture_key(method: str, path: str, params: Dict) -> str:
+    """生成请求对应的fixture键（方法+路径+排序后的查询参数）"""
+    query = urlencode(sorted((str(k), str(v)) for k, v in params.items()))
+    raw = f"{method.upper()} {path}?{query}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _match_route(path: str) -> Tuple[Optional[str], Optional[int]]:
+    """匹配请求路径，返回 (路由名, 路径中的ID)"""
+    for name, pattern in _ROUTES:
+        match = pattern.search(path)
+        if match:
+            item_id = int(match.group(1)) if match.groups() else None
+            return name, item_id
+    return None, None
+
+
+class SyntheticCatalog:
+    """
+    合成课程目录
+
+    所有数据由 seed 决定，同样的参数总是生成同样的数据，保证基准测试可重复。
+    """
+
+    def __init__(
+        self,
+        num_courses: int = 200,
+        num_users: int = 100,
+        chapters_per_course: int = 5,
+        sections_per_chapter: int = 4,
+        lessons_per_user: int = 8,
+        seed: int = 42
+    ):
+        """
+        初始化合成目录
+
+        Args:
+            num_courses: 课程数量
+            num_users: 用户数量（用户ID为 1..num_users）
+            chapters_per_course: 每门课程的章数
+            sections_per_chapter: 每章的节数
+            lessons_per_user: 每个用户课表中的平均课程数
+            seed: 随机种子
+        """
+        self.num_courses = num_courses
+        self.num_users = num_users
+        self.chapters_per_course = chapters_per_course
+        self.sections_per_chapter = sections_per_chapter
+        self.lessons_per_user = lessons_per_user
+        self.seed = seed
+        self._courses = [self._make_course(course_id) for course_id in range(1, num_courses + 1)]
+
+    def _rng(self, *parts) -> random.Random:
+        """为指定实体创建独立的确定性随机数生成器"""
+        return random.Random(f"{self.seed}:" + ":".join(str(p) for p in parts))
+
+    def _make_course(self, course_id: int) -> Dict:
+        """生成课程列表项"""
+        rng = self._rng("course", course_id)
+        first, second, thirds = _CATEGORIES[course_id % len(_CATEGORIES)]
+        third = rng.choice(thirds)
+        level = rng.choice(_LEVELS)
+        return {
+            "id": course_id,
+            "name": f"{third}{level}课程{course_id}",
+            "courseType": rng.choice([1, 2]),
+            "price": rng.choice([0, 9900, 19900, 29900]),
+            "status": 2,
+            "sections": self.chapters_per_course * self.sections_per_chapter,
+            "firstCateName": first,
+            "secondCateName": second,
+            "thirdCateName": third,
+            "updateTime": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T10:00:00",
+        }
+
+    def courses_page(self, page: int, size: int) -> Dict:
+        """分页返回课程列表（PageDTO格式）"""
+        start = max(page - 1, 0) * size
+        items = self._courses[start:start + size]
+        pages = (len(self._courses) + size - 1) // size if size else 0
+        return {"total": len(self._courses), "pages": pages, "list": items}
+
+    def course_detail(self, course_id: int) -> Optional[Dict]:
+        """返回课程详情（含大纲）"""
+        if course_id < 1 or course_id > len(self._courses):
+            return None
+        course = self._courses[course_id - 1]
+        catalogue = []
+        section_id = course_id * 1000
+        for chapter in range(1, self.chapters_per_course + 1):
+            children = []
+            for section in range(1, self.sections_per_chapter + 1):
+                section_id += 1
+                children.append({
+                    "id": section_id,
+                    "name": f"{course['thirdCateName']} 第{chapter}章第{section}节",
+                    "type": 2,
+                    "level": 1,
+                })
+            catalogue.append({
+                "id": course_id * 1000 + chapter * 100,
+                "name": f"第{chapter}章 {course['thirdCateName']}核心知识{chapter}",
+                "type": 1,
+                "level": 0,
+                "children": children,
+            })
+        return {
+            **course,
+            "courseIntroduce": f"{course['name']}系统讲解{course['thirdCateName']}的核心知识与实践。",
+            "usePeople": f"希望提升{course['secondCateName']}能力的开发者",
+            "courseDetail": f"本课程共{course['sections']}节，覆盖{course['thirdCateName']}从原理到实战。",
+            "catalogue": catalogue,
+        }
+
+    def user_lessons(self, user_id: int) -> List[Dict]:
+        """返回用户课表（LearningLessonVO列表）"""
+        if user_id < 1 or user_id > self.num_users or not self._courses:
+            return []
+        rng = self._rng("user", user_id)
+        count = min(len(self._courses), max(1, int(rng.gauss(self.lessons_per_user, 2))))
+        lessons = []
+        for index, course in enumerate(rng.sample(self._courses, count)):
+            sections = course["sections"]
+            status = rng.choice([0, 1, 1, 2, 3])
+            learned = {0: 0, 2: sections}.get(status, rng.randint(1, max(sections - 1, 1)))
+            lessons.append({
+                "id": user_id * 10000 + index,
+                "courseId": course["id"],
+                "courseName": course["name"],
+                "status": status,
+                "sections": sections,
+                "learnedSections": learned,
+                "latestSectionName": f"第{max(learned, 1)}节",
+                "latestLearnTime": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T20:00:00",
+                "createTime": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T09:00:00",
+            })
+        return lessons
+
+    def learning_records(self, course_id: int) -> Dict:
+        """返回课程学习记录（LearningLessonDTO格式）"""
+        rng = self._rng("records", course_id)
+        detail = self.course_detail(course_id)
+        if not detail:
+            return {"id": None, "latestSectionId": None, "records": []}
+        section_ids = [s["id"] for chapter in detail["catalogue"] for s in chapter["children"]]
+        learned = section_ids[:rng.randint(0, len(section_ids))]
+        records = [
+            {"id": i + 1, "sectionId": sid, "moment": rng.randint(0, 1800), "finished": True,
+             "finishTime": "2025-06-01T10:00:00"}
+            for i, sid in enumerate(learned)
+        ]
+        return {
+            "id": course_id,
+            "latestSectionId": learned[-1] if learned else None,
+            "records": records,
+        }
+
+
+class JavaStubBackend:
+    """替身后端基类：根据请求返回 (状态码, 响应体)"""
+
+    async def handle(self, method: str, path: str, params: Dict) -> Tuple[int, object]:
+        """
+        处理一个请求
+
+        Args:
+            method: HTTP方法
+            path: 请求路径（含API前缀）
+            params: 查询参数
+
+        Returns:
+            (状态码, JSON响应体)
+        """
+        raise NotImplementedError
+
+
+class SyntheticJavaBackend(JavaStubBackend):
+    """合成数据后端，支持注入延迟和错误率"""
+
+    def __init__(
+        self,
+        catalog: SyntheticCatalog,
+        latency_ms: float = 0.0,
+        latency_jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 42
+    ):
+        """
+        初始化合成后端
+
+        Args:
+            catalog: 合成课程目录
+            latency_ms: 每个请求的基础延迟（毫秒）
+            latency_jitter_ms: 延迟抖动上限（毫秒，均匀分布）
+            error_rate: 返回500错误的概率（0~1）
+            seed: 延迟和错误注入使用的随机种子
+        """
+        self.catalog = catalog
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+
+    async def handle(self, method: str, path: str, params: Dict) -> Tuple[int, object]:
+        delay = self.latency_ms + (self._rng.uniform(0, self.latency_jitter_ms) if self.latency_jitter_ms else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if self.error_rate and self._rng.random() < self.error_rate:
+            return 500, {"code": 500, "msg": "injected error"}
+
+        route, item_id = _match_route(path)
+        if route == "courses_page":
+            page = int(params.get("page", 1))
+            size = int(params.get("size", 10))
+            return 200, self.catalog.courses_page(page, size)
+        if route == "course_detail":
+            detail = self.catalog.course_detail(item_id)
+            if detail is None:
+                return 404, {"code": 404, "msg": "课程不存在"}
+            return 200, detail
+        if route == "lessons_page":
+            lessons = self.catalog.user_lessons(int(params.get("userId", 0)))
+            size = int(params.get("size", 10))
+            return 200, {"total": len(lessons), "pages": 1, "list": lessons[:size]}
+        if route == "learning_records":
+            return 200, self.catalog.learning_records(item_id)
+        return 404, {"code": 404, "msg": f"未知接口: {path}"}
+
+
+class ReplayJavaBackend(JavaStubBackend):
+    """回放后端：从fixture目录读取录制的响应"""
+
+    def __init__(self, fixture_dir: str):
+        """
+        初始化回放后端
+
+        Args:
+            fixture_dir: fixture目录（由 RecordingTransport 录制）
+        """
+        self.fixture_dir = fixture_dir
+        self._cache: Dict[str, Tuple[int, object]] = {}
+
+    async def handle(self, method: str, path: str, params: Dict) -> Tuple[int, object]:
+        key = _fixture_key(method, path, params)
+        if key not in self._cache:
+            fixture_path = os.path.join(self.fixture_dir, f"{key}.json")
+            if not os.path.exists(fixture_path):
+                logger.warning(f"未找到录制的响应: {method} {path} {params}")
+                return 404, {"code": 404, "msg": "fixture not found"}
+            with open(fixture_path, "r", encoding="utf-8") as f:
+                fixture = json.load(f)
+            self._cache[key] = (fixture["status"], fixture["body"])
+        return self._cache[key]
+
+
+class StubTransport(httpx.AsyncBaseTransport):
+    """把 httpx 请求路由到替身后端的 transport"""
+
+    def __init__(self, backend: JavaStubBackend):
+        self.backend = backend
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        params = dict(request.url.params)
+        status, body = await self.backend.handle(request.method, request.url.path, params)
+        return httpx.Response(status, json=body, request=request)
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """透传到真实服务并把响应录制为fixture的 transport"""
+
+    def __init__(self, fixture_dir: str, transport: Optional[httpx.AsyncBaseTransport] = None):
+        """
+        初始化录制transport
+
+        Args:
+            fixture_dir: fixture输出目录
+            transport: 实际发送请求的transport，默认使用 httpx.AsyncHTTPTransport
+        """
+        self.fixture_dir = fixture_dir
+        self.transport = transport or httpx.AsyncHTTPTransport()
+        os.makedirs(self.fixture_dir, exist_ok=True)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self.transport.handle_async_request(request)
+        content = await response.aread()
+        params = dict(request.url.params)
+        try:
+            body = json.loads(content) if content else None
+        except ValueError:
+            body = None
+
+        if body is not None:
+            key = _fixture_key(request.method, request.url.path, params)
+            fixture = {
+                "request": {"method": request.method, "path": request.url.path, "params": params},
+                "status": response.status_code,
+                "body": body,
+            }
+            with open(os.path.join(self.fixture_dir, f"{key}.json"), "w", encoding="utf-8") as f:
+                json.dump(fixture, f, ensure_ascii=False)
+
+        # aread() 已经解压了响应体，去掉编码相关的头避免客户端重复解码
+        headers = [
+            (k, v) for k, v in response.headers.items()
+            if k.lower() not in ("content-encoding", "content-length", "transfer-encoding")
+        ]
+        return httpx.Response(
+            response.status_code,
+            headers=headers,
+            content=content,
+            request=request
+        )
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def build_backend(mode: str) -> JavaStubBackend:
+    """
+    根据模式和配置创建替身后端
+
+    Args:
+        mode: synthetic 或 replay
+
+    Returns:
+        替身后端
+    """
+    if mode == "replay":
+        return ReplayJavaBackend(settings.java_stub_fixture_dir)
+    if mode == "synthetic":
+        catalog = SyntheticCatalog(
+            num_courses=settings.java_stub_courses,
+            num_users=settings.java_stub_users,
+            chapters_per_course=settings.java_stub_chapters,
+            sections_per_chapter=settings.java_stub_sections,
+            seed=settings.java_stub_seed
+        )
+        return SyntheticJavaBackend(
+            catalog,
+            latency_ms=settings.java_stub_latency_ms,
+            latency_jitter_ms=settings.java_stub_latency_jitter_ms,
+            error_rate=settings.java_stub_error_rate,
+            seed=settings.java_stub_seed
+        )
+    raise ValueError(f"不支持的替身模式: {mode}")
+
+
+def build_transport(mode: str) -> httpx.AsyncBaseTransport:
+    """
+    根据 java_service_mode 创建 JavaServiceClient 使用的 transport
+
+    Args:
+        mode: record、replay 或 synthetic
+
+    Returns:
+        httpx transport
+    """
+    logger.info(f"Java服务使用替身模式: {mode}")
+    if mode == "record":
+        return RecordingTransport(settings.java_stub_fixture_dir)
+    return StubTransport(build_backend(mode))
+
+
+def create_stub_app(backend: JavaStubBackend):
+    """
+    创建替身的ASGI应用，可独立启动以替代真实Java服务
+
+    Args:
+        backend: 替身后端
+
+    Returns:
+        FastAPI应用
+    """
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse
+
+    app = FastAPI(title="Tianji Java Service Stub")
+
+    @app.api_route("/{path:path}", methods=["GET", "POST"])
+    async def handle(path: str, request: Request):
+        status, body = await backend.handle(request.method, request.url.path, dict(request.query_params))
+        return JSONResponse(status_code=status, content=body)
+
+    return app
+
+
+if __name__ == "__main__":
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Java服务替身")
+    parser.add_argument("--mode", choices=["synthetic", "replay"], default="synthetic")
+    parser.add_argument("--courses", type=int, default=settings.java_stub_courses)
+    parser.add_argument("--users", type=int, default=settings.java_stub_users)
+    parser.add_argument("--chapters", type=int, default=settings.java_stub_chapters)
+    parser.add_argument("--sections", type=int, default=settings.java_stub_sections)
+    parser.add_argument("--latency-ms", type=float, default=settings.java_stub_latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=settings.java_stub_latency_jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=settings.java_stub_error_rate)
+    parser.add_argument("--seed", type=int, default=settings.java_stub_seed)
+    parser.add_argument("--fixture-dir", default=settings.java_stub_fixture_dir)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    if args.mode == "replay":
+        stub_backend = ReplayJavaBackend(args.fixture_dir)
+    else:
+        stub_backend = SyntheticJavaBackend(
+            SyntheticCatalog(
+                num_courses=args.courses,
+                num_users=args.users,
+                chapters_per_course=args.chapters,
+                sections_per_chapter=args.sections,
+                seed=args.seed
+            ),
+            latency_ms=args.latency_ms,
+            latency_jitter_ms=args.jitter_ms,
+            error_rate=args.error_rate,
+            seed=args.seed
+        )
+    uvicorn.run(create_stub_app(stub_backend), host=args.host, port=args.port)
@@ -0,0 +1,148 @@
+"""
+学习画像摘要：把原始课表数据压缩为紧凑的特征
+
+原始画像中 lessons、learning_courses、finished_courses 会重复包含同一批课表行，
+重度用户的画像直接序列化后会占用数千个prompt token。这里只保留推荐需要的特征：
+各状态课程数、学习进度、近期活跃度、主要分类、停滞课程，以及课程ID。
+
+使用示例：
+    from services.profile_summary import summarize_learning_profile
+
+    profile = await java_client.get_user_learning_profile(user_id)
+    summary = summarize_learning_profile(profile, course_categories={100: "后端开发 > Java"})
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+
+# 课表状态：0-未学习，1-学习中，2-已学完，3-已失效
+LESSON_STATUS_NAMES = {
+    0: "not_started",
+    1: "learning",
+    2: "finished",
+    3: "expired",
+}
+
+
+def _parse_time(value) -> Optional[datetime]:
+    """解析Java端返回的时间（ISO字符串、'yyyy-MM-dd HH:mm:ss' 或毫秒时间戳）"""
+    if not value:
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000 if value > 1e11 else value)
+    if isinstance(value, str):
+        try:
+            # 截掉毫秒和时区，统一按本地时间比较
+            return datetime.fromisoformat(value.strip()[:19])
+        except ValueError:
+            return None
+    return None
+
+
+def _progress(lesson: Dict) -> float:
+    """计算单门课程的学习进度（0~1）"""
+    sections = lesson.get("sections") or 0
+    if sections <= 0:
+        return 1.0 if lesson.get("status") == 2 else 0.0
+    return round(min((lesson.get("learnedSections") or 0) / sections, 1.0), 2)
+
+
+def summarize_learning_profile(
+    profile: Dict,
+    course_categories: Optional[Dict[int, str]] = None,
+    recent_days: int = 30,
+    stalled_days: int = 14,
+    max_items: int = 5,
+    now: Optional[datetime] = None
+) -> Dict:
+    """
+    把原始学习画像压缩为紧凑特征
+
+    Args:
+        profile: JavaServiceClient.get_user_learning_profile 返回的原始画像
+        course_categories: 课程ID到分类路径的映射（可选，用于统计主要分类）
+        recent_days: 统计近期活跃度的天数
+        stalled_days: 学习中课程超过多少天未学习视为停滞
+        max_items: 列表类特征最多保留的条目数
+        now: 当前时间（默认取系统时间，便于测试）
+
+    Returns:
+        画像特征
+    """
+    lessons: List[Dict] = profile.get("lessons") or []
+    course_categories = course_categories or {}
+    now = now or datetime.now()
+
+    status_counts = Counter(LESSON_STATUS_NAMES.get(l.get("status"), "unknown") for l in lessons)
+    ids_by_status: Dict[str, List[int]] = {}
+    for lesson in lessons:
+        name = LESSON_STATUS_NAMES.get(lesson.get("status"), "unknown")
+        if lesson.get("courseId") is not None:
+            ids_by_status.setdefault(name, []).append(lesson["courseId"])
+
+    # 学习进度
+    total_sections = sum(l.get("sections") or 0 for l in lessons)
+    learned_sections = sum(l.get("learnedSections") or 0 for l in lessons)
+    learning = [l for l in lessons if l.get("status") == 1]
+    avg_learning_progress = (
+        round(sum(_progress(l) for l in learning) / len(learning), 2) if learning else 0.0
+    )
+
+    # 近期活跃度
+    learn_times = [(l, _parse_time(l.get("latestLearnTime"))) for l in lessons]
+    learn_times = [(l, t) for l, t in learn_times if t]
+    recent_cutoff = now - timedelta(days=recent_days)
+    last_learn_time = max((t for _, t in learn_times), default=None)
+    recent_active = sorted(
+        ((l, t) for l, t in learn_times if t >= recent_cutoff),
+        key=lambda item: item[1],
+        reverse=True
+    )
+
+    # 停滞课程：学习中但长时间没有学习记录
+    stalled_cutoff = now - timedelta(days=stalled_days)
+    stalled = []
+    for lesson in learning:
+        learned_at = _parse_time(lesson.get("latestLearnTime"))
+        if learned_at is None or learned_at < stalled_cutoff:
+            stalled.append({
+                "id": lesson.get("courseId"),
+                "name": lesson.get("courseName", ""),
+                "progress": _progress(lesson),
+                "idle_days": (now - learned_at).days if learned_at else None,
+            })
+    stalled.sort(key=lambda item: item["idle_days"] if item["idle_days"] is not None else 1 << 30, reverse=True)
+
+    # 主要分类
+    category_counter = Counter(
+        course_categories[l["courseId"]]
+        for l in lessons
+        if l.get("courseId") in course_categories and course_categories[l["courseId"]]
+    )
+
+    return {
+        "total_courses": profile.get("total_courses", len(lessons)),
+        "status_counts": dict(status_counts),
+        "progress": {
+            "learned_sections": learned_sections,
+            "total_sections": total_sections,
+            "overall_ratio": round(learned_sections / total_sections, 2) if total_sections else 0.0,
+            "avg_learning_ratio": avg_learning_progress,
+        },
+        "recent_activity": {
+            "days": recent_days,
+            "active_courses": len(recent_active),
+            "last_learn_time": last_learn_time.strftime("%Y-%m-%d %H:%M") if last_learn_time else None,
+            "recent": [
+                {"id": l.get("courseId"), "name": l.get("courseName", ""), "progress": _progress(l)}
+                for l, _ in recent_active[:max_items]
+            ],
+        },
+        "top_categories": [
+            {"category": category, "count": count}
+            for category, count in category_counter.most_common(max_items)
+        ],
+        "stalled_courses": stalled[:max_items],
+        "course_ids": ids_by_status,
+    }
@@ -0,0 +1,191 @@
+"""
+课程变更事件队列：对推送的课程变更做防抖和合并
+
+Java端在课程上架、修改、下架时推送事件，短时间内同一门课程可能触发多次事件。
+队列在事件停止到达 debounce_seconds 后（最长不超过 max_wait_seconds）统一处理，
+同一课程的多次事件只同步一次。同步失败的课程按指数退避重新入队，最多重试 sync_max_retries 次。
+
+使用示例：
+    from services.sync_queue import CourseSyncQueue
+    
+    queue = CourseSyncQueue(DataSyncService(vector_store=vector_store))
+    queue.start()
+    queue.submit([101, 102])            # 课程上架或修改
+    queue.submit([103], deleted=True)   # 课程下架
+    await queue.stop()
+"""
+import asyncio
+from typing import Dict, List, Optional, Set
+from loguru import logger
+from config import settings
+from services.data_sync import DataSyncService
+
+
+class CourseSyncQueue:
+    """课程变更事件防抖队列"""
+    
+    def __init__(
+        self,
+        sync_service: DataSyncService,
+        debounce_seconds: Optional[float] = None,
+        max_wait_seconds: Optional[float] = None,
+        max_batch_size: Optional[int] = None
+    ):
+        """
+        初始化队列
+        
+        Args:
+            sync_service: 执行增量同步的数据同步服务
+            debounce_seconds: 防抖窗口，事件停止到达多久后开始同步
+            max_wait_seconds: 从第一个事件到开始同步的最长等待时间
+            max_batch_size: 每批同步的最大课程数
+        """
+        self.sync_service = sync_service
+        self.debounce_seconds = debounce_seconds if debounce_seconds is not None else settings.sync_debounce_seconds
+        self.max_wait_seconds = max_wait_seconds if max_wait_seconds is not None else settings.sync_max_wait_seconds
+        self.max_batch_size = max_batch_size or settings.sync_max_batch_size
+        
+        # 课程ID -> 是否已删除（同一课程以最后一次事件为准）
+        self._pending: Dict[int, bool] = {}
+        # 课程ID -> 已重试次数；等待重试的任务
+        self._attempts: Dict[int, int] = {}
+        self._retry_tasks: Set[asyncio.Task] = set()
+        self._event = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.stats = {
+            "received": 0, "coalesced": 0, "upserted": 0, "deleted": 0, "failed": 0, "batches": 0,
+            "retried": 0, "gave_up": 0,
+        }
+    
+    def start(self):
+        """启动后台处理任务"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"课程变更队列已启动，防抖窗口: {self.debounce_seconds}s")
+    
+    async def stop(self):
+        """停止后台任务，并同步尚未处理的事件（等待中的重试不再执行）"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        for task in self._retry_tasks:
+            task.cancel()
+    
+    def submit(self, course_ids: List[int], deleted: bool = False) -> int:
+        """
+        提交课程变更事件（不等待同步完成）
+        
+        Args:
+            course_ids: 发生变更的课程ID列表
+            deleted: 课程是否已下架/删除
+        
+        Returns:
+            当前等待同步的课程数
+        """
+        for course_id in course_ids:
+            self.stats["received"] += 1
+            if course_id in self._pending:
+                self.stats["coalesced"] += 1
+            self._pending[course_id] = deleted
+            # 新的变更事件重新计算重试次数
+            self._attempts.pop(course_id, None)
+        self._event.set()
+        return len(self._pending)
+    
+    @property
+    def pending_count(self) -> int:
+        """等待同步的课程数"""
+        return len(self._pending)
+    
+    async def flush(self) -> Dict[str, int]:
+        """
+        立即同步所有等待中的事件
+        
+        Returns:
+            同步结果统计：upserted、deleted、failed
+        """
+        result = {"upserted": 0, "deleted": 0, "failed": 0}
+        async with self._lock:
+            while self._pending:
+                batch_ids = list(self._pending)[:self.max_batch_size]
+                batch = {course_id: self._pending.pop(course_id) for course_id in batch_ids}
+                upsert_ids = [course_id for course_id, deleted in batch.items() if not deleted]
+                deleted_ids = [course_id for course_id, deleted in batch.items() if deleted]
+                try:
+                    batch_result = await self.sync_service.sync_courses(upsert_ids, deleted_ids)
+                    failed = {course_id: False for course_id in batch_result.get("failed_ids", [])}
+                except Exception as e:
+                    logger.error(f"课程增量同步失败: {e}")
+                    batch_result = {"upserted": 0, "deleted": 0, "failed": len(batch)}
+                    failed = batch
+                for key in result:
+                    result[key] += batch_result.get(key, 0)
+                    self.stats[key] += batch_result.get(key, 0)
+                self.stats["batches"] += 1
+                for course_id in batch:
+                    if course_id not in failed:
+                        self._attempts.pop(course_id, None)
+                self._schedule_retry(failed)
+        return result
+    
+    def _schedule_retry(self, failed: Dict[int, bool]):
+        """
+        失败的课程按指数退避重新入队（第n次重试前等待 sync_retry_base_seconds * 2^(n-1) 秒）
+        
+        Args:
+            failed: 失败的课程ID -> 是否已删除
+        """
+        # 按重试次数分组，同一次数的课程共用一个等待任务
+        groups: Dict[int, Dict[int, bool]] = {}
+        for course_id, deleted in failed.items():
+            attempt = self._attempts.get(course_id, 0) + 1
+            if attempt > settings.sync_max_retries:
+                self._attempts.pop(course_id, None)
+                self.stats["gave_up"] += 1
+                logger.warning(f"课程 {course_id} 增量同步已重试 {settings.sync_max_retries} 次仍失败，放弃重试")
+                continue
+            self._attempts[course_id] = attempt
+            groups.setdefault(attempt, {})[course_id] = deleted
+        
+        for attempt, courses in groups.items():
+            delay = settings.sync_retry_base_seconds * 2 ** (attempt - 1)
+            logger.info(f"{len(courses)} 门课程增量同步失败，{delay:.0f}s 后第 {attempt} 次重试")
+            task = asyncio.create_task(self._requeue(courses, delay))
+            self._retry_tasks.add(task)
+            task.add_done_callback(self._retry_tasks.discard)
+    
+    async def _requeue(self, courses: Dict[int, bool], delay: float):
+        """等待 delay 秒后把失败的课程放回队列（期间收到新事件的课程以新事件为准）"""
+        await asyncio.sleep(delay)
+        for course_id, deleted in courses.items():
+            if course_id in self._attempts:
+                self._pending.setdefault(course_id, deleted)
+                self.stats["retried"] += 1
+        self._event.set()
+    
+    async def _run(self):
+        """后台任务：等待事件静默后批量同步"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._event.wait()
+            first_event_at = loop.time()
+            
+            # 防抖：窗口内持续有新事件则继续等待，但不超过最长等待时间
+            while True:
+                self._event.clear()
+                remaining = self.max_wait_seconds - (loop.time() - first_event_at)
+                timeout = min(self.debounce_seconds, remaining)
+                if timeout <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            
+            await self.flush()
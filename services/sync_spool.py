@@ -0,0 +1,112 @@
+"""
+同步请求暂存：非写入进程收到的同步请求转交给写入进程执行
+
+多个进程共用知识库目录时只有持有写入租约（rag.writer_lease）的进程写入。其他进程收到的课程变更事件
+和全量同步请求写入数据库目录下的暂存目录，每个请求一个JSON文件（先写临时文件再改名，读取方不会读到
+半个文件）；写入进程定期取出并执行，执行完成后才删除文件，执行失败或进程崩溃时请求留在目录中下次重试。
+
+使用示例：
+    from services.sync_spool import SyncSpool
+    
+    spool = SyncSpool()
+    spool.submit([101, 102])                  # 非写入进程：课程变更事件
+    spool.submit_full(force=False)            # 非写入进程：全量同步
+    for name, request in spool.pending():     # 写入进程：取出并执行
+        ...
+        spool.ack(name)                       # 执行完成后删除
+"""
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
+from config import settings
+
+
+class SyncSpool:
+    """同步请求暂存目录"""
+    
+    def __init__(self, directory: Optional[str] = None):
+        """
+        初始化暂存目录
+        
+        Args:
+            directory: 暂存目录，默认为数据库目录下的 sync_spool
+        """
+        self.directory = directory or os.path.join(settings.chroma_db_path, "sync_spool")
+        os.makedirs(self.directory, exist_ok=True)
+        self.stats = {"submitted": 0, "drained": 0, "discarded": 0}
+    
+    def submit(self, course_ids: List[int], deleted: bool = False):
+        """
+        暂存课程变更事件
+        
+        Args:
+            course_ids: 发生变更的课程ID列表
+            deleted: 课程是否已下架/删除
+        """
+        self._write({"type": "courses", "course_ids": list(course_ids), "deleted": deleted})
+    
+    def submit_full(self, force: bool = False):
+        """
+        暂存全量同步请求
+        
+        Args:
+            force: 是否清空后重新同步
+        """
+        self._write({"type": "full", "force": force})
+    
+    def pending(self) -> List[Tuple[str, Dict]]:
+        """
+        按提交顺序读取全部请求（不删除文件，执行完成后调用 ack）
+        
+        Returns:
+            (文件名, 请求) 列表，请求为 {"type": "courses", "course_ids", "deleted"} 或 {"type": "full", "force"}
+        """
+        requests = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    requests.append((name, json.load(f)))
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                # 无法解析的文件重试也不会成功，直接丢弃
+                logger.warning(f"读取同步请求失败，已丢弃 {name}: {e}")
+                self.stats["discarded"] += 1
+                self._remove(name)
+        return requests
+    
+    def ack(self, name: str):
+        """
+        删除已执行完成的请求
+        
+        Args:
+            name: pending() 返回的文件名
+        """
+        if self._remove(name):
+            self.stats["drained"] += 1
+    
+    def _remove(self, name: str) -> bool:
+        """删除请求文件，文件已不存在时返回False"""
+        try:
+            os.remove(os.path.join(self.directory, name))
+            return True
+        except FileNotFoundError:
+            return False
+    
+    def pending_count(self) -> int:
+        """暂存的请求数"""
+        return sum(1 for name in os.listdir(self.directory) if name.endswith(".json"))
+    
+    def _write(self, request: Dict):
+        """写入一个请求文件（文件名按时间排序）"""
+        name = f"{time.time_ns():020d}-{os.getpid()}"
+        tmp_path = os.path.join(self.directory, f"{name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(request, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.directory, f"{name}.json"))
+        self.stats["submitted"] += 1
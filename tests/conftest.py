@@ -0,0 +1,71 @@
+"""
+测试公共夹具
+
+知识库相关的测试使用内存中的向量数据库替身（接口与 rag.vector_store.VectorStore 一致），
+不加载嵌入模型，也不需要Chroma目录。
+"""
+import os
+import sys
+from typing import Dict, List, Optional
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeEmbeddingModel:
+    """嵌入模型替身（只提供向量维度）"""
+    
+    dimension = 8
+
+
+class FakeVectorStore:
+    """内存中的向量数据库替身：课程ID -> (元数据, 向量)"""
+    
+    def __init__(self):
+        self.embedding_model = FakeEmbeddingModel()
+        self.generation = "0"
+        self._courses: Dict[int, Dict] = {}
+    
+    def put(self, course_id: int, name: str, category: str):
+        """写入一门课程（向量由课程ID确定，写入后代次变化）"""
+        rng = np.random.default_rng(course_id)
+        self._courses[course_id] = {
+            "metadata": {"course_id": course_id, "course_name": name, "category": category},
+            "embedding": rng.normal(size=self.embedding_model.dimension).tolist(),
+        }
+        self.generation = str(int(self.generation) + 1)
+    
+    def count(self) -> int:
+        return len(self._courses)
+    
+    def iter_all(self, batch_size: int = 1000, include_embeddings: bool = True):
+        items = list(self._courses.items())
+        for i in range(0, len(items), batch_size):
+            batch = items[i:i + batch_size]
+            yield (
+                [f"course_{course_id}" for course_id, _ in batch],
+                ["" for _ in batch],
+                [course["metadata"] for _, course in batch],
+                [course["embedding"] for _, course in batch] if include_embeddings else None,
+            )
+    
+    def get_course_metadata(self, course_ids: List[int]) -> Dict[int, Dict]:
+        return {cid: self._courses[cid]["metadata"] for cid in course_ids if cid in self._courses}
+    
+    def get_course_embeddings(self, course_ids: List[int]) -> Dict[int, List[float]]:
+        return {cid: self._courses[cid]["embedding"] for cid in course_ids if cid in self._courses}
+
+
+@pytest.fixture
+def vector_store() -> FakeVectorStore:
+    """只有一门课程的知识库"""
+    store = FakeVectorStore()
+    store.put(1, "Java入门", "后端开发 > Java")
+    return store
+
+
+def add_courses(store: FakeVectorStore, course_ids: List[int], category: Optional[str] = None):
+    """批量写入课程（名称按课程ID生成）"""
+    for course_id in course_ids:
+        store.put(course_id, f"课程{course_id}进阶", category or "后端开发 > Java")
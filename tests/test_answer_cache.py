@@ -0,0 +1,30 @@
+"""
+语义回答缓存：按分组键（画像指纹, 知识库代次, 模型）隔离，组内按相似度命中
+"""
+from agent.answer_cache import SemanticAnswerCache
+
+
+KEY = ("fingerprint", "generation-1", "model")
+
+
+def test_lookup_hits_similar_query_in_same_group():
+    cache = SemanticAnswerCache(similarity_threshold=0.9, ttl_seconds=60, max_entries=10, max_bytes=1 << 20)
+    cache.store("Java多线程学不懂怎么办", [1.0, 0.0, 0.0], KEY, "推荐《Java并发编程》")
+    
+    assert cache.lookup([0.99, 0.05, 0.0], KEY) == "推荐《Java并发编程》"
+    assert cache.lookup([0.0, 1.0, 0.0], KEY) is None
+    # 画像指纹或知识库代次变化后不再命中
+    assert cache.lookup([1.0, 0.0, 0.0], ("fingerprint", "generation-2", "model")) is None
+    assert cache.lookup([1.0, 0.0, 0.0], ("other", "generation-1", "model")) is None
+    assert cache.snapshot()["hits"] == 1
+
+
+def test_explicit_zero_limits_are_honoured():
+    cache = SemanticAnswerCache(similarity_threshold=0.9, ttl_seconds=60, max_entries=0, max_bytes=1 << 20)
+    cache.store("问题", [1.0, 0.0], KEY, "回答")
+    assert cache.lookup([1.0, 0.0], KEY) is None
+    assert cache.snapshot()["entries"] == 0
+    
+    cache = SemanticAnswerCache(similarity_threshold=0.0, ttl_seconds=60, max_entries=10, max_bytes=1 << 20)
+    cache.store("问题", [1.0, 0.0], KEY, "回答")
+    assert cache.lookup([0.1, 1.0], KEY) == "回答"
@@ -0,0 +1,85 @@
+"""
+批量推荐检查点：断点续跑、文件锁
+"""
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from config import settings
+from services.batch_recommend import BatchCheckpoint, BatchJobRunningError, BatchRecommender
+
+
+@pytest.fixture
+def recommender(tmp_path, monkeypatch):
+    """检查点写入临时目录、每批2个用户、打分被替换为记录调用的假实现"""
+    monkeypatch.setattr(settings, "batch_recommend_checkpoint_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "candidate_batch_size", 2)
+    recommender = BatchRecommender(SimpleNamespace(vector_store=None, top_n=10))
+    recommender.calls = []
+    
+    async def recommend_batch(user_ids, top_k, with_reason):
+        recommender.calls.append(list(user_ids))
+        rows = [{"user_id": user_id, "source": "profile", "courses": []} for user_id in user_ids if user_id != 3]
+        failed = [{"user_id": 3, "error": "获取用户课表失败"}] if 3 in user_ids else []
+        return rows, failed
+    
+    recommender._recommend_batch = recommend_batch
+    return recommender
+
+
+async def collect(generator, stop_after=None):
+    """收集输出行，stop_after 指定时读到该数量的用户行后中断任务"""
+    lines = []
+    async for line in generator:
+        lines.append(line)
+        if stop_after is not None and sum("user_id" in item for item in lines) >= stop_after:
+            await generator.aclose()
+            break
+    return lines
+
+
+def test_run_resumes_from_checkpoint(recommender):
+    lines = asyncio.run(collect(recommender.run([1, 2, 3, 4, 5], job_id="job"), stop_after=2))
+    assert lines[0] == {"job_id": "job", "users": 5, "resumed": 0}
+    assert recommender.calls == [[1, 2]]
+    
+    # 中断后锁已释放，用相同的任务ID续跑只处理剩余的用户
+    recommender.calls.clear()
+    lines = asyncio.run(collect(recommender.run([1, 2, 3, 4, 5], job_id="job")))
+    assert lines[0] == {"job_id": "job", "users": 5, "resumed": 2}
+    assert recommender.calls == [[3, 4], [5]]
+    assert lines[-1]["done"] and lines[-1]["failed"] == 1 and lines[-1]["profile"] == 2
+    
+    # 失败的用户不写入检查点，再次续跑时重试
+    recommender.calls.clear()
+    lines = asyncio.run(collect(recommender.run([1, 2, 3, 4, 5], job_id="job")))
+    assert lines[0]["resumed"] == 4
+    assert recommender.calls == [[3]]
+
+
+def test_completed_user_ids_skips_truncated_line(tmp_path):
+    checkpoint = BatchCheckpoint("job", str(tmp_path))
+    checkpoint.append([{"user_id": 1}, {"user_id": 2}])
+    with open(checkpoint.path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"user_id": 3})[:8])
+    assert checkpoint.completed_user_ids() == {1, 2}
+
+
+def test_try_lock_is_exclusive_until_unlock(tmp_path):
+    first = BatchCheckpoint("job", str(tmp_path))
+    second = BatchCheckpoint("job", str(tmp_path))
+    assert first.try_lock()
+    assert not second.try_lock()
+    first.unlock()
+    assert second.try_lock()
+    second.unlock()
+
+
+def test_start_rejects_running_job(recommender):
+    checkpoint = recommender.start("job")
+    with pytest.raises(BatchJobRunningError):
+        recommender.start("job")
+    checkpoint.unlock()
+    recommender.start("job").unlock()
@@ -0,0 +1,37 @@
+"""
+分类索引的增量更新
+
+全量同步可能由另一个实例重建索引文件（如 /sync 新建的 DataSyncService），
+长期存在的增量同步实例更新前必须先加载最新文件，不能用旧的内存副本覆盖。
+"""
+from conftest import add_courses
+from rag.category_index import CategoryIndex
+
+
+def test_category_index_update_after_rebuild_by_other_instance(tmp_path, vector_store):
+    path = str(tmp_path / "category_index.json")
+    long_lived = CategoryIndex(path)
+    long_lived.build(vector_store)
+    assert long_lived.size == 1
+    
+    # 另一个实例全量重建
+    add_courses(vector_store, [2, 3, 4, 5])
+    assert CategoryIndex(path).build(vector_store) == 5
+    
+    # 随后的增量事件：在重建后的文件基础上更新
+    add_courses(vector_store, [6])
+    long_lived.update(vector_store, [6])
+    assert long_lived.size == 6
+    assert CategoryIndex(path).size == 6
+
+
+def test_category_index_update_applies_deletes(tmp_path, vector_store):
+    path = str(tmp_path / "category_index.json")
+    index = CategoryIndex(path)
+    add_courses(vector_store, [2, 3])
+    index.build(vector_store)
+    
+    index.update(vector_store, [], deleted_ids=[2])
+    reloaded = CategoryIndex(path)
+    assert reloaded.size == 2
+    assert {course["id"] for course in reloaded.browse("Java")["courses"]} == {1, 3}
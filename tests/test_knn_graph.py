@@ -0,0 +1,43 @@
+"""
+课程相似度图的增量更新
+
+全量同步可能由另一个实例重建图文件，增量同步实例更新前必须先加载最新文件；
+增量更新的结果应与全量建图一致。
+"""
+from conftest import add_courses
+from rag.knn_graph import CourseKnnGraph
+
+
+def test_knn_graph_update_after_rebuild_by_other_instance(tmp_path, vector_store):
+    path = str(tmp_path / "knn_graph.npz")
+    k = 2
+    add_courses(vector_store, [2])
+    long_lived = CourseKnnGraph(path, k=k)
+    long_lived.build(vector_store)
+    assert long_lived.size == 2
+    
+    add_courses(vector_store, [3, 4, 5])
+    assert CourseKnnGraph(path, k=k).build(vector_store) == 5
+    
+    add_courses(vector_store, [6])
+    long_lived.update(vector_store, [6])
+    reloaded = CourseKnnGraph(path, k=k)
+    assert reloaded.size == 6
+    assert set(reloaded.similar([6])[6][i][0] for i in range(k)) <= {1, 2, 3, 4, 5}
+
+
+def test_knn_graph_incremental_update_matches_full_build(tmp_path, vector_store):
+    path = str(tmp_path / "knn_graph.npz")
+    add_courses(vector_store, [2, 3, 4, 5])
+    graph = CourseKnnGraph(path, k=3)
+    graph.build(vector_store)
+    
+    add_courses(vector_store, [6, 7])
+    graph.update(vector_store, [6, 7], deleted_ids=[3])
+    
+    vector_store._courses.pop(3)
+    expected = CourseKnnGraph(str(tmp_path / "expected.npz"), k=3)
+    expected.build(vector_store)
+    course_ids = [1, 2, 4, 5, 6, 7]
+    actual = {cid: [n for n, _ in neighbors] for cid, neighbors in graph.similar(course_ids).items()}
+    assert actual == {cid: [n for n, _ in neighbors] for cid, neighbors in expected.similar(course_ids).items()}
@@ -0,0 +1,71 @@
+"""
+LLM调用调度：优先级排队、取消时归还并发许可
+"""
+import asyncio
+from types import SimpleNamespace
+
+from agent.llm_governor import LLMGovernor, llm_priority
+
+
+MESSAGES = [SimpleNamespace(content="你好")]
+
+
+def make_governor():
+    return LLMGovernor(max_concurrency=1, requests_per_minute=0, tokens_per_minute=0)
+
+
+async def hold(governor):
+    """占住唯一的并发许可，返回 (调用任务, 放行事件)"""
+    gate = asyncio.Event()
+    task = asyncio.create_task(governor.call(gate.wait, MESSAGES))
+    await asyncio.sleep(0)
+    return task, gate
+
+
+def test_interactive_calls_run_before_queued_batch_calls():
+    async def main():
+        governor = make_governor()
+        holder, gate = await hold(governor)
+        order = []
+        
+        async def call(name, priority):
+            async def factory():
+                order.append(name)
+            with llm_priority(priority):
+                await governor.call(factory, MESSAGES)
+        
+        waiters = [asyncio.create_task(call("batch", "batch"))]
+        await asyncio.sleep(0)
+        waiters.append(asyncio.create_task(call("interactive", "interactive")))
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(holder, *waiters)
+        return order
+    
+    assert asyncio.run(main()) == ["interactive", "batch"]
+
+
+def test_cancel_releases_permit():
+    async def main():
+        governor = make_governor()
+        holder, gate = await hold(governor)
+        
+        # 仍在排队时取消
+        queued = asyncio.create_task(governor.call(lambda: asyncio.sleep(0), MESSAGES))
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.sleep(0)
+        
+        # 刚拿到许可、还没开始调用时取消
+        granted = asyncio.create_task(governor.call(lambda: asyncio.sleep(0), MESSAGES))
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.sleep(0)
+        assert holder.done()
+        granted.cancel()
+        await asyncio.gather(queued, granted, return_exceptions=True)
+        
+        assert governor.snapshot()["active"] == 0
+        return await asyncio.wait_for(governor.call(lambda: asyncio.sleep(0, "ok"), MESSAGES), 1)
+    
+    assert asyncio.run(main()) == "ok"
@@ -0,0 +1,62 @@
+"""
+课程变更事件队列：防抖合并、失败重试
+"""
+import asyncio
+
+from config import settings
+from services.sync_queue import CourseSyncQueue
+
+
+class FakeSyncService:
+    """记录每批同步的课程，fail 中的课程每次同步都失败，flaky 中的课程只失败一次"""
+    
+    def __init__(self, fail=(), flaky=()):
+        self.fail = set(fail)
+        self.flaky = set(flaky)
+        self.batches = []
+    
+    async def sync_courses(self, upsert_ids, deleted_ids):
+        self.batches.append((sorted(upsert_ids), sorted(deleted_ids)))
+        failed = [course_id for course_id in upsert_ids if course_id in self.fail | self.flaky]
+        self.flaky -= set(failed)
+        return {"upserted": len(upsert_ids) - len(failed), "deleted": len(deleted_ids), "failed": len(failed),
+                "failed_ids": failed}
+
+
+def test_events_are_debounced_and_coalesced():
+    async def main():
+        service = FakeSyncService()
+        queue = CourseSyncQueue(service, debounce_seconds=0.05, max_wait_seconds=1.0)
+        queue.start()
+        queue.submit([1, 2])
+        await asyncio.sleep(0.01)
+        queue.submit([2], deleted=True)
+        queue.submit([3])
+        await asyncio.sleep(0.2)
+        await queue.stop()
+        return service, queue
+    
+    service, queue = asyncio.run(main())
+    assert service.batches == [([1, 3], [2])]
+    assert queue.stats["coalesced"] == 1
+
+
+def test_failed_courses_are_retried_with_backoff(monkeypatch):
+    monkeypatch.setattr(settings, "sync_retry_base_seconds", 0.02)
+    monkeypatch.setattr(settings, "sync_max_retries", 2)
+    
+    async def main():
+        service = FakeSyncService(fail=[1], flaky=[2])
+        queue = CourseSyncQueue(service, debounce_seconds=0.01, max_wait_seconds=1.0)
+        queue.start()
+        queue.submit([1, 2, 3])
+        await asyncio.sleep(0.5)
+        await queue.stop()
+        return service, queue
+    
+    service, queue = asyncio.run(main())
+    # 第一次重试：课程1、2；第二次重试：只剩一直失败的课程1，之后放弃
+    assert service.batches == [([1, 2, 3], []), ([1, 2], []), ([1], [])]
+    assert queue.stats["retried"] == 3
+    assert queue.stats["gave_up"] == 1
+    assert queue.pending_count == 0
@@ -0,0 +1,33 @@
+"""
+同步请求暂存：执行完成（ack）之前请求一直保留，无法解析的请求被丢弃
+"""
+from services.sync_spool import SyncSpool
+
+
+def test_requests_stay_pending_until_ack(tmp_path):
+    spool = SyncSpool(str(tmp_path))
+    spool.submit([101, 102])
+    spool.submit_full(force=True)
+    
+    requests = spool.pending()
+    assert [request for _, request in requests] == [
+        {"type": "courses", "course_ids": [101, 102], "deleted": False},
+        {"type": "full", "force": True},
+    ]
+    # 执行失败（未ack）时请求留在目录中，下次重试
+    assert [name for name, _ in spool.pending()] == [name for name, _ in requests]
+    
+    spool.ack(requests[0][0])
+    spool.ack(requests[0][0])
+    assert spool.pending_count() == 1
+    assert spool.stats["drained"] == 1
+
+
+def test_unreadable_request_is_discarded(tmp_path):
+    spool = SyncSpool(str(tmp_path))
+    (tmp_path / "00000000000000000001-1.json").write_text("{", encoding="utf-8")
+    spool.submit([7], deleted=True)
+    
+    assert [request for _, request in spool.pending()] == [{"type": "courses", "course_ids": [7], "deleted": True}]
+    assert spool.pending_count() == 1
+    assert spool.stats["discarded"] == 1
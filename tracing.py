@@ -0,0 +1,334 @@
+"""
+请求追踪：记录单次请求各处理阶段的调用树（span），用于排查某一次慢对话
+
+/metrics 的直方图只能看出整体哪个阶段慢，解释不了某一次对话为什么慢（多跑了几轮LLM？某个工具超时？
+哪次Java调用卡住？）。追踪在请求入口创建根span，之后各模块在阶段边界创建子span，父子关系通过
+上下文变量传递（asyncio 任务创建时复制上下文，并发的工具调用各自挂在同一个父span下）：
+    HTTP POST /chat
+    └── agent
+        ├── answer_cache.key
+        │   └── java GET /lessons/page
+        ├── agent.node
+        │   └── llm.answer
+        ├── agent.tools
+        │   ├── tool.search_courses
+        │   │   ├── embed.query
+        │   │   └── vector_store.query
+        │   └── serialize
+        └── ...
+
+- 请求头带 X-Debug-Trace 时一定追踪，/chat 的响应中附带调用树（流式接口在最后推送 trace 事件）
+- 其余请求按 TRACE_SAMPLE_RATE 抽样；追踪的请求都在响应头中返回 X-Trace-Id
+- 结束的追踪保存在进程内的环形缓冲区（最近 TRACE_BUFFER_SIZE 条），通过 /debug/traces 查看；
+  多进程部署时每个工作进程各自保存，按响应头中的 X-Worker-Pid 到对应进程查看
+- 单次请求最多记录 TRACE_MAX_SPANS 个span（批量推荐等长任务不会无限增长），超出的只计数
+
+没有进行中的追踪时 span() 只读取一次上下文变量，几乎没有开销。线程池中执行的函数不会继承上下文，
+需要挂到当前调用树下时用 bind() 包装。
+
+使用示例：
+    from tracing import span, bind
+    
+    with span("vector_store.query", top_k=5):
+        results = collection.query(...)
+    
+    await loop.run_in_executor(None, bind(vector_store.search), query)
+"""
+import contextvars
+import functools
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+from config import settings
+
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("trace_span", default=None)
+
+# 不追踪的路径前缀（调试和监控接口本身、健康检查）
+_UNTRACED_PREFIXES = ("/debug", "/metrics", "/health")
+
+
+class Span:
+    """调用树中的一个节点"""
+    
+    __slots__ = ("name", "attrs", "trace", "start", "end", "error", "children")
+    
+    def __init__(self, name: str, trace: "Trace", attrs: Dict):
+        """
+        创建span（开始计时）
+        
+        Args:
+            name: 阶段名称
+            trace: 所属的追踪
+            attrs: 附加属性
+        """
+        self.name = name
+        self.attrs = attrs
+        self.trace = trace
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+        self.children: List["Span"] = []
+    
+    def set(self, **attrs):
+        """补充属性（如执行结果、token数）"""
+        self.attrs.update(attrs)
+    
+    def finish(self):
+        """结束计时"""
+        if self.end is None:
+            self.end = time.perf_counter()
+    
+    def to_dict(self, origin: float, now: float) -> Dict:
+        """
+        转换为字典（子span按开始时间排序）
+        
+        Args:
+            origin: 追踪开始时间，各span的 start_ms 相对于它计算
+            now: 当前时间，未结束的span按当前时间计算耗时
+        
+        Returns:
+            {"name", "start_ms", "duration_ms", "attrs", "error", "running", "children"}
+        """
+        end = self.end if self.end is not None else now
+        return {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 2),
+            "duration_ms": round((end - self.start) * 1000, 2),
+            "attrs": self.attrs,
+            "error": self.error,
+            "running": self.end is None,
+            "children": [
+                child.to_dict(origin, now) for child in sorted(self.children, key=lambda child: child.start)
+            ],
+        }
+
+
+class Trace:
+    """一次请求的追踪（根span及其统计）"""
+    
+    def __init__(self, name: str, debug: bool = False, **attrs):
+        """
+        创建追踪
+        
+        Args:
+            name: 根span名称
+            debug: 是否由调试请求头触发（响应中附带调用树）
+            **attrs: 根span的属性
+        """
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started_at = time.time()
+        self.debug = debug
+        self.span_count = 1
+        self.dropped = 0
+        self.root = Span(name, self, attrs)
+    
+    def child(self, parent: Span, name: str, attrs: Dict) -> Optional[Span]:
+        """
+        在父span下创建子span
+        
+        Returns:
+            子span；超过 trace_max_spans 时返回None（只计数）
+        """
+        if self.span_count >= settings.trace_max_spans:
+            self.dropped += 1
+            return None
+        self.span_count += 1
+        child = Span(name, self, attrs)
+        parent.children.append(child)
+        return child
+    
+    @property
+    def duration_ms(self) -> float:
+        """耗时（毫秒），进行中的追踪按当前时间计算"""
+        end = self.root.end if self.root.end is not None else time.perf_counter()
+        return round((end - self.root.start) * 1000, 2)
+    
+    def summary(self) -> Dict:
+        """追踪摘要（列表展示用）"""
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "status": self.root.attrs.get("status"),
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+            "duration_ms": self.duration_ms,
+            "spans": self.span_count,
+            "dropped_spans": self.dropped,
+        }
+    
+    def to_dict(self) -> Dict:
+        """完整调用树"""
+        return {
+            **self.summary(),
+            "pid": os.getpid(),
+            "root": self.root.to_dict(self.root.start, time.perf_counter()),
+        }
+
+
+class TraceBuffer:
+    """最近结束的追踪（环形缓冲区，线程安全）"""
+    
+    def __init__(self, size: int):
+        """
+        初始化缓冲区
+        
+        Args:
+            size: 最多保存的追踪数，超出时丢弃最早的
+        """
+        self._traces: deque = deque(maxlen=size)
+        self._lock = threading.Lock()
+    
+    def add(self, trace: Trace):
+        """保存一条结束的追踪"""
+        with self._lock:
+            self._traces.append(trace)
+    
+    def recent(self, limit: int = 50, min_ms: float = 0.0, name: Optional[str] = None) -> List[Dict]:
+        """
+        按时间倒序列出追踪摘要
+        
+        Args:
+            limit: 最多返回的条数
+            min_ms: 只返回耗时不小于该值的追踪
+            name: 只返回根span名称包含该文本的追踪（如 /chat）
+        
+        Returns:
+            追踪摘要列表
+        """
+        with self._lock:
+            traces = list(self._traces)
+        results = []
+        for trace in reversed(traces):
+            if trace.duration_ms < min_ms or (name and name not in trace.root.name):
+                continue
+            results.append(trace.summary())
+            if len(results) >= limit:
+                break
+        return results
+    
+    def get(self, trace_id: str) -> Optional[Trace]:
+        """按ID查找追踪"""
+        with self._lock:
+            for trace in self._traces:
+                if trace.trace_id == trace_id:
+                    return trace
+        return None
+
+
+TRACES = TraceBuffer(settings.trace_buffer_size)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Optional[Span]]:
+    """
+    在当前span下记录一个子阶段（没有进行中的追踪时不做任何事）
+    
+    Args:
+        name: 阶段名称
+        **attrs: 附加属性
+    
+    Yields:
+        子span（可用 set() 补充属性）；未追踪时为None
+    """
+    parent = _current_span.get()
+    child = parent.trace.child(parent, name, attrs) if parent is not None else None
+    if child is None:
+        yield None
+        return
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = f"{type(e).__name__}: {e}"[:200]
+        raise
+    finally:
+        child.finish()
+        _current_span.reset(token)
+
+
+def current_trace() -> Optional[Trace]:
+    """当前请求的追踪（未追踪时为None）"""
+    current = _current_span.get()
+    return current.trace if current is not None else None
+
+
+def debug_trace() -> Optional[Dict]:
+    """当前请求带调试请求头时返回调用树（请求仍在进行，根span标记为 running），否则返回None"""
+    trace = current_trace()
+    return trace.to_dict() if trace is not None and trace.debug else None
+
+
+def bind(func: Callable) -> Callable:
+    """
+    让线程池中执行的函数挂到当前调用树下（run_in_executor 不会复制上下文）
+    
+    Args:
+        func: 在线程池中执行的函数
+    
+    Returns:
+        在当前上下文副本中执行 func 的函数；未追踪时原样返回
+    """
+    if _current_span.get() is None:
+        return func
+    return functools.partial(contextvars.copy_context().run, func)
+
+
+class TracingMiddleware:
+    """
+    为HTTP请求创建追踪的ASGI中间件
+    
+    带 X-Debug-Trace 请求头的请求一定追踪，其余按 trace_sample_rate 抽样；追踪的请求在响应头中返回
+    X-Trace-Id 和 X-Worker-Pid，结束（流式响应发送完）后存入环形缓冲区。
+    """
+    
+    def __init__(self, app):
+        """
+        初始化中间件
+        
+        Args:
+            app: 被包装的ASGI应用
+        """
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        """处理一次ASGI调用（不追踪的请求直接转发）"""
+        if scope["type"] != "http" or not settings.trace_enabled or scope["path"].startswith(_UNTRACED_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+        debug = any(key == b"x-debug-trace" for key, _ in scope["headers"])
+        if not debug and random.random() >= settings.trace_sample_rate:
+            await self.app(scope, receive, send)
+            return
+        
+        trace = Trace(f"HTTP {scope['method']} {scope['path']}", debug=debug)
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                trace.root.set(status=message["status"])
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"x-trace-id", trace.trace_id.encode()),
+                    (b"x-worker-pid", str(os.getpid()).encode()),
+                ]
+            await send(message)
+        
+        token = _current_span.set(trace.root)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            trace.root.error = f"{type(e).__name__}: {e}"[:200]
+            raise
+        finally:
+            _current_span.reset(token)
+            # 按路由模板命名，便于按接口筛选（路径中的ID放到属性里）
+            route = scope.get("route")
+            if route is not None:
+                trace.root.name = f"HTTP {scope['method']} {route.path}"
+                trace.root.set(path=scope["path"])
+            trace.root.finish()
+            TRACES.add(trace)